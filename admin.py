@@ -1,26 +1,13 @@
 from fastapi import APIRouter, HTTPException
-import psycopg2
 from datetime import date
+from database import get_db_connection, get_pool_stats
+import ws_hub
 
 router = APIRouter(
     prefix="/api/admin",
     tags=["Admin Dashboard"]
 )
 
-# 🔥 Usamos exactamente la misma conexión cruda que en tu chats.py
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        return conn
-    except Exception as e:
-        print(f"Error al conectar a la base de datos en admin: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
-
 # 1. RUTA PARA LAS MÉTRICAS EN VIVO (Dashboard)
 @router.get("/metricas")
 def obtener_metricas():
@@ -156,4 +143,15 @@ def obtener_bloqueos():
         raise HTTPException(status_code=500, detail="Error al cargar bloqueos")
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# 5. RUTA PARA MONITOREAR EL POOL DE CONEXIONES
+@router.get("/db-pool")
+def obtener_estado_pool():
+    return get_pool_stats()
+
+# 6. RUTA PARA MONITOREAR LOS WEBSOCKETS (por worker: cada proceso tiene sus propios sockets)
+# async: las estadísticas se leen en el hilo del event loop, el mismo que muta los hubs
+@router.get("/websockets")
+async def obtener_estado_websockets():
+    return ws_hub.estadisticas()
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Request, HTTPException, Form
 from fastapi.responses import RedirectResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import database
 import jwt
 from jwt.algorithms import RSAAlgorithm
 import json
@@ -22,21 +23,12 @@ APPLE_CLIENT_ID_WEB = "com.prendiax.web.service"
 APPLE_BUNDLE_ID_IOS = "com.prendiax.app" 
 APPLE_PRIVATE_KEY_FILE = "AuthKey_YFNS7NW42N.p8"
 
-# 🔴 CONFIGURACIÓN DB
-DB_CONFIG = {
-    "database": "prendia_db",
-    "user": "postgres",
-    "password": "Elbicho7",
-    "host": "localhost",
-    "port": "5432"
-}
-
 # ==========================================
 # 🧠 LÓGICA DE FUSIÓN Y BASE DE DATOS
 # ==========================================
 
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
+    return database.get_db_connection(cursor_factory=RealDictCursor)
 
 def process_unified_login(apple_sub, email, name, tipo, user_agent):
     """
@@ -170,7 +162,7 @@ class AppleLoginAppModel(BaseModel):
     user_agent: Optional[str] = "App Movil"
 
 @router.post("/api/auth/apple/ios")
-async def login_apple_ios(data: AppleLoginAppModel):
+def login_apple_ios(data: AppleLoginAppModel):
     print("=======================================")
     print(f"[APPLE APP] Procesando login...")
     print(f"TOKEN RECIBIDO: '{data.identityToken}'")
@@ -252,7 +244,7 @@ async def login_apple_web_callback(request: Request):
 
         # Validar Token
         header = jwt.get_unverified_header(id_token_str)
-        public_key = get_apple_public_key(header['kid'])
+        public_key = await run_in_threadpool(get_apple_public_key, header['kid'])
         
         decoded = jwt.decode(id_token_str, public_key, algorithms=['RS256'], audience=APPLE_CLIENT_ID_WEB)
         
@@ -267,7 +259,7 @@ async def login_apple_web_callback(request: Request):
             except: pass
 
         # Ejecutamos la lógica central
-        result = process_unified_login(apple_sub, email, name, tipo_recuperado, "Web Browser")
+        result = await database.run_db(process_unified_login, apple_sub, email, name, tipo_recuperado, "Web Browser")
         
         # Guardamos sesión (Cookies para Web)
         request.session['user'] = {
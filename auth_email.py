@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Request, HTTPException, Form
 from fastapi.responses import JSONResponse, RedirectResponse  # <--- IMPORTANTE: RedirectResponse
 from pydantic import BaseModel
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import database
 import bcrypt
 import os
 from dotenv import load_dotenv
@@ -36,19 +36,8 @@ class RegisterRequestApp(BaseModel):
 # ==========================================
 
 def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            database=os.getenv("DB_NAME", "prendia_db"),
-            user=os.getenv("DB_USER", "prendiax_user"),
-            password=os.getenv("DB_PASSWORD", "Elbicho7"),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432"),
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except Exception as e:
-        print(f"[ERROR] DB Connection: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a BD")
+    # Conexión del pool compartido, con cursores tipo diccionario para este router
+    return database.get_db_connection(cursor_factory=RealDictCursor)
 
 async def verify_recaptcha(token: str, ip: str) -> bool:
     try:
@@ -102,40 +91,32 @@ def log_failed_attempt(email: str, ip: str, conn):
         conn.rollback()
         print(f"[ERROR] Failed attempt log: {e}")
 
-@email_router.post("/auth/email")
-async def login_via_email(
-    request: Request,
-    email: str = Form(...),
-    password: str = Form(...),
-    tipo: str = Form("emprendedor"),
-    target: str = Form("perfil"),
-    g_recaptcha_response: str = Form(..., alias="g-recaptcha-response")
-):
-    # --- CORRECCIÓN AQUÍ: Cambiamos "/" por "/login" ---
-    # Así te regresa al formulario de login para mostrarte el mensaje rojo
-    error_url = f"/login?tipo={tipo}&target={target}&error=" 
+# --- Trabajo de BD de las rutas web (corre en el executor de BD vía run_db) ---
 
+def _registrar_intento_fallido(email: str, ip: str):
+    conn = get_db_connection()
     try:
-        ip_address = request.client.host
-        user_agent = request.headers.get("user-agent")
-        
-        # 1. Validar Captcha
-        if not await verify_recaptcha(g_recaptcha_response, ip_address):
-            conn = get_db_connection()
-            log_failed_attempt(email, ip_address, conn)
-            conn.close()
-            return RedirectResponse(url=error_url + "captcha_failed", status_code=303)
+        log_failed_attempt(email, ip, conn)
+    finally:
+        conn.close()
 
-        conn = get_db_connection()
-        
+def _ip_bloqueada(ip: str) -> bool:
+    conn = get_db_connection()
+    try:
+        return is_ip_blocked(ip, conn)
+    finally:
+        conn.close()
+
+def _autenticar_email(email: str, password: str, ip_address: str, user_agent: str):
+    """Devuelve (codigo_error, None) o (None, usuario) con el flag tiene_datos."""
+    conn = get_db_connection()
+    try:
         # Validaciones de seguridad
         if is_ip_blocked(ip_address, conn):
-            conn.close()
-            return RedirectResponse(url=error_url + "ip_blocked", status_code=303)
-            
+            return "ip_blocked", None
+
         if is_user_quarantined(email, conn):
-            conn.close()
-            return RedirectResponse(url=error_url + "quarantined", status_code=303)
+            return "quarantined", None
 
         try:
             cursor = conn.cursor()
@@ -145,8 +126,7 @@ async def login_via_email(
             # 2. Verificar Usuario y Contraseña
             if not user or not user["password"] or not bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
                 log_failed_attempt(email, ip_address, conn)
-                # Regresamos al /login con el error en la URL
-                return RedirectResponse(url=error_url + "invalid_credentials", status_code=303)
+                return "invalid_credentials", None
 
             # Actualizar datos técnicos
             cursor.execute(
@@ -155,28 +135,87 @@ async def login_via_email(
             )
             conn.commit()
 
-            # Redirección de Éxito
             cursor.execute("SELECT 1 FROM datos_usuario WHERE user_id = %s;", (user["id"],))
             tiene_datos = cursor.fetchone() is not None
-            
-            redirect_url = "/perfil-especifico" if tipo == "explorador" else ("/perfil" if tiene_datos else "/dashboard")
-
-            # Guardar sesión
-            request.session["user"] = {
-                "id": user["id"],
-                "email": email,
-                "nombre": user["nombre"],
-                "tipo": tipo
-            }
-
-            return RedirectResponse(url=redirect_url, status_code=303)
+            return None, {"id": user["id"], "nombre": user["nombre"], "tiene_datos": tiene_datos}
 
         except Exception as e:
             conn.rollback()
             print(f"[ERROR SQL LOGIN] {traceback.format_exc()}")
-            return RedirectResponse(url=error_url + "auth_failed", status_code=303)
-        finally:
-            conn.close()
+            return "auth_failed", None
+    finally:
+        conn.close()
+
+def _crear_usuario_email(nombre: str, email: str, password: str, ip_address: str, user_agent: str):
+    """Devuelve (codigo_error, None) o (None, user_id)."""
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
+        if cursor.fetchone():
+            return "email_exists", None
+
+        cursor.execute(
+            """
+            INSERT INTO usuarios (nombre, email, password, ip_address, user_agent, verified, created_at)
+            VALUES (%s, %s, %s, %s, %s, TRUE, NOW())
+            RETURNING id
+            """,
+            (nombre, email, hashed, ip_address, user_agent)
+        )
+        user_id = cursor.fetchone()["id"]
+        conn.commit()
+        return None, user_id
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR SQL REGISTRO] {traceback.format_exc()}")
+        return "auth_failed", None
+    finally:
+        conn.close()
+
+
+@email_router.post("/auth/email")
+async def login_via_email(
+    request: Request,
+    email: str = Form(...),
+    password: str = Form(...),
+    tipo: str = Form("emprendedor"),
+    target: str = Form("perfil"),
+    g_recaptcha_response: str = Form(..., alias="g-recaptcha-response")
+):
+    # --- CORRECCIÓN AQUÍ: Cambiamos "/" por "/login" ---
+    # Así te regresa al formulario de login para mostrarte el mensaje rojo
+    error_url = f"/login?tipo={tipo}&target={target}&error=" 
+
+    try:
+        ip_address = request.client.host
+        user_agent = request.headers.get("user-agent")
+        
+        # 1. Validar Captcha
+        if not await verify_recaptcha(g_recaptcha_response, ip_address):
+            await database.run_db(_registrar_intento_fallido, email, ip_address)
+            return RedirectResponse(url=error_url + "captcha_failed", status_code=303)
+
+        error, user = await database.run_db(_autenticar_email, email, password, ip_address, user_agent)
+        if error:
+            # Regresamos al /login con el error en la URL
+            return RedirectResponse(url=error_url + error, status_code=303)
+
+        # Redirección de Éxito
+        redirect_url = "/perfil-especifico" if tipo == "explorador" else ("/perfil" if user["tiene_datos"] else "/dashboard")
+
+        # Guardar sesión
+        request.session["user"] = {
+            "id": user["id"],
+            "email": email,
+            "nombre": user["nombre"],
+            "tipo": tipo
+        }
+
+        return RedirectResponse(url=redirect_url, status_code=303)
 
     except Exception as e:
         print(f"[ERROR GENERAL LOGIN] {traceback.format_exc()}")
@@ -201,51 +240,25 @@ async def register_via_email(
         ip_address = request.client.host
         user_agent = request.headers.get("user-agent")
 
-        conn = get_db_connection()
-
-        if is_ip_blocked(ip_address, conn):
-            conn.close()
+        if await database.run_db(_ip_bloqueada, ip_address):
             return RedirectResponse(url=error_url + "ip_blocked", status_code=303)
 
         if not await verify_recaptcha(g_recaptcha_response, ip_address):
-            conn.close()
             return RedirectResponse(url=error_url + "captcha_failed", status_code=303)
 
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        error, user_id = await database.run_db(_crear_usuario_email, nombre, email, password, ip_address, user_agent)
+        if error:
+            return RedirectResponse(url=error_url + error, status_code=303)
 
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
-            if cursor.fetchone():
-                return RedirectResponse(url=error_url + "email_exists", status_code=303)
-
-            cursor.execute(
-                """
-                INSERT INTO usuarios (nombre, email, password, ip_address, user_agent, verified, created_at)
-                VALUES (%s, %s, %s, %s, %s, TRUE, NOW())
-                RETURNING id
-                """,
-                (nombre, email, hashed, ip_address, user_agent)
-            )
-            user_id = cursor.fetchone()["id"]
-            conn.commit()
+        redirect_url = "/perfil-especifico" if tipo == "explorador" else "/dashboard"
 
-            redirect_url = "/perfil-especifico" if tipo == "explorador" else "/dashboard"
-
-            request.session["user"] = {
-                "id": user_id,
-                "email": email,
-                "nombre": nombre,
-                "tipo": tipo
-            }
-            return RedirectResponse(url=redirect_url, status_code=303)
-
-        except Exception as e:
-            conn.rollback()
-            print(f"[ERROR SQL REGISTRO] {traceback.format_exc()}")
-            return RedirectResponse(url=error_url + "auth_failed", status_code=303)
-        finally:
-            conn.close()
+        request.session["user"] = {
+            "id": user_id,
+            "email": email,
+            "nombre": nombre,
+            "tipo": tipo
+        }
+        return RedirectResponse(url=redirect_url, status_code=303)
 
     except Exception as e:
         print(f"[ERROR GENERAL REGISTRO] {e}")
@@ -256,7 +269,7 @@ async def register_via_email(
 # ==========================================
 
 @email_router.post("/api/auth/email")
-async def login_via_email_app(datos: LoginRequestApp):
+def login_via_email_app(datos: LoginRequestApp):
     # ... (Tu código de app sigue igual, responde JSON para Flutter)
     print(f"[APP LOGIN] Iniciando sesión para: {datos.email}")
     conn = get_db_connection()
@@ -306,7 +319,7 @@ async def login_via_email_app(datos: LoginRequestApp):
         conn.close()
 
 @email_router.post("/api/auth/register")
-async def register_via_email_app(datos: RegisterRequestApp):
+def register_via_email_app(datos: RegisterRequestApp):
     # ... (Tu código de app sigue igual)
     conn = get_db_connection()
     try:
@@ -349,7 +362,7 @@ async def register_via_email_app(datos: RegisterRequestApp):
         conn.close()
 
 @email_router.get("/api/auth/current_user")
-async def get_current_user_api(request: Request):
+def get_current_user_api(request: Request):
     # ... (Tu código mixto sigue igual)
     conn = None
     try:
@@ -4,8 +4,8 @@ from pydantic import BaseModel  # <--- ESTO ES LO CORRECTO import BaseModel
 from authlib.integrations.starlette_client import OAuth
 from google.auth.transport.requests import Request as GoogleRequest
 from google.oauth2 import id_token
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import database
 from typing import Optional
 import os
 
@@ -17,14 +17,7 @@ router = APIRouter()
 
 # 🔧 Conexión a la base de datos
 def get_db_connection():
-    return psycopg2.connect(
-        database="prendia_db",
-        user="postgres",
-        password="Elbicho7", 
-        host="localhost",
-        port="5432",
-        cursor_factory=RealDictCursor
-    )
+    return database.get_db_connection(cursor_factory=RealDictCursor)
 
 # 🔐 Configurar OAuth con Google (PARA FLUJO WEB)
 oauth = OAuth()
@@ -57,7 +50,7 @@ class GoogleLoginApp(BaseModel):
     user_agent: Optional[str] = None
 
 @router.post("/api/auth/google")
-async def google_login_app(data: GoogleLoginApp):
+def google_login_app(data: GoogleLoginApp):
     print(f"[GOOGLE APP] Recibiendo login desde App...")
     
     try:
@@ -183,6 +176,43 @@ async def login_via_google(request: Request):
     request.session["target"] = target
     return await oauth.google.authorize_redirect(request, redirect_uri)
 
+def _registrar_usuario_google(email, name, tipo):
+    """Crea o actualiza el usuario de Google y decide a dónde redirigirlo (corre en el executor de BD)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Verificar usuario
+        cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
+        user_db = cursor.fetchone()
+
+        if user_db:
+            user_id = user_db["id"]
+            # Actualizar nombre si es necesario
+            cursor.execute("UPDATE usuarios SET nombre = %s WHERE id = %s", (name, user_id))
+        else:
+            cursor.execute(
+                "INSERT INTO usuarios (nombre, email, verified, created_at) VALUES (%s, %s, TRUE, NOW()) RETURNING id",
+                (name, email)
+            )
+            user_id = cursor.fetchone()["id"]
+
+        conn.commit()
+
+        # Redirección Web
+        if tipo == "explorador":
+            cursor.execute("DELETE FROM datos_usuario WHERE user_id = %s;", (user_id,))
+            conn.commit()
+            return user_id, "/perfil-especifico"
+
+        cursor.execute("SELECT 1 FROM datos_usuario WHERE user_id = %s;", (user_id,))
+        if cursor.fetchone():
+            return user_id, "/perfil"
+        return user_id, "/dashboard"
+
+    finally:
+        cursor.close()
+        conn.close()
+
 @router.get("/auth/google/callback")
 async def auth_google_callback(request: Request):
     try:
@@ -196,50 +226,18 @@ async def auth_google_callback(request: Request):
         if not email:
             return RedirectResponse(url="/login?error=no_email", status_code=302)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            # Verificar usuario
-            cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
-            user_db = cursor.fetchone()
-
-            if user_db:
-                user_id = user_db["id"]
-                # Actualizar nombre si es necesario
-                cursor.execute("UPDATE usuarios SET nombre = %s WHERE id = %s", (name, user_id))
-            else:
-                cursor.execute(
-                    "INSERT INTO usuarios (nombre, email, verified, created_at) VALUES (%s, %s, TRUE, NOW()) RETURNING id",
-                    (name, email)
-                )
-                user_id = cursor.fetchone()["id"]
-
-            conn.commit()
-
-            # Guardar en Sesión Web
-            tipo = request.session.get("tipo", "emprendedor")
-            request.session['user'] = {
-                "id": user_id,
-                "email": email,
-                "name": name,
-                "tipo": tipo
-            }
+        tipo = request.session.get("tipo", "emprendedor")
+        user_id, destino = await database.run_db(_registrar_usuario_google, email, name, tipo)
 
-            # Redirección Web
-            if tipo == "explorador":
-                cursor.execute("DELETE FROM datos_usuario WHERE user_id = %s;", (user_id,))
-                conn.commit()
-                return RedirectResponse(url="/perfil-especifico", status_code=302)
+        # Guardar en Sesión Web
+        request.session['user'] = {
+            "id": user_id,
+            "email": email,
+            "name": name,
+            "tipo": tipo
+        }
 
-            cursor.execute("SELECT 1 FROM datos_usuario WHERE user_id = %s;", (user_id,))
-            if cursor.fetchone():
-                return RedirectResponse(url="/perfil", status_code=302)
-            else:
-                return RedirectResponse(url="/dashboard", status_code=302)
-
-        finally:
-            cursor.close()
-            conn.close()
+        return RedirectResponse(url=destino, status_code=302)
 
     except Exception as e:
         print(f"[ERROR WEB] Google Callback: {e}")
@@ -250,7 +248,7 @@ async def auth_google_callback(request: Request):
 # ==========================================
 
 @router.get("/perfil", response_class=HTMLResponse)
-async def redireccionar_a_perfil(request: Request):
+def redireccionar_a_perfil(request: Request):
     if "user" not in request.session:
         tipo = request.query_params.get("tipo", "emprendedor")
         target = "perfil-especifico" if tipo == "explorador" else "perfil"
@@ -284,7 +282,7 @@ async def get_current_user(request: Request):
     }
 
 @router.get("/perfil-especifico", response_class=HTMLResponse)
-async def perfil_especifico(request: Request):
+def perfil_especifico(request: Request):
     if 'user' not in request.session:
         return RedirectResponse(url="/login?tipo=explorador&target=perfil-especifico", status_code=302)
     
@@ -313,19 +311,10 @@ async def dashboard(request: Request):
     except:
         return HTMLResponse("Error loading dashboard", status_code=500)
 
-@router.post("/dashboard")
-async def save_dashboard(request: Request):
-    if "user" not in request.session:
-        return RedirectResponse(url="/login", status_code=302)
-    
-    user_id = request.session["user"]["id"]
+def _guardar_dashboard(user_id, nombre_empresa, descripcion):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        form_data = await request.form()
-        nombre_empresa = form_data.get("nombre_empresa")
-        descripcion = form_data.get("descripcion")
-        
         cursor.execute(
             """
             INSERT INTO datos_usuario (user_id, nombre_empresa, descripcion)
@@ -337,14 +326,29 @@ async def save_dashboard(request: Request):
             (user_id, nombre_empresa, descripcion)
         )
         conn.commit()
-        return RedirectResponse(url="/perfil", status_code=303)
     except:
         conn.rollback()
-        return HTMLResponse("Error guardando datos", status_code=500)
+        raise
     finally:
         cursor.close()
         conn.close()
 
+@router.post("/dashboard")
+async def save_dashboard(request: Request):
+    if "user" not in request.session:
+        return RedirectResponse(url="/login", status_code=302)
+    
+    user_id = request.session["user"]["id"]
+    try:
+        form_data = await request.form()
+        nombre_empresa = form_data.get("nombre_empresa")
+        descripcion = form_data.get("descripcion")
+        
+        await database.run_db(_guardar_dashboard, user_id, nombre_empresa, descripcion)
+        return RedirectResponse(url="/perfil", status_code=303)
+    except:
+        return HTMLResponse("Error guardando datos", status_code=500)
+
 @router.get("/logout")
 @router.post("/logout")
 async def logout(request: Request):
@@ -0,0 +1,576 @@
+"""
+Benchmarks de carga contra una instancia corriendo de PrendiaX.
+
+Uso:
+    python benchmark.py feed-ws --url http://localhost:8000 --user-id 1 --ws 200 --requests 500
+    python benchmark.py media-memoria --ruta /media/123 --viewers 50 --pid <pid del worker>
+    python benchmark.py busqueda --dsn postgresql://localhost/prendiax_bench --poblar 1000000
+    python benchmark.py correo --correos 2000 --conexiones 1,3,5 --latencia 20
+    python benchmark.py ws-workers --url-envio http://localhost:8000 --url-ws http://localhost:8001 --emisor 1 --receptor 2
+    python benchmark.py chat-envio --url http://localhost:8000 --emisor 1 --receptor 2 --mensajes 5000 --concurrencia 50
+    python benchmark.py feed-paginas --url http://localhost:8000 --user-id 1 --limit 10
+
+Cada subcomando imprime percentiles de latencia. Para comparar antes/después de un cambio,
+corre el mismo comando contra ambas versiones del servidor con la misma base de datos.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import httpx
+import psycopg2
+
+from busqueda_sql import FILTRO_BUSQUEDA, RELEVANCIA_BUSQUEDA, tsquery_busqueda
+
+try:
+    import websockets
+except ImportError:  # solo se necesita para los benchmarks con WebSockets
+    websockets = None
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # solo se necesita para el benchmark de correo (servidor SMTP local)
+    Controller = None
+
+
+def percentiles(muestras_ms):
+    if not muestras_ms:
+        return {"n": 0}
+    datos = sorted(muestras_ms)
+
+    def p(q):
+        return round(datos[min(len(datos) - 1, int(len(datos) * q))], 2)
+
+    return {
+        "n": len(datos),
+        "p50": p(0.50),
+        "p95": p(0.95),
+        "p99": p(0.99),
+        "max": round(datos[-1], 2),
+        "promedio": round(statistics.fmean(datos), 2),
+    }
+
+
+def imprimir(titulo, resultado):
+    print(f"{titulo}: " + json.dumps(resultado, ensure_ascii=False))
+
+
+def _ws_url(base_url, path):
+    return base_url.replace("https://", "wss://").replace("http://", "ws://").rstrip("/") + path
+
+
+def _headers(user_id):
+    # get_user_id_hybrid acepta el token legado "jwt_app_<id>" cuando no es un JWT válido
+    return {"Authorization": f"Bearer jwt_app_{user_id}"}
+
+
+# ==========================================
+# feed-ws: latencia de /feed con tráfico WebSocket en paralelo
+# ==========================================
+
+async def _cliente_chat_ws(url, rtts_ms, parar):
+    """Mantiene un WS de chats y mide el round-trip del ping: si el event loop se congela, sube."""
+    try:
+        async with websockets.connect(url, open_timeout=10) as ws:
+            while not parar.is_set():
+                inicio = time.perf_counter()
+                await ws.send("ping")
+                await ws.recv()
+                rtts_ms.append((time.perf_counter() - inicio) * 1000)
+                await asyncio.sleep(0.2)
+    except Exception as e:
+        print(f"[WS chats] {e}", file=sys.stderr)
+
+
+async def _cliente_notif_ws(url, parar):
+    """WS de notificaciones: solo se mantiene abierto, como lo hace la app."""
+    try:
+        async with websockets.connect(url, open_timeout=10) as ws:
+            while not parar.is_set():
+                await ws.send("ping")
+                await asyncio.sleep(1)
+    except Exception as e:
+        print(f"[WS notificaciones] {e}", file=sys.stderr)
+
+
+async def feed_ws(args):
+    if websockets is None:
+        sys.exit("Este benchmark necesita el paquete 'websockets' (pip install websockets)")
+
+    parar = asyncio.Event()
+    rtts_ms = []
+    clientes_ws = []
+    for i in range(args.ws):
+        if i % 2 == 0:
+            url = _ws_url(args.url, f"/chats/ws/{args.user_id}")
+            clientes_ws.append(asyncio.create_task(_cliente_chat_ws(url, rtts_ms, parar)))
+        else:
+            url = _ws_url(args.url, f"/notificaciones/ws/{args.user_id}")
+            clientes_ws.append(asyncio.create_task(_cliente_notif_ws(url, parar)))
+    await asyncio.sleep(1)  # dejar que los sockets terminen el handshake
+
+    latencias_ms = []
+    errores = 0
+    limite = asyncio.Semaphore(args.concurrencia)
+    limits = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+
+    async with httpx.AsyncClient(base_url=args.url, headers=_headers(args.user_id), limits=limits, timeout=60) as client:
+        async def una_peticion(i):
+            nonlocal errores
+            async with limite:
+                inicio = time.perf_counter()
+                try:
+                    r = await client.get("/feed", params={"limit": args.limit, "offset": (i % 10) * args.limit})
+                    if r.status_code != 200:
+                        errores += 1
+                        return
+                except httpx.HTTPError:
+                    errores += 1
+                    return
+                latencias_ms.append((time.perf_counter() - inicio) * 1000)
+
+        inicio_total = time.perf_counter()
+        await asyncio.gather(*(una_peticion(i) for i in range(args.requests)))
+        duracion = time.perf_counter() - inicio_total
+
+    parar.set()
+    await asyncio.gather(*clientes_ws, return_exceptions=True)
+
+    imprimir("/feed (ms)", percentiles(latencias_ms))
+    imprimir("WS ping (ms)", percentiles(rtts_ms))
+    print(f"errores: {errores}  |  {round(len(latencias_ms) / duracion, 1)} req/s  |  {args.ws} WebSockets abiertos")
+
+
+# ==========================================
+# media-memoria: memoria del servidor por espectador de video concurrente
+# ==========================================
+
+def _rss_kb(pid):
+    """RSS actual del proceso (Linux). Con varios workers de uvicorn, pasar el pid del worker."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def _muestrear_rss(pid, muestras, parar):
+    while not parar.is_set():
+        rss = _rss_kb(pid)
+        if rss is not None:
+            muestras.append(rss)
+        await asyncio.sleep(0.05)
+
+
+async def media_memoria(args):
+    latencias_ms = []
+    errores = 0
+    bytes_recibidos = 0
+    rss_inicial = _rss_kb(args.pid) if args.pid else None
+    muestras_rss = []
+    parar = asyncio.Event()
+    muestreo = asyncio.create_task(_muestrear_rss(args.pid, muestras_rss, parar)) if args.pid else None
+
+    limits = httpx.Limits(max_connections=args.viewers, max_keepalive_connections=args.viewers)
+    async with httpx.AsyncClient(base_url=args.url, headers=_headers(args.user_id), limits=limits, timeout=120) as client:
+        # Primero el tamaño total, como hace un reproductor con "bytes=0-1"
+        r = await client.get(args.ruta, headers={"Range": "bytes=0-1"})
+        if r.status_code != 206 or "content-range" not in r.headers:
+            sys.exit(f"{args.ruta} no respondió 206 a un Range (status {r.status_code})")
+        tamano = int(r.headers["content-range"].split("/")[-1])
+
+        async def espectador(n):
+            nonlocal errores, bytes_recibidos
+            # Cada espectador avanza por el video en ventanas de --rango bytes, empezando en un punto distinto
+            inicio = (n * args.rango) % tamano
+            for _ in range(args.peticiones):
+                fin = min(inicio + args.rango, tamano) - 1
+                t0 = time.perf_counter()
+                try:
+                    resp = await client.get(args.ruta, headers={"Range": f"bytes={inicio}-{fin}"})
+                    if resp.status_code != 206 or len(resp.content) != fin - inicio + 1:
+                        errores += 1
+                    else:
+                        bytes_recibidos += len(resp.content)
+                        latencias_ms.append((time.perf_counter() - t0) * 1000)
+                except httpx.HTTPError:
+                    errores += 1
+                inicio = fin + 1 if fin + 1 < tamano else 0
+
+        inicio_total = time.perf_counter()
+        await asyncio.gather(*(espectador(n) for n in range(args.viewers)))
+        duracion = time.perf_counter() - inicio_total
+
+    parar.set()
+    if muestreo:
+        await muestreo
+
+    imprimir("Range (ms)", percentiles(latencias_ms))
+    print(f"video: {tamano} bytes  |  {args.viewers} espectadores  |  ventana {args.rango} bytes  |  errores: {errores}")
+    print(f"{round(bytes_recibidos / duracion / 1024 / 1024, 1)} MB/s servidos")
+    if rss_inicial is not None and muestras_rss:
+        pico = max(muestras_rss)
+        print(f"RSS inicial {rss_inicial} KB  |  pico {pico} KB  |  "
+              f"~{round((pico - rss_inicial) / args.viewers, 1)} KB por espectador")
+    else:
+        print("(pasa --pid <pid del worker> para medir memoria del servidor)")
+
+
+# ==========================================
+# busqueda: LIKE '%…%' contra texto completo sobre un dataset sintético
+# ==========================================
+
+# Vocabulario con acentos a propósito: la búsqueda nueva debe encontrar "cafe" en "café"
+VOCABULARIO = [
+    "café", "pastelería", "repostería", "pasteles", "zapatos", "tenis", "niños", "ropa", "artesanía", "envío",
+    "domicilio", "tacos", "panadería", "diseño", "uñas", "maquillaje", "reparación", "celulares", "mascotas",
+    "jardinería", "clases", "inglés", "fotografía", "eventos", "flores", "joyería", "muebles", "limpieza",
+    "plomería", "electricista", "comida", "vegana", "económico", "oferta", "descuento", "nuevo", "usado",
+    "calidad", "precio", "pedido", "hoy", "mañana", "gratis", "tienda", "servicio", "cotización", "regalo",
+]
+ETIQUETAS = ["Comida", "Ropa", "Belleza", "Servicios", "Tecnología", "Hogar", "Mascotas", "Educación", "Eventos"]
+
+# Misma forma que search_publicaciones antes y después del cambio (sin filtro de bloqueos)
+SQL_BUSQUEDA_LIKE = """
+    SELECT p.id FROM publicaciones p
+    JOIN usuarios u ON p.user_id = u.id
+    LEFT JOIN datos_usuario du ON p.user_id = du.user_id
+    WHERE LOWER(COALESCE(du.nombre_empresa, u.nombre)) LIKE %(like)s
+       OR EXISTS (SELECT 1 FROM unnest(p.etiquetas) AS etiqueta WHERE LOWER(etiqueta) LIKE %(like)s)
+       OR LOWER(p.contenido) LIKE %(like)s
+    ORDER BY p.fecha_creacion DESC, p.id DESC LIMIT %(limit)s
+"""
+# La misma condición y el mismo orden que /search (busqueda_sql.py); params: tsquery x4 y limit
+SQL_BUSQUEDA_FTS = f"""
+    SELECT p.id, {RELEVANCIA_BUSQUEDA} AS relevancia
+    FROM publicaciones p
+    JOIN usuarios u ON p.user_id = u.id
+    LEFT JOIN datos_usuario du ON p.user_id = du.user_id
+    WHERE {FILTRO_BUSQUEDA}
+    ORDER BY relevancia DESC, p.id DESC LIMIT %s
+"""
+
+
+def _poblar_busqueda(conn, total, usuarios, lote):
+    """Crea `usuarios` autores y `total` publicaciones aleatorias; el trigger de la migración 004 llena busqueda."""
+    cur = conn.cursor()
+    sello = int(time.time())
+    cur.execute("""
+        INSERT INTO usuarios (nombre, email, verified, created_at)
+        SELECT 'Bench ' || g, 'bench-' || %s || '-' || g || '@bench.invalid', TRUE, NOW()
+        FROM generate_series(1, %s) g
+        RETURNING id
+    """, (sello, usuarios))
+    ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+
+    creadas = 0
+    while creadas < total:
+        n = min(lote, total - creadas)
+        # "WHERE g IS NOT NULL" amarra la subconsulta a cada fila para que random() cambie por publicación
+        cur.execute("""
+            INSERT INTO publicaciones (user_id, contenido, etiquetas, fecha_creacion)
+            SELECT %(ids)s[1 + floor(random() * array_length(%(ids)s, 1))::int],
+                   (SELECT string_agg(%(vocab)s[1 + floor(random() * array_length(%(vocab)s, 1))::int], ' ')
+                    FROM generate_series(1, 8 + (g %% 20)) WHERE g IS NOT NULL),
+                   ARRAY[%(tags)s[1 + floor(random() * array_length(%(tags)s, 1))::int]],
+                   NOW() - random() * INTERVAL '365 days'
+            FROM generate_series(1, %(n)s) g
+        """, {"ids": ids, "vocab": VOCABULARIO, "tags": ETIQUETAS, "n": n})
+        conn.commit()
+        creadas += n
+        print(f"  {creadas}/{total} publicaciones", file=sys.stderr)
+
+    cur.execute("ANALYZE publicaciones")
+    conn.commit()
+    cur.close()
+
+
+def _medir(cur, sql, params, repeticiones):
+    tiempos_ms = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        tiempos_ms.append((time.perf_counter() - inicio) * 1000)
+    return tiempos_ms
+
+
+async def busqueda(args):
+    # Solo contra una base aparte: --poblar inserta cientos de miles de filas
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.poblar:
+            print(f"Generando {args.poblar} publicaciones sintéticas...", file=sys.stderr)
+            _poblar_busqueda(conn, args.poblar, args.usuarios, args.lote)
+
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM publicaciones")
+        print(f"publicaciones en la base: {cur.fetchone()[0]}")
+
+        todos_like, todos_fts = [], []
+        for termino in args.terminos.split(","):
+            termino = termino.strip().lower()
+            tsq = tsquery_busqueda(termino)
+            like_ms = _medir(cur, SQL_BUSQUEDA_LIKE, {"like": f"%{termino}%", "limit": args.limit}, args.repeticiones)
+            fts_ms = _medir(cur, SQL_BUSQUEDA_FTS, [tsq] * 4 + [args.limit], args.repeticiones)
+            todos_like += like_ms
+            todos_fts += fts_ms
+            imprimir(f"'{termino}' LIKE (ms)", percentiles(like_ms))
+            imprimir(f"'{termino}' texto completo (ms)", percentiles(fts_ms))
+        cur.close()
+
+        imprimir("TOTAL LIKE (ms)", percentiles(todos_like))
+        imprimir("TOTAL texto completo (ms)", percentiles(todos_fts))
+    finally:
+        conn.close()
+
+
+# ==========================================
+# correo: correos/s de mailer.py contra un SMTP local (aiosmtpd), sin mandar nada de verdad
+# ==========================================
+
+class _SMTPLocal:
+    """Acepta todo y solo cuenta. `latencia_ms` simula lo que tarda un servidor real en responder cada DATA."""
+
+    def __init__(self, latencia_ms):
+        self.latencia = latencia_ms / 1000
+        self.recibidos = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        self.recibidos += 1
+        return "250 OK"
+
+
+async def correo(args):
+    if Controller is None:
+        sys.exit("Instala aiosmtpd para este benchmark: pip install aiosmtpd")
+    import mailer
+
+    handler = _SMTPLocal(args.latencia)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.puerto)
+    controller.start()
+    try:
+        destinatarios = [f"usuario{i}@prueba.local" for i in range(args.correos)]
+        plantilla = mailer.PlantillaCorreo("Benchmark PrendiaX", "<p>" + "Hola " * 200 + "</p>")
+        for conexiones in (int(c) for c in args.conexiones.split(",")):
+            m = mailer.Mailer(conexiones=conexiones, tasa=args.tasa, servidor="127.0.0.1", puerto=args.puerto,
+                              usuario=None, starttls=False, solo_ipv4=False)
+            antes = handler.recibidos
+            metricas = await asyncio.to_thread(m.enviar, plantilla, destinatarios)
+            m.cerrar()
+            imprimir(f"{conexiones} conexiones", {
+                "enviados": metricas["enviados"], "fallas": metricas["fallas"], "recibidos": handler.recibidos - antes,
+                "segundos": metricas["segundos"], "correos_por_segundo": metricas["correos_por_segundo"],
+            })
+    finally:
+        controller.stop()
+
+
+# ==========================================
+# ws-workers: entrega de chat entre dos workers distintos (pubsub.py, LISTEN/NOTIFY)
+# ==========================================
+# Levantar dos instancias contra la misma base, p. ej.:
+#   uvicorn main:app --port 8000 & uvicorn main:app --port 8001 &
+# El receptor se conecta por WebSocket a una y el emisor manda por HTTP a la otra: sin el puente
+# de pubsub los mensajes nunca llegan.
+
+async def ws_workers(args):
+    if websockets is None:
+        sys.exit("Este benchmark necesita el paquete 'websockets' (pip install websockets)")
+
+    latencias_ms = []
+    perdidos = 0
+    async with httpx.AsyncClient(base_url=args.url_envio, headers=_headers(args.emisor), timeout=30) as client:
+        r = await client.post(f"/chats/iniciar/{args.receptor}")
+        r.raise_for_status()
+        chat_id = r.json()["chat_id"]
+
+        url = _ws_url(args.url_ws, f"/chats/ws/{args.receptor}")
+        async with websockets.connect(url, open_timeout=10) as ws:
+            await asyncio.sleep(0.5)  # que el worker del socket ya esté escuchando
+            for i in range(args.mensajes):
+                inicio = time.perf_counter()
+                r = await client.post(f"/chats/{chat_id}/mensaje", data={"contenido": f"benchmark ws-workers {i}"})
+                r.raise_for_status()
+                mensaje_id = r.json()["id"]
+                try:
+                    while True:
+                        evento = json.loads(await asyncio.wait_for(ws.recv(), timeout=args.timeout))
+                        if evento.get("id") == mensaje_id:
+                            latencias_ms.append((time.perf_counter() - inicio) * 1000)
+                            break
+                except asyncio.TimeoutError:
+                    perdidos += 1
+
+    imprimir("Entrega entre workers, envío HTTP -> WebSocket (ms)", percentiles(latencias_ms))
+    print(f"entregados: {len(latencias_ms)} / {args.mensajes}, perdidos: {perdidos}")
+    if perdidos:
+        sys.exit(1)
+
+
+# ==========================================
+# chat-envio: mensajes/s que acepta un worker en POST /chats/{id}/mensaje
+# ==========================================
+# Apuntar --url a un solo worker (no al balanceador) para medir mensajes/s por worker.
+
+async def chat_envio(args):
+    latencias_ms = []
+    errores = 0
+    limite = asyncio.Semaphore(args.concurrencia)
+    limits = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+
+    async with httpx.AsyncClient(base_url=args.url, headers=_headers(args.emisor), limits=limits, timeout=60) as client:
+        r = await client.post(f"/chats/iniciar/{args.receptor}")
+        r.raise_for_status()
+        chat_id = r.json()["chat_id"]
+
+        async def un_mensaje(i):
+            nonlocal errores
+            async with limite:
+                inicio = time.perf_counter()
+                try:
+                    r = await client.post(f"/chats/{chat_id}/mensaje", data={"contenido": f"benchmark chat-envio {i}"})
+                    if r.status_code != 200:
+                        errores += 1
+                        return
+                except httpx.HTTPError:
+                    errores += 1
+                    return
+                latencias_ms.append((time.perf_counter() - inicio) * 1000)
+
+        inicio_total = time.perf_counter()
+        await asyncio.gather(*(un_mensaje(i) for i in range(args.mensajes)))
+        duracion = time.perf_counter() - inicio_total
+
+    imprimir("POST /chats/{id}/mensaje (ms)", percentiles(latencias_ms))
+    print(f"errores: {errores}  |  {round(len(latencias_ms) / duracion, 1)} mensajes/s  |  concurrencia {args.concurrencia}")
+
+
+# ==========================================
+# feed-paginas: recorrer /feed con offset y con cursor da la misma lista, sin huecos ni repetidos
+# ==========================================
+# Sirve como prueba de integración del feed con publicaciones fijadas: marcar algunas (fijada = TRUE)
+# en la base antes de correrlo, idealmente más que --limit para cruzar el borde de página.
+
+async def _paginas_feed(client, limit, maximo, por_cursor):
+    ids, offset, cursor = [], 0, None
+    for _ in range(maximo):
+        params = {"limit": limit}
+        if por_cursor:
+            if cursor:
+                params["cursor"] = cursor
+        else:
+            params["offset"] = offset
+        r = await client.get("/feed", params=params)
+        r.raise_for_status()
+        pagina = [p["id"] for p in r.json()]
+        if len(pagina) > limit:
+            sys.exit(f"/feed devolvió {len(pagina)} publicaciones con limit={limit}")
+        ids.extend(pagina)
+        offset += limit
+        cursor = r.headers.get("X-Next-Cursor")
+        if not pagina or (por_cursor and not cursor):
+            break
+    return ids
+
+
+async def feed_paginas(args):
+    async with httpx.AsyncClient(base_url=args.url, headers=_headers(args.user_id), timeout=30) as client:
+        por_offset = await _paginas_feed(client, args.limit, args.paginas, por_cursor=False)
+        por_cursor = await _paginas_feed(client, args.limit, args.paginas, por_cursor=True)
+
+    fallas = []
+    for nombre, ids in (("offset", por_offset), ("cursor", por_cursor)):
+        repetidos = len(ids) - len(set(ids))
+        if repetidos:
+            fallas.append(f"{nombre}: {repetidos} publicaciones repetidas")
+    if por_offset != por_cursor:
+        faltan = set(por_cursor) - set(por_offset)
+        fallas.append(f"offset y cursor difieren ({len(por_offset)} vs {len(por_cursor)}; {len(faltan)} faltan con offset)")
+    print(f"publicaciones recorridas: offset {len(por_offset)}, cursor {len(por_cursor)}")
+    for falla in fallas:
+        print(f"FALLA {falla}")
+    if fallas:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de carga de PrendiaX")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("feed-ws", help="p50/p95/p99 de /feed con WebSockets activos")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--user-id", type=int, default=1, help="usuario existente con el que se autentica")
+    p.add_argument("--ws", type=int, default=100, help="WebSockets abiertos durante la prueba")
+    p.add_argument("--requests", type=int, default=500)
+    p.add_argument("--concurrencia", type=int, default=50)
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=feed_ws)
+
+    p = sub.add_parser("media-memoria", help="memoria y latencia sirviendo video por Range a espectadores concurrentes")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--ruta", required=True, help="p. ej. /media/123 o /chats/media/456")
+    p.add_argument("--user-id", type=int, default=1)
+    p.add_argument("--viewers", type=int, default=50)
+    p.add_argument("--peticiones", type=int, default=20, help="Range requests por espectador")
+    p.add_argument("--rango", type=int, default=512 * 1024, help="bytes por Range request")
+    p.add_argument("--pid", type=int, help="pid del proceso del servidor para muestrear su RSS")
+    p.set_defaults(func=media_memoria)
+
+    p = sub.add_parser("busqueda", help="LIKE vs texto completo en /search sobre datos sintéticos (base aparte)")
+    p.add_argument("--dsn", required=True, help="base de pruebas con el esquema y las migraciones aplicadas")
+    p.add_argument("--poblar", type=int, default=0, help="publicaciones sintéticas a generar antes de medir (p. ej. 1000000)")
+    p.add_argument("--usuarios", type=int, default=5000, help="autores sintéticos")
+    p.add_argument("--lote", type=int, default=50000, help="publicaciones por commit al poblar")
+    p.add_argument("--terminos", default="cafe,zapatos,reposteria,ropa niños,servicio domicilio,xyz")
+    p.add_argument("--repeticiones", type=int, default=20)
+    p.add_argument("--limit", type=int, default=10)
+    p.set_defaults(func=busqueda)
+
+    p = sub.add_parser("correo", help="correos/s de mailer.py según el número de conexiones SMTP (servidor local)")
+    p.add_argument("--correos", type=int, default=2000)
+    p.add_argument("--conexiones", default="1,3,5", help="tamaños de pool a comparar, separados por coma")
+    p.add_argument("--latencia", type=float, default=20, help="ms que tarda el servidor local en aceptar cada correo")
+    p.add_argument("--tasa", type=float, default=0, help="máximo de correos por segundo (0 = sin límite)")
+    p.add_argument("--puerto", type=int, default=8025)
+    p.set_defaults(func=correo)
+
+    p = sub.add_parser("ws-workers", help="mensajes de chat enviados a un worker y recibidos por WebSocket en otro")
+    p.add_argument("--url-envio", default="http://localhost:8000", help="worker que recibe el POST del mensaje")
+    p.add_argument("--url-ws", default="http://localhost:8001", help="worker donde está conectado el receptor")
+    p.add_argument("--emisor", type=int, required=True)
+    p.add_argument("--receptor", type=int, required=True)
+    p.add_argument("--mensajes", type=int, default=200)
+    p.add_argument("--timeout", type=float, default=5, help="segundos para dar un mensaje por perdido")
+    p.set_defaults(func=ws_workers)
+
+    p = sub.add_parser("chat-envio", help="mensajes/s y latencia de envío de chat contra un worker")
+    p.add_argument("--url", default="http://localhost:8000", help="un worker en particular")
+    p.add_argument("--emisor", type=int, required=True)
+    p.add_argument("--receptor", type=int, required=True)
+    p.add_argument("--mensajes", type=int, default=5000)
+    p.add_argument("--concurrencia", type=int, default=50)
+    p.set_defaults(func=chat_envio)
+
+    p = sub.add_parser("feed-paginas", help="recorre /feed con offset y con cursor y verifica que coincidan")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--user-id", type=int, default=1)
+    p.add_argument("--limit", type=int, default=10)
+    p.add_argument("--paginas", type=int, default=50, help="máximo de páginas a recorrer con cada modo")
+    p.set_defaults(func=feed_paginas)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
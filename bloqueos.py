@@ -0,0 +1,109 @@
+# bloqueos.py
+# Caché en memoria de los bloqueos de cada usuario (a quién bloqueó + quién lo bloqueó, juntos).
+# El feed, la búsqueda y los chats la consultan en cada petición en lugar de ir a la tabla bloqueos;
+# el feed recibe la lista como un solo parámetro int[] en vez de dos subconsultas.
+#
+# Invalidación entre workers: bloquear_usuario manda NOTIFY bloqueos_cambiados dentro de su transacción
+# y cada worker escucha ese canal con el hilo de pubsub.py (iniciar_escucha, llamado desde main.py).
+# BLOQUEOS_TTL es solo la red de seguridad por si se pierde una notificación.
+# La caché es LRU con a lo más BLOQUEOS_MAX usuarios; al guardar se tiran los vencidos del extremo viejo.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pubsub
+from database import get_db_connection
+
+BLOQUEOS_TTL = float(os.getenv("BLOQUEOS_TTL", "300"))
+BLOQUEOS_MAX = int(os.getenv("BLOQUEOS_MAX", "50000"))
+CANAL_BLOQUEOS = "bloqueos_cambiados"
+
+_cache = OrderedDict()  # user_id -> (expira, frozenset de ids), del menos al más recientemente usado
+_lock = threading.Lock()
+
+SQL_BLOQUEOS_DE = """
+    SELECT bloqueado_id FROM bloqueos WHERE bloqueador_id = %s
+    UNION
+    SELECT bloqueador_id FROM bloqueos WHERE bloqueado_id = %s
+"""
+
+
+def _consultar(cur, user_id: int) -> frozenset:
+    cur.execute(SQL_BLOQUEOS_DE, (user_id, user_id))
+    return frozenset(row[0] for row in cur.fetchall())
+
+
+def bloqueados_de(user_id, cur=None) -> frozenset:
+    """
+    Usuarios que `user_id` no debe ver, en ambos sentidos. Si se pasa `cur`, un fallo de caché
+    reutiliza esa conexión en lugar de pedir otra al pool.
+    """
+    if not user_id or user_id < 0:
+        return frozenset()
+    ahora = time.monotonic()
+    with _lock:
+        guardado = _cache.get(user_id)
+        if guardado and guardado[0] > ahora:
+            _cache.move_to_end(user_id)
+            return guardado[1]
+
+    if cur is not None:
+        ids = _consultar(cur, user_id)
+    else:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            ids = _consultar(cursor, user_id)
+            cursor.close()
+        finally:
+            conn.close()
+
+    with _lock:
+        _cache[user_id] = (ahora + BLOQUEOS_TTL, ids)
+        _cache.move_to_end(user_id)
+        _podar(ahora)
+    return ids
+
+
+def _podar(ahora: float):
+    # Llamar con _lock tomado. Del extremo menos usado: fuera lo vencido y lo que pase de BLOQUEOS_MAX
+    while _cache:
+        user_id, (expira, _) = next(iter(_cache.items()))
+        if expira > ahora and len(_cache) <= BLOQUEOS_MAX:
+            break
+        del _cache[user_id]
+
+
+def ids_bloqueados(user_id, cur=None) -> list:
+    """Lo mismo como lista, lista para pasarse como parámetro int[] (p.user_id <> ALL(%s))."""
+    return list(bloqueados_de(user_id, cur))
+
+
+def hay_bloqueo(user_a: int, user_b: int, cur=None) -> bool:
+    return user_b in bloqueados_de(user_a, cur)
+
+
+def invalidar(*user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _cache.pop(user_id, None)
+
+
+def notificar_cambio(cur, *user_ids):
+    """Avisa a todos los workers; Postgres entrega el NOTIFY solo si la transacción hace commit."""
+    pubsub.notificar(cur, CANAL_BLOQUEOS, ",".join(str(u) for u in user_ids))
+
+
+def _al_cambio(payload: str):
+    invalidar(*(int(u) for u in payload.split(",") if u))
+
+
+def _vaciar():
+    with _lock:
+        _cache.clear()
+
+
+def iniciar_escucha():
+    # Mientras la escucha estuvo caída pudimos perder avisos: al reconectar se vacía todo
+    pubsub.suscribir(CANAL_BLOQUEOS, _al_cambio, al_reconectar=_vaciar)
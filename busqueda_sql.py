@@ -0,0 +1,41 @@
+# busqueda_sql.py
+# SQL de la búsqueda de publicaciones (/search), aparte para que benchmark.py mida exactamente la misma
+# consulta sin importar publicaciones.py (que abre el pool de la base al importarse).
+#
+# p.busqueda es un tsvector con etiquetas y contenido en la configuración es_unaccent (migración
+# 004_busqueda_publicaciones). Un OR entre p.busqueda @@ q y "el autor se llama q" no se puede resolver con
+# índices (Postgres no arma un BitmapOr con una subconsulta), así que cada mitad va por su índice y se unen
+# los ids en un InitPlan; la consulta de afuera solo lee esas filas por la llave primaria:
+#   - texto:  idx_publicaciones_busqueda (GIN)
+#   - autor:  idx_datos_usuario_nombre_busqueda / idx_usuarios_nombre_busqueda (GIN de expresión)
+#             y luego idx_publicaciones_user_fecha_id por cada autor encontrado
+import re
+from typing import Optional
+
+# Params: tsquery x3
+FILTRO_BUSQUEDA = """
+    p.id = ANY(ARRAY(
+        SELECT id FROM publicaciones
+        WHERE busqueda @@ to_tsquery('es_unaccent', %s)
+        UNION
+        SELECT id FROM publicaciones
+        WHERE user_id IN (
+            SELECT user_id FROM datos_usuario
+            WHERE to_tsvector('es_unaccent', COALESCE(nombre_empresa, '')) @@ to_tsquery('es_unaccent', %s)
+            UNION
+            SELECT id FROM usuarios
+            WHERE to_tsvector('es_unaccent', COALESCE(nombre, '')) @@ to_tsquery('es_unaccent', %s)
+        )
+    ))
+"""
+# Params: tsquery
+RELEVANCIA_BUSQUEDA = "COALESCE(ts_rank(p.busqueda, to_tsquery('es_unaccent', %s)), 0)"
+
+
+def tsquery_busqueda(query: str) -> Optional[str]:
+    """
+    "zapatos niñ" -> "zapatos:* & niñ:*". Cada palabra es prefijo porque la búsqueda corre mientras se escribe.
+    Solo se dejan letras y números para que la sintaxis de to_tsquery no falle con lo que escriba el usuario.
+    """
+    palabras = re.findall(r"\w+", query.lower())
+    return " & ".join(f"{palabra}:*" for palabra in palabras) if palabras else None
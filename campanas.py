@@ -0,0 +1,384 @@
+# campanas.py
+# Motor único de campañas masivas (push y correo). anuncio.py, recordatorio_publicar.py y spam_instalacion.py
+# quedaron como atajos que llaman a este módulo.
+#
+# Uso:
+#   python campanas.py anuncio --titulo "..." --cuerpo "..."
+#   python campanas.py recordatorio                  -> push de recordatorio (mensaje al azar)
+#   python campanas.py instalacion                   -> correo a quien no tiene la app
+#   python campanas.py instalacion --simular         -> cuenta la audiencia y muestra el mensaje, no manda nada
+#   python campanas.py instalacion --prueba yo@x.com -> manda solo a esa dirección
+#   python campanas.py anuncio ... --nueva           -> abandona la ejecución a medias y empieza de cero
+#   python campanas.py recordatorio --stub           -> FCM simulado, para probar en local
+#
+# La audiencia se lee por bloques con keyset sobre id (id > último, LIMIT bloque), una consulta corta por
+# bloque: nunca se carga entera en memoria ni deja una transacción abierta durante horas frenando el vacuum. Cada bloque deja su punto de control en campanas_ejecuciones (ultimo_id y totales);
+# si el proceso se cae, correr la misma campaña otra vez retoma desde ahí con el mismo mensaje.
+# Lo peor que pasa tras una caída es que el último bloque se reenvíe.
+import argparse
+import logging
+import os
+import random
+import signal
+import time
+from collections import Counter
+
+import firebase_admin
+import psycopg2
+from firebase_admin import credentials
+from psycopg2.extras import Json
+
+import mailer
+import notificaciones_push
+from database import DB_CONFIG
+from limitador import LimitadorTasa
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+CAMPANA_BLOQUE = int(os.getenv("CAMPANA_BLOQUE", "1000"))
+
+# --- AUDIENCIAS (siempre "id, destino" ordenadas por id: el id es el punto de control). Params: desde_id, bloque ---
+AUDIENCIA_CON_APP = """
+    SELECT id, fcm_token FROM usuarios
+    WHERE fcm_token IS NOT NULL AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+AUDIENCIA_SIN_APP = """
+    SELECT id, email FROM usuarios
+    WHERE fcm_token IS NULL AND email IS NOT NULL AND email <> '' AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+# --- MENSAJES ---
+MENSAJES_RECORDATORIO = [
+    {
+        "titulo": "¡Inicia la semana con ventas! 🚀",
+        "cuerpo": "Publica hoy tus servicios o productos en PrendiaX y llega a más clientes cerca de ti."
+    },
+    {
+        "titulo": "¿Qué ofreces hoy? 📸",
+        "cuerpo": "Mantente visible en tu zona. Sube una foto o video de tu negocio y atrae nuevos clientes."
+    },
+    {
+        "titulo": "¡Prepárate para el fin de semana! 🔥",
+        "cuerpo": "Aprovecha el tráfico de hoy. Promociona tu talento local en PrendiaX totalmente gratis."
+    },
+    {
+        "titulo": "Tu próximo cliente te está buscando 🔍",
+        "cuerpo": "Actualiza tu catálogo. Un perfil con fotos recientes genera 80% más confianza."
+    }
+]
+
+ASUNTO_INSTALACION = "¿Ya tienes PrendiaX en tu celular? 📱"
+HTML_INSTALACION = """
+<h2>Lleva tu negocio al siguiente nivel con la App de PrendiaX</h2>
+<p>Hola,</p>
+<p>Notamos que te registraste en nuestra plataforma web, pero aún no disfrutas de la experiencia completa en tu dispositivo móvil.</p>
+<p>Con la aplicación oficial podrás:</p>
+<ul>
+    <li>Recibir notificaciones en tiempo real de clientes interesados.</li>
+    <li>Chatear directamente con otros emprendedores.</li>
+    <li>Publicar fotos y videos de tus servicios al instante.</li>
+</ul>
+<br>
+<p style="background-color: #1976d2; color: white; padding: 12px 24px; text-decoration: none; border-radius: 8px; font-weight: bold; display: inline-block;">Búscanos en App Store y Google Play</p>
+<br><br>
+<p>No dejes pasar la oportunidad de conectar con tu comunidad local desde cualquier lugar.</p>
+<p>Atentamente,<br><b>El equipo de PrendiaX</b></p>
+"""
+
+# Cada campaña: canal, audiencia y cómo arma sus parámetros. Los parámetros se guardan con la ejecución,
+# así que al reanudar se manda exactamente el mismo mensaje (el recordatorio no vuelve a sortearse).
+CAMPANAS = {
+    "anuncio": {
+        "canal": "push",
+        "audiencia": AUDIENCIA_CON_APP,
+        "parametros": lambda args: {"titulo": args.titulo, "cuerpo": args.cuerpo, "data": {"tipo": "general"}},
+    },
+    "recordatorio": {
+        "canal": "push",
+        "audiencia": AUDIENCIA_CON_APP,
+        "parametros": lambda args: {**random.choice(MENSAJES_RECORDATORIO), "data": {"tipo": "recordatorio"}},
+    },
+    "instalacion": {
+        "canal": "email",
+        "audiencia": AUDIENCIA_SIN_APP,
+        "parametros": lambda args: {"asunto": ASUNTO_INSTALACION, "html": HTML_INSTALACION},
+    },
+}
+
+_detener = False
+
+
+def _pedir_salida(signum, frame):
+    global _detener
+    _detener = True
+    logging.info("Señal recibida: la campaña se detiene al terminar el bloque actual (se puede reanudar)")
+
+
+def conectar():
+    return psycopg2.connect(**DB_CONFIG)
+
+
+# --- CANALES (misma interfaz: enviar(bloque de (id, destino)) -> resultado del bloque, cerrar()) ---
+
+class CanalPush:
+    def __init__(self, parametros: dict, limitador=None, concurrencia: int = notificaciones_push.PUSH_CONCURRENCIA,
+                 stub: bool = False):
+        self.parametros = parametros
+        self.limitador = limitador
+        self.concurrencia = concurrencia
+        self.podar = not stub  # con --stub los "tokens muertos" son inventados
+        if stub:
+            notificaciones_push.usar_fcm_simulado()
+        elif not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate("firebase_key.json"))
+
+    def enviar(self, bloque: list) -> dict:
+        p = self.parametros
+        metricas = notificaciones_push.enviar_difusion(
+            [destino for _, destino in bloque], p["titulo"], p["cuerpo"], p.get("data"), self.concurrencia, self.limitador
+        )
+        return {"enviados": metricas["exitos"], "fallidos": metricas["fallas"], "errores": metricas["errores"],
+                "tokens_muertos": metricas["tokens_muertos"] if self.podar else []}
+
+    def cerrar(self):
+        pass
+
+
+class CanalEmail:
+    """Correo con el pool de conexiones SMTP de mailer.py; la plantilla MIME se arma una vez por campaña."""
+
+    def __init__(self, parametros: dict, tasa: float = None, conexiones: int = mailer.SMTP_CONEXIONES):
+        self.plantilla = mailer.PlantillaCorreo(parametros["asunto"], parametros["html"])
+        self.mailer = mailer.Mailer(conexiones=conexiones, tasa=tasa or mailer.SMTP_TASA)
+
+    def enviar(self, bloque: list) -> dict:
+        metricas = self.mailer.enviar(self.plantilla, [email for _, email in bloque])
+        for email, error in metricas["fallidos"]:
+            logging.warning(f"Correo a {email} falló: {error}")
+        return {"enviados": metricas["enviados"], "fallidos": metricas["fallas"], "errores": metricas["errores"],
+                "tokens_muertos": []}
+
+    def cerrar(self):
+        self.mailer.cerrar()
+
+
+# --- PUNTOS DE CONTROL ---
+
+def abrir_ejecucion(conn, campana: str, parametros: dict, nueva: bool = False):
+    """
+    Retoma la ejecución 'en_curso' de la campaña (con sus parámetros originales) o crea una.
+    Devuelve (ejecucion_id, ultimo_id, parametros, totales previos).
+    """
+    cur = conn.cursor()
+    if nueva:
+        cur.execute("""
+            UPDATE campanas_ejecuciones SET estado = 'abandonada', actualizada_en = NOW()
+            WHERE campana = %s AND estado = 'en_curso'
+        """, (campana,))
+    cur.execute("""
+        SELECT id, ultimo_id, parametros, enviados, fallidos, podados FROM campanas_ejecuciones
+        WHERE campana = %s AND estado = 'en_curso'
+        ORDER BY id DESC LIMIT 1
+    """, (campana,))
+    fila = cur.fetchone()
+    if fila:
+        ejecucion_id, ultimo_id, parametros, enviados, fallidos, podados = fila
+        logging.info(f"🔁 Reanudando la ejecución {ejecucion_id} de '{campana}' desde el usuario {ultimo_id}")
+    else:
+        cur.execute(
+            "INSERT INTO campanas_ejecuciones (campana, parametros) VALUES (%s, %s) RETURNING id",
+            (campana, Json(parametros)),
+        )
+        ejecucion_id, ultimo_id, enviados, fallidos, podados = cur.fetchone()[0], 0, 0, 0, 0
+    conn.commit()
+    cur.close()
+    return ejecucion_id, ultimo_id, parametros, {"enviados": enviados, "fallidos": fallidos, "podados": podados}
+
+
+def guardar_avance(conn, ejecucion_id: int, ultimo_id: int, resultado: dict) -> int:
+    """Poda los tokens muertos del bloque y mueve el punto de control, todo en una transacción."""
+    cur = conn.cursor()
+    podados = notificaciones_push.podar_tokens(cur, resultado["tokens_muertos"]) if resultado["tokens_muertos"] else 0
+    cur.execute("""
+        UPDATE campanas_ejecuciones
+        SET ultimo_id = %s, enviados = enviados + %s, fallidos = fallidos + %s, podados = podados + %s,
+            actualizada_en = NOW()
+        WHERE id = %s
+    """, (ultimo_id, resultado["enviados"], resultado["fallidos"], podados, ejecucion_id))
+    conn.commit()
+    cur.close()
+    return podados
+
+
+def terminar_ejecucion(conn, ejecucion_id: int):
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE campanas_ejecuciones SET estado = 'terminada', terminada_en = NOW(), actualizada_en = NOW()
+        WHERE id = %s
+    """, (ejecucion_id,))
+    conn.commit()
+    cur.close()
+
+
+def leer_audiencia(conn, campana: str, desde_id: int, bloque: int):
+    """
+    Genera bloques de (id, destino). Cada bloque es su propia consulta y su propia transacción, así que
+    una campaña con tasa limitada no retiene un snapshot de usuarios mientras manda.
+    """
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute(CAMPANAS[campana]["audiencia"], (desde_id, bloque))
+            filas = cur.fetchall()
+            conn.rollback()  # solo lectura: se cierra la transacción antes de mandar el bloque
+            if not filas:
+                break
+            yield filas
+            if len(filas) < bloque:
+                break
+            desde_id = filas[-1][0]
+    finally:
+        cur.close()
+
+
+# --- EJECUCIÓN ---
+
+def _mostrar_mensaje(canal: str, parametros: dict):
+    if canal == "push":
+        print(f"📢 Título: {parametros['titulo']}\n💬 Cuerpo: {parametros['cuerpo']}")
+    else:
+        print(f"✉️ Asunto: {parametros['asunto']}")
+
+
+def _resumen(campana: str, canal: str, totales: dict, errores: Counter, procesados: int, segundos: float,
+             terminada: bool):
+    print("\n" + "=" * 50)
+    print(f"{'✅ Campaña terminada' if terminada else '⏸️ Campaña detenida (se puede reanudar)'}: {campana} ({canal})")
+    print(f"👥 Destinatarios en esta corrida: {procesados}")
+    print(f"📬 Enviados: {totales['enviados']} | ❌ Fallidos: {totales['fallidos']} (acumulado de la ejecución)")
+    if errores:
+        print(f"⚠️ Errores en esta corrida: {dict(errores)}")
+    if canal == "push":
+        print(f"🧹 Tokens muertos podados: {totales['podados']}")
+    ritmo = procesados / segundos if segundos else 0.0
+    print(f"⏱️ {segundos:.1f}s ({ritmo:.1f} envíos/s)")
+    print("=" * 50 + "\n")
+
+
+def simular(campana: str, parametros: dict, bloque: int = CAMPANA_BLOQUE) -> int:
+    """--simular: recorre la audiencia igual que el envío real pero sin mandar ni guardar nada."""
+    conn = conectar()
+    try:
+        total = 0
+        ejemplos = []
+        for filas in leer_audiencia(conn, campana, 0, bloque):
+            total += len(filas)
+            ejemplos.extend(filas[:3 - len(ejemplos)])
+    finally:
+        conn.close()
+    _mostrar_mensaje(CAMPANAS[campana]["canal"], parametros)
+    print(f"🔎 Simulación de '{campana}': {total} destinatarios. Ejemplos: {[destino[:24] for _, destino in ejemplos]}")
+    return total
+
+
+def ejecutar(campana: str, parametros: dict, bloque: int = CAMPANA_BLOQUE, tasa: float = None,
+             concurrencia: int = None, stub: bool = False, nueva: bool = False) -> dict:
+    """
+    Manda la campaña completa (o lo que le faltaba). Devuelve los totales acumulados de la ejecución.
+    `concurrencia`: lotes multicast en paralelo (push) o conexiones SMTP (correo); None usa el default del canal.
+    """
+    canal_nombre = CAMPANAS[campana]["canal"]
+    control = conectar()
+    lectura = conectar()
+    canal = None
+    try:
+        cur = control.cursor()
+        # Un candado por campaña: dos procesos de la misma campaña mandarían todo dos veces
+        cur.execute("SELECT pg_try_advisory_lock(hashtext('campana:' || %s))", (campana,))
+        if not cur.fetchone()[0]:
+            raise RuntimeError(f"La campaña '{campana}' ya está corriendo en otro proceso")
+        cur.close()
+
+        ejecucion_id, ultimo_id, parametros, totales = abrir_ejecucion(control, campana, parametros, nueva)
+        _mostrar_mensaje(canal_nombre, parametros)
+
+        if canal_nombre == "push":
+            limitador = LimitadorTasa(tasa, rafaga=max(tasa, notificaciones_push.TAMANO_LOTE)) if tasa else None
+            canal = CanalPush(parametros, limitador, concurrencia or notificaciones_push.PUSH_CONCURRENCIA, stub)
+        else:
+            canal = CanalEmail(parametros, tasa, concurrencia or mailer.SMTP_CONEXIONES)
+
+        inicio = time.perf_counter()
+        procesados = 0
+        errores = Counter()
+        terminada = True
+        for filas in leer_audiencia(lectura, campana, ultimo_id, bloque):
+            resultado = canal.enviar(filas)
+            procesados += len(filas)
+            errores.update(resultado["errores"])
+            totales["enviados"] += resultado["enviados"]
+            totales["fallidos"] += resultado["fallidos"]
+            totales["podados"] += guardar_avance(control, ejecucion_id, filas[-1][0], resultado)
+            logging.info(f"Campaña '{campana}': bloque hasta el usuario {filas[-1][0]} -> "
+                         f"{resultado['enviados']} ok / {resultado['fallidos']} fallas ({procesados} en esta corrida)")
+            if _detener:
+                terminada = False
+                break
+
+        if terminada:
+            terminar_ejecucion(control, ejecucion_id)
+        _resumen(campana, canal_nombre, totales, errores, procesados, time.perf_counter() - inicio, terminada)
+        return totales
+    finally:
+        if canal is not None:
+            canal.cerrar()
+        lectura.close()
+        control.close()  # al cerrar la sesión se suelta el advisory lock
+
+
+def enviar_prueba(campana: str, parametros: dict, destino: str, stub: bool = False) -> dict:
+    """--prueba: manda la campaña a un solo destino (correo o token), sin tocar puntos de control."""
+    if CAMPANAS[campana]["canal"] == "push":
+        canal = CanalPush(parametros, stub=stub)
+    else:
+        canal = CanalEmail(parametros)
+    try:
+        resultado = canal.enviar([(0, destino)])
+    finally:
+        canal.cerrar()
+    print(f"🧪 Prueba de '{campana}' a {destino}: {'enviada' if resultado['enviados'] else dict(resultado['errores'])}")
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Campañas masivas de push y correo")
+    parser.add_argument("campana", choices=sorted(CAMPANAS))
+    parser.add_argument("--titulo", help="anuncio: título del push")
+    parser.add_argument("--cuerpo", help="anuncio: texto del push")
+    parser.add_argument("--simular", action="store_true", help="cuenta la audiencia sin mandar nada")
+    parser.add_argument("--prueba", metavar="DESTINO", help="manda solo a este correo / token")
+    parser.add_argument("--nueva", action="store_true", help="no reanuda: abandona la ejecución a medias")
+    parser.add_argument("--bloque", type=int, default=CAMPANA_BLOQUE, help="destinatarios por bloque (y por punto de control)")
+    parser.add_argument("--tasa", type=float, help="máximo de envíos por segundo")
+    parser.add_argument("--concurrencia", type=int,
+                        help="push: lotes multicast en paralelo / correo: conexiones SMTP")
+    parser.add_argument("--stub", action="store_true", help="push: no llama a Firebase (FCM simulado)")
+    args = parser.parse_args()
+
+    if args.campana == "anuncio" and not (args.titulo and args.cuerpo):
+        parser.error("anuncio necesita --titulo y --cuerpo")
+    parametros = CAMPANAS[args.campana]["parametros"](args)
+
+    if args.simular:
+        simular(args.campana, parametros, args.bloque)
+    elif args.prueba:
+        enviar_prueba(args.campana, parametros, args.prueba, args.stub)
+    else:
+        signal.signal(signal.SIGTERM, _pedir_salida)
+        signal.signal(signal.SIGINT, _pedir_salida)
+        ejecutar(args.campana, parametros, args.bloque, args.tasa, args.concurrencia, args.stub, args.nueva)
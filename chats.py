@@ -6,11 +6,20 @@ import psycopg2
 from datetime import datetime
 import logging
 import io
+import os
+import base64
 import re
 import json 
+import asyncio
 from pydantic import BaseModel
 import jwt # <--- NECESARIO PARA LEER EL TOKEN
-from firebase_admin import messaging # 🔥 Añadir a tus imports
+from database import get_db_connection, run_db
+from media_store import store as media_store, ingerir_upload, ArchivoMuyGrande
+from rangos import respuesta_bytea
+import bloqueos
+import pubsub
+import push_outbox
+from ws_hub import hub_chat
 
 
 router = APIRouter(prefix="/chats", tags=["chats"])
@@ -31,51 +40,11 @@ logging.basicConfig(
 # 🔥 CLAVE MAESTRA (IGUAL A LA DE APPLE_AUTH.PY)
 SECRET_KEY_JWT = "Elbicho7"
 
-# --- GESTOR DE WEBSOCKETS ---
-class NotificationManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
-        logging.debug(f"Usuario {user_id} conectado a WS Notificaciones")
-
-    def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-        logging.debug(f"Usuario {user_id} desconectado de WS Notificaciones")
-
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    logging.error(f"Error enviando WS a {user_id}: {e}")
-
-notification_manager = NotificationManager()
-
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Error al conectar a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
-
 MAX_FILE_SIZE = 100 * 1024 * 1024 
 
+# Búsqueda dentro de los mensajes: requiere el índice opcional 015_busqueda_mensajes_chat (misma variable)
+CHAT_BUSQUEDA_MENSAJES = os.getenv("CHAT_BUSQUEDA_MENSAJES", "0") == "1"
+
 # Modelos Pydantic
 class InterestRequest(BaseModel):
     user_id: int
@@ -100,71 +69,19 @@ class ReportePublicacionRequest(BaseModel):
     publicacion_id: int
     motivo: str
 
-# Diccionario para WebSockets de Chat
-websocket_connections: Dict[int, WebSocket] = {}
-
 def sanitize_filename(filename: str) -> str:
     clean_name = re.sub(r'[^a-zA-Z0-9\.\-_]', '_', filename)
     clean_name = re.sub(r'_+', '_', clean_name)
     return clean_name.strip('_')
 
 def verificar_bloqueo(cur, user_a: int, user_b: int):
-    cur.execute("""
-        SELECT 1 FROM bloqueos 
-        WHERE (bloqueador_id = %s AND bloqueado_id = %s) 
-           OR (bloqueador_id = %s AND bloqueado_id = %s)
-    """, (user_a, user_b, user_b, user_a))
-    
-    if cur.fetchone():
+    # Caché de bloqueos por worker (bloqueos.py); `cur` solo se usa si hay que cargarla
+    if bloqueos.hay_bloqueo(user_a, user_b, cur):
         raise HTTPException(
             status_code=403, 
             detail="No puedes interactuar con este usuario (Bloqueo activo)"
         )
 
-def send_bytes_range_requests(request: Request, file_bytes: bytes, content_type: str, filename: str):
-    file_size = len(file_bytes)
-    range_header = request.headers.get("range")
-
-    if not range_header:
-        return StreamingResponse(
-            io.BytesIO(file_bytes),
-            media_type=content_type,
-            headers={"Content-Disposition": f"inline; filename={filename}"}
-        )
-
-    try:
-        start, end = 0, None
-        match = range_header.strip().replace("bytes=", "").split("-")
-        if match[0]: start = int(match[0])
-        if len(match) > 1 and match[1]: end = int(match[1])
-        
-        if end is None: end = file_size - 1
-        if start >= file_size: raise HTTPException(status_code=416, detail="Range Not Satisfiable")
-        if end >= file_size: end = file_size - 1
-
-        chunk_length = end - start + 1
-        data_chunk = file_bytes[start : end + 1]
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(chunk_length),
-            "Content-Disposition": f"inline; filename={filename}",
-        }
-
-        return StreamingResponse(
-            io.BytesIO(data_chunk),
-            status_code=206,
-            headers=headers,
-            media_type=content_type
-        )
-    except ValueError:
-        return StreamingResponse(
-            io.BytesIO(file_bytes),
-            media_type=content_type,
-            headers={"Content-Disposition": f"inline; filename={filename}"}
-        )
-
 # =========================================================================
 # 🔥 CORRECCIÓN CRÍTICA 1: LECTURA DE TOKEN REAL (JWT)
 # =========================================================================
@@ -228,13 +145,13 @@ async def get_current_user_endpoint(user_id: int = Depends(get_session)):
     return {"user_id": user_id}
 
 @router.get("/user/{user_id}")
-async def get_user_info(user_id: int, requesting_user_id: int = Depends(get_session)):
+def get_user_info(user_id: int, requesting_user_id: int = Depends(get_session)):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
             SELECT u.id, u.nombre, COALESCE(du.nombre_empresa, '') AS nombre_empresa,
-                   du.categoria, du.foto IS NOT NULL AS has_foto
+                   du.categoria, (du.foto_key IS NOT NULL OR du.foto IS NOT NULL) AS has_foto
             FROM usuarios u
             LEFT JOIN datos_usuario du ON u.id = du.user_id
             WHERE u.id = %s
@@ -269,12 +186,12 @@ async def get_chats_page(request: Request, user_id: int = Depends(get_session)):
         return RedirectResponse(url="/login", status_code=302)
 
 @router.get("/media/{mensaje_id}")
-async def get_media_chat(request: Request, mensaje_id: int, user_id: int = Depends(get_session)):
+def get_media_chat(request: Request, mensaje_id: int, user_id: int = Depends(get_session)):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT m.media_content, m.tipo
+            SELECT m.media_key, octet_length(m.media_content), m.tipo
             FROM mensajes_chat m
             JOIN chats c ON m.chat_id = c.id
             WHERE m.id = %s AND (c.usuario1_id = %s OR c.usuario2_id = %s)
@@ -283,10 +200,10 @@ async def get_media_chat(request: Request, mensaje_id: int, user_id: int = Depen
         cur.close()
         conn.close()
 
-        if not result or not result[0]:
+        if not result or not (result[0] or result[1]):
             raise HTTPException(status_code=404, detail="Archivo no encontrado")
 
-        media_content, tipo = result
+        media_key, tamano, tipo = result
         content_type = {
             'imagen': 'image/jpeg',
             'video': 'video/mp4',
@@ -300,22 +217,29 @@ async def get_media_chat(request: Request, mensaje_id: int, user_id: int = Depen
         elif tipo == 'imagen': filename += ".jpg"
         elif tipo == 'document': filename += ".pdf"
         
-        return send_bytes_range_requests(request, media_content, content_type, filename)
-
+        if media_key:
+            return media_store.respuesta(request, media_key, content_type, filename)
+        # Archivo viejo en la BD: se lee solo la ventana pedida por Range
+        return respuesta_bytea(request, "mensajes_chat", "media_content", mensaje_id, tamano, content_type, filename)
+
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Bandeja: las filas del usuario en chats_lectura ya traen el orden (ultima_actividad) y los no leídos,
+# así que es un recorrido de idx_chats_lectura_bandeja más un join por chat de la página (migración 014)
 @router.get("/list")
-async def list_chats(user_id: int = Depends(get_session), limit: int = 10, offset: int = 0):
+def list_chats(user_id: int = Depends(get_session), limit: int = 10, offset: int = 0):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
             SELECT c.id, 
-                   CASE 
-                       WHEN c.usuario1_id = %s THEN c.usuario2_id 
-                       ELSE c.usuario1_id 
-                   END AS otro_usuario_id,
+                   u.id AS otro_usuario_id,
                    COALESCE(du.nombre_empresa, u.nombre) AS display_name,
                    CASE 
                        WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor'
@@ -324,22 +248,19 @@ async def list_chats(user_id: int = Depends(get_session), limit: int = 10, offse
                    m.contenido AS ultimo_mensaje,
                    m.fecha_envio,
                    m.tipo AS tipo_ultimo_mensaje,
-                   SUM(CASE WHEN m.leido = FALSE AND m.receptor_id = %s THEN 1 ELSE 0 END) AS unread_count,
-                   du.foto IS NOT NULL AS has_foto,
+                   l.no_leidos AS unread_count,
+                   (du.foto_key IS NOT NULL OR du.foto IS NOT NULL) AS has_foto,
                    m.emisor_id = %s AS es_mio,
                    c.creado_en
-            FROM chats c
-            JOIN usuarios u ON (CASE 
-                                   WHEN c.usuario1_id = %s THEN c.usuario2_id 
-                                   ELSE c.usuario1_id 
-                               END) = u.id
+            FROM chats_lectura l
+            JOIN chats c ON c.id = l.chat_id
+            JOIN usuarios u ON u.id = CASE WHEN c.usuario1_id = l.user_id THEN c.usuario2_id ELSE c.usuario1_id END
             LEFT JOIN datos_usuario du ON u.id = du.user_id
             LEFT JOIN mensajes_chat m ON c.ultimo_mensaje_id = m.id
-            WHERE c.usuario1_id = %s OR c.usuario2_id = %s
-            GROUP BY c.id, c.usuario1_id, c.usuario2_id, u.nombre, du.nombre_empresa, du.categoria, m.contenido, m.fecha_envio, m.tipo, du.foto, m.emisor_id, c.creado_en
-            ORDER BY COALESCE(m.fecha_envio, c.creado_en) DESC
+            WHERE l.user_id = %s
+            ORDER BY l.ultima_actividad DESC, l.chat_id DESC
             LIMIT %s OFFSET %s
-        """, (user_id, user_id, user_id, user_id, user_id, user_id, limit, offset))
+        """, (user_id, user_id, limit, offset))
         chats = cur.fetchall()
         cur.close()
         conn.close()
@@ -363,13 +284,85 @@ async def list_chats(user_id: int = Depends(get_session), limit: int = 10, offse
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{chat_id}/mensajes")
-async def get_chat_messages(chat_id: int, user_id: int = Depends(get_session), limit: int = 20, offset: int = 0):
+# Lectura por marca (chats_lectura, migración 013): cada participante guarda hasta qué mensaje leyó y cuántos
+# recibió después. Leer es actualizar esa fila; mensajes_chat.leido ya no se reescribe. El "leido" de cada
+# mensaje se deduce de la marca de su receptor.
+# Si la fila ya existe, no_leidos se ajusta por diferencia sobre la versión bloqueada (restando los recibidos entre
+# la marca vieja y la nueva): un COUNT hecho antes del bloqueo pisaría el +1 de un envío concurrente.
+def _marcar_leido(cur, chat_id: int, user_id: int, hasta_id: int):
+    """Sube la marca de `user_id` hasta `hasta_id` y descuenta los que acaba de leer. None si la marca no avanzó."""
+    cur.execute("""
+        INSERT INTO chats_lectura (user_id, chat_id, last_read_message_id, no_leidos)
+        VALUES (%s, %s, %s, (SELECT COUNT(*) FROM mensajes_chat m WHERE m.chat_id = %s AND m.receptor_id = %s AND m.id > %s))
+        ON CONFLICT (user_id, chat_id) DO UPDATE
+        SET last_read_message_id = EXCLUDED.last_read_message_id,
+            no_leidos = GREATEST(0, chats_lectura.no_leidos - (
+                SELECT COUNT(*) FROM mensajes_chat m
+                WHERE m.chat_id = chats_lectura.chat_id AND m.receptor_id = chats_lectura.user_id
+                  AND m.id > chats_lectura.last_read_message_id AND m.id <= EXCLUDED.last_read_message_id))
+        WHERE chats_lectura.last_read_message_id < EXCLUDED.last_read_message_id
+        RETURNING no_leidos
+    """, (user_id, chat_id, hasta_id, chat_id, user_id, hasta_id))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+def _leer_chat(chat_id: int, user_id: int, hasta_id: int | None = None):
+    """
+    Marca el chat como leído hasta `hasta_id` (o hasta el último mensaje). Devuelve (otro_usuario_id, hasta_id, no_leidos);
+    hasta_id es None si no había nada nuevo que marcar.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT usuario1_id, usuario2_id, ultimo_mensaje_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
+        chat = cur.fetchone()
+        if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
+
+        otro_usuario_id = chat[1] if chat[0] == user_id else chat[0]
+        # No se puede marcar más allá del último mensaje que existe
+        hasta_id = min(hasta_id, chat[2]) if hasta_id is not None and chat[2] is not None else chat[2]
+        no_leidos = _marcar_leido(cur, chat_id, user_id, hasta_id) if hasta_id else None
+        conn.commit()
+        if no_leidos is None:
+            return otro_usuario_id, None, None
+        return otro_usuario_id, hasta_id, no_leidos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+async def _avisar_lectura(chat_id: int, lector_id: int, otro_usuario_id: int, hasta_id: int):
+    # Confirmación de lectura para el otro participante y, para borrar el contador, para los otros dispositivos del lector
+    evento = {"tipo": "leido", "chat_id": chat_id, "lector_id": lector_id, "hasta_id": hasta_id}
+    await pubsub.publicar_ws("chat", otro_usuario_id, evento)
+    await pubsub.publicar_ws("chat", lector_id, evento)
+
+@router.post("/{chat_id}/leido")
+async def mark_chat_read(chat_id: int, hasta_id: int | None = None, user_id: int = Depends(get_session)):
+    try:
+        otro_usuario_id, marcado, no_leidos = await run_db(_leer_chat, chat_id, user_id, hasta_id)
+        if marcado is not None:
+            await _avisar_lectura(chat_id, user_id, otro_usuario_id, marcado)
+        return {"chat_id": chat_id, "last_read_message_id": marcado, "unread_count": no_leidos or 0}
+    except HTTPException: raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Historial por cursor sobre el índice (chat_id, id), ver migración 012_mensajes_chat_keyset:
+#   sin cursor        -> la página más nueva (y marca el chat como leído, como siempre lo hizo la app)
+#   before_id=<id>    -> la página anterior (al hacer scroll hacia arriba)
+#   after_id=<id>     -> lo que llegó después (al reconectar el socket)
+# Siempre se devuelven en orden ascendente; "antes_de" es el before_id de la siguiente página vieja
+# (None cuando ya no hay más). offset se queda para la app vieja, contado desde el más nuevo.
+def _leer_mensajes(chat_id: int, user_id: int, limit: int, offset: int, before_id: int | None, after_id: int | None):
+    """Devuelve (respuesta, lectura); lectura es (otro_usuario_id, hasta_id) si esta carga avanzó la marca."""
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         cur.execute("""
-            SELECT id, usuario1_id, usuario2_id 
+            SELECT id, usuario1_id, usuario2_id, ultimo_mensaje_id
             FROM chats 
             WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)
         """, (chat_id, user_id, user_id))
@@ -384,32 +377,46 @@ async def get_chat_messages(chat_id: int, user_id: int = Depends(get_session), l
                        WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor'
                        ELSE 'explorador'
                    END AS tipo_usuario,
-                   du.foto IS NOT NULL AS has_foto
+                   (du.foto_key IS NOT NULL OR du.foto IS NOT NULL) AS has_foto
             FROM usuarios u
             LEFT JOIN datos_usuario du ON u.id = du.user_id
             WHERE u.id = %s
         """, (otro_usuario_id,))
         otro_usuario = cur.fetchone()
 
-        cur.execute("""
-            SELECT m.id, m.emisor_id, m.receptor_id, m.contenido, m.tipo, m.fecha_envio, m.leido
-            FROM mensajes_chat m
-            WHERE m.chat_id = %s
-            ORDER BY m.fecha_envio ASC
-            LIMIT %s OFFSET %s
-        """, (chat_id, limit, offset))
-        mensajes = cur.fetchall()
-
-        # Marcar como leídos
-        cur.execute("""
-            UPDATE mensajes_chat 
-            SET leido = TRUE 
-            WHERE chat_id = %s AND receptor_id = %s AND leido = FALSE
-        """, (chat_id, user_id))
+        # Se pide uno de más para saber si queda otra página sin contar el historial
+        if after_id is not None:
+            cur.execute("""
+                SELECT m.id, m.emisor_id, m.receptor_id, m.contenido, m.tipo, m.fecha_envio
+                FROM mensajes_chat m
+                WHERE m.chat_id = %s AND m.id > %s
+                ORDER BY m.id ASC
+                LIMIT %s
+            """, (chat_id, after_id, limit + 1))
+            mensajes = cur.fetchall()
+            hay_mas = len(mensajes) > limit
+            mensajes = mensajes[:limit]
+        else:
+            cur.execute("""
+                SELECT m.id, m.emisor_id, m.receptor_id, m.contenido, m.tipo, m.fecha_envio
+                FROM mensajes_chat m
+                WHERE m.chat_id = %s AND (%s::bigint IS NULL OR m.id < %s)
+                ORDER BY m.id DESC
+                LIMIT %s OFFSET %s
+            """, (chat_id, before_id, before_id, limit + 1, 0 if before_id is not None else offset))
+            mensajes = cur.fetchall()
+            hay_mas = len(mensajes) > limit
+            mensajes = mensajes[:limit][::-1]
+
+        # Abrir el chat (página más nueva) lo marca como leído: una sola fila de chats_lectura
+        lectura = None
+        if before_id is None and after_id is None and offset == 0 and chat[3] is not None:
+            if _marcar_leido(cur, chat_id, user_id, chat[3]) is not None:
+                lectura = (otro_usuario_id, chat[3])
         conn.commit()
 
-        cur.close()
-        conn.close()
+        cur.execute("SELECT user_id, last_read_message_id FROM chats_lectura WHERE chat_id = %s", (chat_id,))
+        marcas = dict(cur.fetchall())
 
         mensajes_list = [
             {
@@ -420,13 +427,13 @@ async def get_chat_messages(chat_id: int, user_id: int = Depends(get_session), l
                 "tipo": row[4],
                 "media_url": f"/chats/media/{row[0]}" if row[4] in ['imagen', 'video', 'voz', 'document'] else "",
                 "fecha_envio": row[5].strftime("%Y-%m-%d %H:%M:%S"),
-                "leido": row[6],
+                "leido": row[0] <= marcas.get(row[2], 0),
                 "es_mio": row[1] == user_id
             }
             for row in mensajes
         ]
 
-        return {
+        respuesta = {
             "chat_id": chat_id,
             "otro_usuario": {
                 "id": otro_usuario_id,
@@ -434,82 +441,144 @@ async def get_chat_messages(chat_id: int, user_id: int = Depends(get_session), l
                 "tipo_usuario": otro_usuario[1],
                 "foto_perfil_url": f"/chats/user/{otro_usuario_id}/foto_perfil" if otro_usuario[1] == 'emprendedor' and otro_usuario[2] else ""
             },
-            "mensajes": mensajes_list
+            "mensajes": mensajes_list,
+            "hay_mas": hay_mas,
+            "antes_de": mensajes[0][0] if mensajes and hay_mas and after_id is None else None
         }
+        return respuesta, lectura
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+@router.get("/{chat_id}/mensajes")
+async def get_chat_messages(chat_id: int, user_id: int = Depends(get_session), limit: int = 20, offset: int = 0,
+                            before_id: int | None = None, after_id: int | None = None):
+    limit = max(1, min(limit, 100))
+    try:
+        respuesta, lectura = await run_db(_leer_mensajes, chat_id, user_id, limit, offset, before_id, after_id)
+        if lectura:
+            await _avisar_lectura(chat_id, user_id, *lectura)
+        return respuesta
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/{chat_id}/mensaje")
-async def send_message(chat_id: int, contenido: str = Form(...), user_id: int = Depends(get_session)):
+async def _subir_archivo(file: UploadFile, detalle_limite: str) -> str:
+    """Copia el archivo al media store por trozos, cortando en cuanto supera MAX_FILE_SIZE."""
     try:
-        contenido = contenido.strip()
-        if not contenido: raise HTTPException(status_code=400, detail="Mensaje vacío")
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT id, usuario1_id, usuario2_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
+        media_key = await ingerir_upload(file, MAX_FILE_SIZE, file.content_type)
+    except ArchivoMuyGrande:
+        raise HTTPException(status_code=400, detail=detalle_limite)
+    if not media_key: raise HTTPException(status_code=400, detail="Archivo vacío")
+    return media_key
+
+# Ingesta de mensajes: los cuatro endpoints de envío validan su archivo/texto y llaman a _ingerir_mensaje.
+# Idas a la base por mensaje: 1) chat + nombre del emisor, 2) INSERT_MENSAJE, 3) push al outbox, 4) commit.
+# El bloqueo sale de la caché de bloqueos.py (sin consulta salvo la primera vez por usuario).
+SQL_CHAT_EMISOR = """
+    SELECT c.usuario1_id, c.usuario2_id, COALESCE(du.nombre_empresa, u.nombre)
+    FROM chats c
+    JOIN usuarios u ON u.id = %(emisor)s
+    LEFT JOIN datos_usuario du ON du.user_id = u.id
+    WHERE c.id = %(chat)s AND (c.usuario1_id = %(emisor)s OR c.usuario2_id = %(emisor)s)
+"""
+
+# Mensaje, puntero del chat y bandeja de los dos participantes en una sentencia. El puntero y ultima_actividad
+# solo avanzan: si dos envíos se cruzan, el que hace commit después no pisa al mensaje más nuevo.
+INSERT_MENSAJE = """
+    WITH nuevo AS (
+        INSERT INTO mensajes_chat (chat_id, emisor_id, receptor_id, contenido, tipo, media_key, fecha_envio)
+        VALUES (%(chat)s, %(emisor)s, %(receptor)s, %(contenido)s, %(tipo)s, %(media_key)s, CURRENT_TIMESTAMP)
+        RETURNING id, fecha_envio
+    ), puntero AS (
+        UPDATE chats c SET ultimo_mensaje_id = n.id
+        FROM nuevo n
+        WHERE c.id = %(chat)s AND (c.ultimo_mensaje_id IS NULL OR c.ultimo_mensaje_id < n.id)
+    ), bandeja AS (
+        INSERT INTO chats_lectura (user_id, chat_id, no_leidos, ultima_actividad)
+        SELECT %(receptor)s, %(chat)s, 1, fecha_envio FROM nuevo
+        UNION ALL
+        SELECT %(emisor)s, %(chat)s, 0, fecha_envio FROM nuevo
+        ON CONFLICT (user_id, chat_id) DO UPDATE
+        SET no_leidos = chats_lectura.no_leidos + EXCLUDED.no_leidos,
+            ultima_actividad = GREATEST(chats_lectura.ultima_actividad, EXCLUDED.ultima_actividad)
+    )
+    SELECT id, fecha_envio FROM nuevo
+"""
+
+def _guardar_mensaje(chat_id: int, user_id: int, tipo: str, cuerpo_push: str, contenido: str | None = None, media_key: str | None = None):
+    """
+    Parte síncrona de la ingesta: valida el chat y el bloqueo, guarda el mensaje (con el puntero del chat y la bandeja
+    de ambos) y encola el push al receptor, todo en una transacción. Devuelve (message_data, receptor_id).
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(SQL_CHAT_EMISOR, {"chat": chat_id, "emisor": user_id})
         chat = cur.fetchone()
         if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
 
-        receptor_id = chat[2] if chat[1] == user_id else chat[1]
+        receptor_id = chat[1] if chat[0] == user_id else chat[0]
         verificar_bloqueo(cur, user_id, receptor_id)
+        emisor_nombre = chat[2] or "Usuario"  # 🔥 título del push
 
-        # 🔥 Buscar el nombre de quien envía y el token del receptor
-        cur.execute("""
-            SELECT 
-                (SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s),
-                (SELECT fcm_token FROM usuarios WHERE id = %s)
-        """, (user_id, receptor_id))
-        row = cur.fetchone()
-        emisor_nombre = row[0] if row and row[0] else "Usuario"
-        fcm_token = row[1] if row and row[1] else None
-
-        cur.execute("""
-            INSERT INTO mensajes_chat (chat_id, emisor_id, receptor_id, contenido, tipo, fecha_envio)
-            VALUES (%s, %s, %s, %s, 'texto', CURRENT_TIMESTAMP)
-            RETURNING id, fecha_envio
-        """, (chat_id, user_id, receptor_id, contenido))
+        # El archivo ya está en el media store (ver _subir_archivo); el mensaje solo guarda la clave
+        cur.execute(INSERT_MENSAJE, {
+            "chat": chat_id, "emisor": user_id, "receptor": receptor_id,
+            "contenido": contenido, "tipo": tipo, "media_key": media_key,
+        })
         mensaje = cur.fetchone()
 
-        cur.execute("UPDATE chats SET ultimo_mensaje_id = %s WHERE id = %s", (mensaje[0], chat_id))
+        # El push lo entrega push_worker.py; si FCM tarda o falla, el envío del mensaje no se entera
+        push_outbox.encolar_push(cur, receptor_id, f"Nuevo mensaje de {emisor_nombre}", cuerpo_push, {"tipo": "chat", "chat_id": chat_id})
         conn.commit()
 
         message_data = {
             "id": mensaje[0], "chat_id": chat_id, "emisor_id": user_id, "receptor_id": receptor_id,
-            "contenido": contenido, "tipo": "texto", "media_url": "",
+            "contenido": contenido or "", "tipo": tipo, "media_url": f"/chats/media/{mensaje[0]}" if tipo != 'texto' else "",
             "fecha_envio": mensaje[1].strftime("%Y-%m-%d %H:%M:%S"), "leido": False, "es_mio": True
         }
-        
-        if receptor_id in websocket_connections:
-            try: await websocket_connections[receptor_id].send_text(json.dumps(message_data))
-            except: del websocket_connections[receptor_id]
-
-        # 🔥 ENVIAR PUSH NOTIFICATION (CHAT) 🔥
-        if fcm_token:
-            try:
-                push_msg = messaging.Message(
-                    notification=messaging.Notification(
-                        title=f"Nuevo mensaje de {emisor_nombre}",
-                        body=contenido
-                    ),
-                    apns=messaging.APNSConfig(
-                        payload=messaging.APNSPayload(
-                            aps=messaging.Aps(sound="default")
-                        )
-                    ),
-                    data={"tipo": "chat", "chat_id": str(chat_id)},
-                    token=fcm_token,
-                )
-                messaging.send(push_msg)
-            except Exception as e:
-                logging.error(f"Error enviando Push (Chat): {e}")
-
+        return message_data, receptor_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         cur.close()
         conn.close()
-        return message_data
+
+# Otros workers reenvían aquí los eventos de chat de los usuarios conectados a este proceso
+pubsub.registrar_destino("chat", hub_chat.enviar)
+
+async def _entregar_mensaje(message_data: dict, receptor_id: int):
+    # El receptor puede estar conectado a otro worker: pubsub entrega aquí y publica para los demás
+    await pubsub.publicar_ws("chat", receptor_id, message_data)
+
+_entregas = set()  # referencias a las entregas en curso (asyncio solo guarda referencias débiles a las tareas)
+
+async def _ingerir_mensaje(chat_id: int, user_id: int, tipo: str, cuerpo_push: str, contenido: str | None = None, media_key: str | None = None) -> dict:
+    """
+    Guarda el mensaje y responde sin esperar la entrega: el WebSocket local y el NOTIFY a los demás workers
+    corren en segundo plano. Si la entrega falla el mensaje ya está guardado y el cliente lo ve al recargar.
+    """
+    message_data, receptor_id = await run_db(_guardar_mensaje, chat_id, user_id, tipo, cuerpo_push, contenido, media_key)
+    entrega = asyncio.create_task(_entregar_mensaje(message_data, receptor_id))
+    _entregas.add(entrega)
+    entrega.add_done_callback(_entregas.discard)
+    return message_data
+
+@router.post("/{chat_id}/mensaje")
+async def send_message(chat_id: int, contenido: str = Form(...), user_id: int = Depends(get_session)):
+    try:
+        contenido = contenido.strip()
+        if not contenido: raise HTTPException(status_code=400, detail="Mensaje vacío")
+
+        return await _ingerir_mensaje(chat_id, user_id, 'texto', contenido, contenido)
+    except HTTPException as he: raise he
     except Exception as e:
-        if 'conn' in locals() and conn: conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{chat_id}/media")
@@ -531,77 +600,10 @@ async def send_media(chat_id: int, file: UploadFile = File(...), user_id: int =
         if not tipo:
             raise HTTPException(status_code=400, detail=f"Formato no soportado ({ext or content_type})")
 
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Archivo excede 20MB")
+        media_key = await _subir_archivo(file, "Archivo excede 20MB")
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT id, usuario1_id, usuario2_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
-            chat = cur.fetchone()
-            if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
-
-            receptor_id = chat[2] if chat[1] == user_id else chat[1]
-            verificar_bloqueo(cur, user_id, receptor_id)
-            
-            # 🔥 NUEVO: Obtener nombre y token para push
-            cur.execute("""
-                SELECT 
-                    (SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s),
-                    (SELECT fcm_token FROM usuarios WHERE id = %s)
-            """, (user_id, receptor_id))
-            row = cur.fetchone()
-            emisor_nombre = row[0] if row and row[0] else "Usuario"
-            fcm_token = row[1] if row and row[1] else None
-
-            cur.execute("""
-                INSERT INTO mensajes_chat (chat_id, emisor_id, receptor_id, tipo, media_content, fecha_envio)
-                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                RETURNING id, fecha_envio
-            """, (chat_id, user_id, receptor_id, tipo, psycopg2.Binary(file_content)))
-            mensaje = cur.fetchone()
-
-            cur.execute("UPDATE chats SET ultimo_mensaje_id = %s WHERE id = %s", (mensaje[0], chat_id))
-            conn.commit()
-
-            message_data = {
-                "id": mensaje[0], "chat_id": chat_id, "emisor_id": user_id, "receptor_id": receptor_id,
-                "contenido": "", "tipo": tipo, "media_url": f"/chats/media/{mensaje[0]}",
-                "fecha_envio": mensaje[1].strftime("%Y-%m-%d %H:%M:%S"), "leido": False, "es_mio": True
-            }
-            if receptor_id in websocket_connections:
-                try: await websocket_connections[receptor_id].send_text(json.dumps(message_data))
-                except: del websocket_connections[receptor_id]
-
-            # 🔥 NUEVO: ENVIAR PUSH NOTIFICATION (MEDIA) 🔥
-            if fcm_token:
-                cuerpo = "📷 Te ha enviado una foto." if tipo == 'imagen' else "🎥 Te ha enviado un video."
-                try:
-                    push_msg = messaging.Message(
-                        notification=messaging.Notification(
-                            title=f"Nuevo mensaje de {emisor_nombre}",
-                            body=cuerpo
-                        ),
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(sound="default")
-                            )
-                        ),
-                        data={"tipo": "chat", "chat_id": str(chat_id)},
-                        token=fcm_token,
-                    )
-                    messaging.send(push_msg)
-                except Exception as e:
-                    logging.error(f"Error enviando Push ({tipo}): {e}")
-
-            return message_data
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            cur.close()
-            conn.close()
+        cuerpo = "📷 Te ha enviado una foto." if tipo == 'imagen' else "🎥 Te ha enviado un video."
+        return await _ingerir_mensaje(chat_id, user_id, tipo, cuerpo, None, media_key)
     except HTTPException as he: raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -623,76 +625,9 @@ async def send_voice_note(chat_id: int, file: UploadFile = File(...), user_id: i
         if not es_audio:
             raise HTTPException(status_code=400, detail=f"No es un audio válido ({ext or content_type})")
 
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Audio muy grande")
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT id, usuario1_id, usuario2_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
-            chat = cur.fetchone()
-            if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
-
-            receptor_id = chat[2] if chat[1] == user_id else chat[1]
-            verificar_bloqueo(cur, user_id, receptor_id)
-            
-            # 🔥 NUEVO: Obtener nombre y token para push
-            cur.execute("""
-                SELECT 
-                    (SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s),
-                    (SELECT fcm_token FROM usuarios WHERE id = %s)
-            """, (user_id, receptor_id))
-            row = cur.fetchone()
-            emisor_nombre = row[0] if row and row[0] else "Usuario"
-            fcm_token = row[1] if row and row[1] else None
+        media_key = await _subir_archivo(file, "Audio muy grande")
 
-            cur.execute("""
-                INSERT INTO mensajes_chat (chat_id, emisor_id, receptor_id, tipo, media_content, fecha_envio)
-                VALUES (%s, %s, %s, 'voz', %s, CURRENT_TIMESTAMP)
-                RETURNING id, fecha_envio
-            """, (chat_id, user_id, receptor_id, psycopg2.Binary(file_content)))
-            mensaje = cur.fetchone()
-
-            cur.execute("UPDATE chats SET ultimo_mensaje_id = %s WHERE id = %s", (mensaje[0], chat_id))
-            conn.commit()
-
-            message_data = {
-                "id": mensaje[0], "chat_id": chat_id, "emisor_id": user_id, "receptor_id": receptor_id,
-                "contenido": "", "tipo": "voz", "media_url": f"/chats/media/{mensaje[0]}",
-                "fecha_envio": mensaje[1].strftime("%Y-%m-%d %H:%M:%S"), "leido": False, "es_mio": True
-            }
-            if receptor_id in websocket_connections:
-                try: await websocket_connections[receptor_id].send_text(json.dumps(message_data))
-                except: del websocket_connections[receptor_id]
-
-            # 🔥 NUEVO: ENVIAR PUSH NOTIFICATION (VOZ) 🔥
-            if fcm_token:
-                try:
-                    push_msg = messaging.Message(
-                        notification=messaging.Notification(
-                            title=f"Nuevo mensaje de {emisor_nombre}",
-                            body="🎙️ Te ha enviado una nota de voz."
-                        ),
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(sound="default")
-                            )
-                        ),
-                        data={"tipo": "chat", "chat_id": str(chat_id)},
-                        token=fcm_token,
-                    )
-                    messaging.send(push_msg)
-                except Exception as e:
-                    logging.error(f"Error enviando Push (voz): {e}")
-
-            return message_data
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            cur.close()
-            conn.close()
+        return await _ingerir_mensaje(chat_id, user_id, 'voz', "🎙️ Te ha enviado una nota de voz.", None, media_key)
     except HTTPException as he: raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -716,132 +651,160 @@ async def send_document(chat_id: int, file: UploadFile = File(...), contenido: s
         if not es_doc:
             raise HTTPException(status_code=400, detail=f"Documento no permitido ({ext})")
 
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="Documento excede 20MB")
+        media_key = await _subir_archivo(file, "Documento excede 20MB")
 
         doc_name = contenido if contenido else file.filename
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT id, usuario1_id, usuario2_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
-            chat = cur.fetchone()
-            if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
-
-            receptor_id = chat[2] if chat[1] == user_id else chat[1]
-            verificar_bloqueo(cur, user_id, receptor_id)
-            
-            # 🔥 NUEVO: Obtener nombre y token para push
-            cur.execute("""
-                SELECT 
-                    (SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s),
-                    (SELECT fcm_token FROM usuarios WHERE id = %s)
-            """, (user_id, receptor_id))
-            row = cur.fetchone()
-            emisor_nombre = row[0] if row and row[0] else "Usuario"
-            fcm_token = row[1] if row and row[1] else None
 
-            cur.execute("""
-                INSERT INTO mensajes_chat (chat_id, emisor_id, receptor_id, contenido, tipo, media_content, fecha_envio)
-                VALUES (%s, %s, %s, %s, 'document', %s, CURRENT_TIMESTAMP)
-                RETURNING id, fecha_envio
-            """, (chat_id, user_id, receptor_id, doc_name, psycopg2.Binary(file_content)))
-            mensaje = cur.fetchone()
-
-            cur.execute("UPDATE chats SET ultimo_mensaje_id = %s WHERE id = %s", (mensaje[0], chat_id))
-            conn.commit()
-
-            message_data = {
-                "id": mensaje[0], "chat_id": chat_id, "emisor_id": user_id, "receptor_id": receptor_id,
-                "contenido": doc_name, "tipo": "document", "media_url": f"/chats/media/{mensaje[0]}",
-                "fecha_envio": mensaje[1].strftime("%Y-%m-%d %H:%M:%S"), "leido": False, "es_mio": True
-            }
-            if receptor_id in websocket_connections:
-                try: await websocket_connections[receptor_id].send_text(json.dumps(message_data))
-                except: del websocket_connections[receptor_id]
-
-            # 🔥 NUEVO: ENVIAR PUSH NOTIFICATION (DOCUMENTO) 🔥
-            if fcm_token:
-                try:
-                    push_msg = messaging.Message(
-                        notification=messaging.Notification(
-                            title=f"Nuevo mensaje de {emisor_nombre}",
-                            body=f"📄 Te ha enviado un documento: {doc_name}"
-                        ),
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(sound="default")
-                            )
-                        ),
-                        data={"tipo": "chat", "chat_id": str(chat_id)},
-                        token=fcm_token,
-                    )
-                    messaging.send(push_msg)
-                except Exception as e:
-                    logging.error(f"Error enviando Push (documento): {e}")
-
-            return message_data
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            cur.close()
-            conn.close()
+        return await _ingerir_mensaje(chat_id, user_id, 'document', f"📄 Te ha enviado un documento: {doc_name}", doc_name, media_key)
     except HTTPException as he: raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Búsqueda por nombre del contacto (o del negocio, si tiene). Va siempre junto con l.user_id = %s: el recorrido
+# es el de idx_chats_lectura_bandeja sobre los chats del usuario y el LIKE solo filtra esas filas, así que un
+# índice sobre los nombres de todos los usuarios no ayudaría.
+CONDICION_NOMBRE = "LOWER(COALESCE(du.nombre_empresa, u.nombre)) LIKE %s"
+
+SQL_CHATS_USUARIO = """
+    SELECT c.id, 
+           u.id AS otro_usuario_id,
+           COALESCE(du.nombre_empresa, u.nombre) AS display_name,
+           CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END AS tipo_usuario,
+           m.contenido AS ultimo_mensaje, m.fecha_envio, m.tipo AS tipo_ultimo_mensaje,
+           l.no_leidos AS unread_count,
+           (du.foto_key IS NOT NULL OR du.foto IS NOT NULL) AS has_foto,
+           l.ultima_actividad
+    FROM chats_lectura l
+    JOIN chats c ON c.id = l.chat_id
+    JOIN usuarios u ON u.id = CASE WHEN c.usuario1_id = l.user_id THEN c.usuario2_id ELSE c.usuario1_id END
+    LEFT JOIN datos_usuario du ON u.id = du.user_id
+    LEFT JOIN mensajes_chat m ON c.ultimo_mensaje_id = m.id
+"""
+
+def _patron_like(texto: str) -> str:
+    # % y _ que escriba el usuario se buscan literalmente
+    texto = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{texto}%"
+
+def _fila_a_chat(row) -> dict:
+    return {
+        "chat_id": row[0], "otro_usuario_id": int(row[1]), "display_name": row[2], "tipo_usuario": row[3],
+        "foto_perfil_url": f"/chats/user/{row[1]}/foto_perfil" if row[3] == 'emprendedor' and row[8] else "",
+        "ultimo_mensaje": row[4] if row[4] else "", "fecha_envio": row[5].strftime("%Y-%m-%d %H:%M:%S") if row[5] else "",
+        "tipo_ultimo_mensaje": row[6] if row[6] else "texto", "unread_count": int(row[7])
+    }
+
 @router.get("/buscar")
-async def search_chats(query: str, user_id: int = Depends(get_session), limit: int = 10, offset: int = 0):
+def search_chats(query: str, user_id: int = Depends(get_session), limit: int = 10, offset: int = 0):
     try:
         query = query.strip().lower()
         if not query: raise HTTPException(status_code=400, detail="Búsqueda vacía")
 
+        patron = _patron_like(query)
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT c.id, 
-                   CASE WHEN c.usuario1_id = %s THEN c.usuario2_id ELSE c.usuario1_id END AS otro_usuario_id,
-                   COALESCE(du.nombre_empresa, u.nombre) AS display_name,
-                   CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END AS tipo_usuario,
-                   m.contenido AS ultimo_mensaje, m.fecha_envio, m.tipo AS tipo_ultimo_mensaje,
-                   SUM(CASE WHEN m.leido = FALSE AND m.receptor_id = %s THEN 1 ELSE 0 END) AS unread_count,
-                   du.foto IS NOT NULL AS has_foto
-            FROM chats c
-            JOIN usuarios u ON (CASE WHEN c.usuario1_id = %s THEN c.usuario2_id ELSE c.usuario1_id END) = u.id
-            LEFT JOIN datos_usuario du ON u.id = du.user_id
-            LEFT JOIN mensajes_chat m ON c.ultimo_mensaje_id = m.id
-            WHERE (c.usuario1_id = %s OR c.usuario2_id = %s)
-              AND (LOWER(COALESCE(du.nombre_empresa, u.nombre)) LIKE %s)
-            GROUP BY c.id, c.usuario1_id, c.usuario2_id, u.nombre, du.nombre_empresa, du.categoria, m.contenido, m.fecha_envio, m.tipo, du.foto
-            ORDER BY m.fecha_envio DESC NULLS LAST
+        cur.execute(SQL_CHATS_USUARIO + f"""
+            WHERE l.user_id = %s AND {CONDICION_NOMBRE}
+            ORDER BY l.ultima_actividad DESC, l.chat_id DESC
             LIMIT %s OFFSET %s
-        """, (user_id, user_id, user_id, user_id, user_id, f"%{query}%", limit, offset))
+        """, (user_id, patron, limit, offset))
         chats = cur.fetchall()
         cur.close()
         conn.close()
 
-        chats_list = [
-            {
-                "chat_id": row[0], "otro_usuario_id": int(row[1]), "display_name": row[2], "tipo_usuario": row[3],
-                "foto_perfil_url": f"/chats/user/{row[1]}/foto_perfil" if row[3] == 'emprendedor' and row[8] else "",
-                "ultimo_mensaje": row[4] if row[4] else "", "fecha_envio": row[5].strftime("%Y-%m-%d %H:%M:%S") if row[5] else "",
-                "tipo_ultimo_mensaje": row[6] if row[6] else "texto", "unread_count": int(row[7])
-            } for row in chats
-        ]
-        return chats_list
+        return [_fila_a_chat(row) for row in chats]
+    except HTTPException: raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/iniciar/{otro_usuario_id}")
-async def start_chat(otro_usuario_id: int, user_id: int = Depends(get_session)):
+def _codificar_cursor_chat(ultima_actividad, chat_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{ultima_actividad.isoformat()}|{chat_id}".encode()).decode()
+
+def _decodificar_cursor_chat(cursor: str | None):
+    """Cursor opaco -> (ultima_actividad, chat_id). None si no viene; 400 si está mal formado."""
+    if not cursor:
+        return None
     try:
-        if user_id == otro_usuario_id: raise HTTPException(status_code=400, detail="No auto-chat")
+        valor, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(valor), int(chat_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _buscar(user_id: int, q: str, limit: int, cursor, antes_de: int | None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        patron = _patron_like(q.lower())
+        condiciones = f"l.user_id = %s AND {CONDICION_NOMBRE}"
+        params = [user_id, patron]
+        if cursor:
+            condiciones += " AND (l.ultima_actividad, l.chat_id) < (%s, %s)"
+            params.extend(cursor)
+        # Uno de más para saber si hay otra página
+        cur.execute(SQL_CHATS_USUARIO + f"""
+            WHERE {condiciones}
+            ORDER BY l.ultima_actividad DESC, l.chat_id DESC
+            LIMIT %s
+        """, params + [limit + 1])
+        chats = cur.fetchall()
+        siguiente_chats = _codificar_cursor_chat(chats[limit - 1][9], chats[limit - 1][0]) if len(chats) > limit else None
+        chats = chats[:limit]
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
+        mensajes, siguiente_mensajes = [], None
+        if CHAT_BUSQUEDA_MENSAJES:
+            # tipo = 'texto' y la misma expresión que idx_mensajes_chat_busqueda; solo chats del usuario
+            cur.execute("""
+                SELECT m.id, m.chat_id, m.emisor_id, m.contenido, m.fecha_envio,
+                       u.id, COALESCE(du.nombre_empresa, u.nombre)
+                FROM mensajes_chat m
+                JOIN chats_lectura l ON l.chat_id = m.chat_id AND l.user_id = %s
+                JOIN chats c ON c.id = m.chat_id
+                JOIN usuarios u ON u.id = CASE WHEN c.usuario1_id = l.user_id THEN c.usuario2_id ELSE c.usuario1_id END
+                LEFT JOIN datos_usuario du ON u.id = du.user_id
+                WHERE m.tipo = 'texto'
+                  AND to_tsvector('es_unaccent', COALESCE(m.contenido, '')) @@ plainto_tsquery('es_unaccent', %s)
+                  AND (%s::bigint IS NULL OR m.id < %s)
+                ORDER BY m.id DESC
+                LIMIT %s
+            """, (user_id, q, antes_de, antes_de, limit + 1))
+            filas = cur.fetchall()
+            siguiente_mensajes = filas[limit - 1][0] if len(filas) > limit else None
+            mensajes = [
+                {
+                    "id": row[0], "chat_id": row[1], "emisor_id": int(row[2]), "contenido": row[3] or "",
+                    "fecha_envio": row[4].strftime("%Y-%m-%d %H:%M:%S"), "es_mio": row[2] == user_id,
+                    "otro_usuario_id": int(row[5]), "display_name": row[6]
+                } for row in filas[:limit]
+            ]
+
+        return {
+            "chats": [_fila_a_chat(row) for row in chats], "siguiente_chats": siguiente_chats,
+            "mensajes": mensajes, "antes_de": siguiente_mensajes, "busqueda_mensajes": CHAT_BUSQUEDA_MENSAJES
+        }
+    finally:
+        cur.close()
+        conn.close()
+
+# Chats por nombre del contacto y, si CHAT_BUSQUEDA_MENSAJES está activo, mensajes que contienen el texto.
+# Cada lista pagina por su lado: `cursor` = siguiente_chats (ultima_actividad, chat_id) y `antes_de` = id del
+# último mensaje encontrado.
+@router.get("/busqueda")
+async def search_chats_and_messages(q: str, user_id: int = Depends(get_session), limit: int = 20,
+                                    cursor: str | None = None, antes_de: int | None = None):
+    q = q.strip()
+    if not q: raise HTTPException(status_code=400, detail="Búsqueda vacía")
+    limit = max(1, min(limit, 50))
+    try:
+        return await run_db(_buscar, user_id, q, limit, _decodificar_cursor_chat(cursor), antes_de)
+    except HTTPException: raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _obtener_o_crear_chat(user_id: int, otro_usuario_id: int):
+    """Devuelve (chat_id, es_nuevo)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
         verificar_bloqueo(cur, user_id, otro_usuario_id)
 
         cur.execute("SELECT id FROM usuarios WHERE id = %s", (otro_usuario_id,))
@@ -853,111 +816,143 @@ async def start_chat(otro_usuario_id: int, user_id: int = Depends(get_session)):
         """, (user_id, otro_usuario_id, otro_usuario_id, user_id))
         chat = cur.fetchone()
         if chat: 
-            cur.close()
-            conn.close()
-            return {"chat_id": chat[0]}
+            return chat[0], False
 
         cur.execute("""
             INSERT INTO chats (usuario1_id, usuario2_id, creado_en)
             VALUES (%s, %s, CURRENT_TIMESTAMP)
-            RETURNING id
+            RETURNING id, creado_en
         """, (user_id, otro_usuario_id))
-        chat_id = cur.fetchone()[0]
+        chat_id, creado_en = cur.fetchone()
+        cur.execute("""
+            INSERT INTO chats_lectura (user_id, chat_id, ultima_actividad) VALUES (%s, %s, %s), (%s, %s, %s)
+            ON CONFLICT DO NOTHING
+        """, (user_id, chat_id, creado_en, otro_usuario_id, chat_id, creado_en))
         conn.commit()
+        return chat_id, True
+    finally:
+        cur.close()
+        conn.close()
+
+@router.post("/iniciar/{otro_usuario_id}")
+async def start_chat(otro_usuario_id: int, user_id: int = Depends(get_session)):
+    try:
+        if user_id == otro_usuario_id: raise HTTPException(status_code=400, detail="No auto-chat")
+
+        chat_id, es_nuevo = await run_db(_obtener_o_crear_chat, user_id, otro_usuario_id)
+        if not es_nuevo:
+            return {"chat_id": chat_id}
 
         message_data = {"chat_id": chat_id, "otro_usuario_id": user_id, "tipo": "nuevo_chat", "fecha_creacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-        if otro_usuario_id in websocket_connections:
-            try: await websocket_connections[otro_usuario_id].send_text(json.dumps(message_data))
-            except: del websocket_connections[otro_usuario_id]
+        await _entregar_mensaje(message_data, otro_usuario_id)
 
-        cur.close()
-        conn.close()
         return {"chat_id": chat_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/{chat_id}")
-async def delete_chat(chat_id: int, user_id: int = Depends(get_session)):
+def _eliminar_chat(chat_id: int, user_id: int):
+    """Borra el chat y sus mensajes. Devuelve el id del otro participante."""
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
         cur.execute("SELECT id, usuario1_id, usuario2_id FROM chats WHERE id = %s AND (usuario1_id = %s OR usuario2_id = %s)", (chat_id, user_id, user_id))
         chat = cur.fetchone()
         if not chat: raise HTTPException(status_code=404, detail="Chat no encontrado")
 
         receptor_id = chat[2] if chat[1] == user_id else chat[1]
         cur.execute("DELETE FROM mensajes_chat WHERE chat_id = %s", (chat_id,))
+        cur.execute("DELETE FROM chats_lectura WHERE chat_id = %s", (chat_id,))
         cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
         conn.commit()
+        return receptor_id
+    finally:
+        cur.close()
+        conn.close()
+
+@router.delete("/{chat_id}")
+async def delete_chat(chat_id: int, user_id: int = Depends(get_session)):
+    try:
+        receptor_id = await run_db(_eliminar_chat, chat_id, user_id)
 
         message_data = {"chat_id": chat_id, "otro_usuario_id": user_id, "tipo": "chat_deleted", "fecha_eliminacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-        if receptor_id in websocket_connections:
-            try: await websocket_connections[receptor_id].send_text(json.dumps(message_data))
-            except: del websocket_connections[receptor_id]
+        await _entregar_mensaje(message_data, receptor_id)
 
-        cur.close()
-        conn.close()
         return {"message": "Chat eliminado"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _usuario_existe(user_id: int) -> bool:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM usuarios WHERE id = %s", (user_id,))
+        existe = cur.fetchone() is not None
+        cur.close()
+        return existe
+    finally:
+        conn.close()
+
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     await websocket.accept()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM usuarios WHERE id = %s", (user_id,))
-        if not cur.fetchone():
+        if not await run_db(_usuario_existe, user_id):
             await websocket.close(code=1008, reason="Usuario no encontrado")
             return
-        cur.close()
-        conn.close()
 
-        websocket_connections[user_id] = websocket
+        # Todos los sockets del usuario (celular, web, otra pestaña) quedan registrados y reciben
+        conexion = hub_chat.registrar(websocket, user_id)
         try:
             while True:
-                await websocket.receive_text()
-                await websocket.send_text(json.dumps({"type": "ping"}))
+                texto = await websocket.receive_text()
+                if conexion.recibido(texto):
+                    continue  # "pong" del heartbeat: solo cuenta como actividad
+                # La respuesta pasa por la cola del socket para no escribir a la vez que su tarea de envío
+                conexion.encolar(json.dumps({"type": "ping"}))
         except WebSocketDisconnect:
-            if user_id in websocket_connections: del websocket_connections[user_id]
+            pass
         except Exception:
-            if user_id in websocket_connections: del websocket_connections[user_id]
+            pass
+        finally:
+            await hub_chat.desconectar(conexion)
     except Exception as e:
         logging.error(f"Error WS: {e}")
         await websocket.close(code=1008)
 
 @router.get("/user/{user_id}/foto_perfil")
-async def get_user_profile_picture(user_id: int):
+def get_user_profile_picture(user_id: int, request: Request):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END, du.foto
+            SELECT CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
+                   du.foto_key, CASE WHEN du.foto_key IS NULL THEN du.foto END
             FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
         """, (user_id,))
         result = cur.fetchone()
         cur.close()
         conn.close()
 
-        if not result or result[0] != 'emprendedor' or not result[1]:
+        if result and result[0] == 'emprendedor' and result[1]:
+            return media_store.respuesta(request, result[1], "image/jpeg")
+        if not result or result[0] != 'emprendedor' or not result[2]:
             try:
                 with open("default_profile.jpg", "rb") as f: default_foto = f.read()
                 return StreamingResponse(io.BytesIO(default_foto), media_type="image/jpeg")
             except: raise HTTPException(status_code=404)
 
-        return StreamingResponse(io.BytesIO(result[1]), media_type="image/jpeg")
+        return StreamingResponse(io.BytesIO(result[2]), media_type="image/jpeg")
+    except HTTPException: raise
+    except FileNotFoundError: raise HTTPException(status_code=404, detail="Archivo no encontrado")
     except Exception: raise HTTPException(status_code=500)
 
 @router.get("/unread_count")
-async def get_unread_count(user_id: int = Depends(get_session)):
+def get_unread_count(user_id: int = Depends(get_session)):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT COUNT(*) FROM mensajes_chat m JOIN chats c ON m.chat_id = c.id
-            WHERE m.receptor_id = %s AND m.leido = FALSE AND (c.usuario1_id = %s OR c.usuario2_id = %s)
-        """, (user_id, user_id, user_id))
+        # Suma de los contadores de chats_lectura: un rango de la PK, sin tocar mensajes_chat
+        cur.execute("SELECT COALESCE(SUM(no_leidos), 0) FROM chats_lectura WHERE user_id = %s", (user_id,))
         count = cur.fetchone()[0]
         cur.close()
         conn.close()
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Request, Form, UploadFile, File, HTTPException, Header, Response
 from fastapi.responses import RedirectResponse, JSONResponse
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, get_db_connection, run_db
+from media_store import store as media_store
 from models import DatosUsuario
 from fastapi.templating import Jinja2Templates
-import psycopg2
 import base64
 import logging
 
@@ -14,19 +14,57 @@ router = APIRouter()
 templates = Jinja2Templates(directory=".")
 templates.env.filters["b64encode"] = lambda data: base64.b64encode(data).decode('utf-8') if data else ""
 
-# Tu conexión original para la parte WEB (No la borramos)
-def get_db_connection():
-    return psycopg2.connect(
-        host="localhost",
-        database="prendia_db",
-        user="postgres",
-        password="Elbicho7",
-    )
-
 # ==============================================================================
 #  SECCIÓN 1: RUTAS WEB (HTML/JINJA2) - ESTO ES TU CÓDIGO ORIGINAL
 # ==============================================================================
 
+# --- Trabajo de BD con SQLAlchemy (síncrono): las rutas async lo mandan a run_db ---
+
+def _insertar_datos(user_id, campos, foto):
+    foto_key = media_store.guardar(foto, "image/jpeg") if foto else None
+    db: Session = SessionLocal()
+    try:
+        db.add(DatosUsuario(user_id=user_id, foto_key=foto_key, **campos))
+        db.commit()
+    finally:
+        db.close()
+
+def _actualizar_datos(user_id, campos, foto):
+    """Actualiza el registro existente; None si el usuario no tiene datos. foto=None conserva la actual."""
+    db: Session = SessionLocal()
+    try:
+        datos_usuario = db.query(DatosUsuario).filter(DatosUsuario.user_id == user_id).first()
+        if not datos_usuario:
+            return None
+
+        for campo, valor in campos.items():
+            setattr(datos_usuario, campo, valor)
+        if foto:
+            datos_usuario.foto_key = media_store.guardar(foto, "image/jpeg")
+            datos_usuario.foto = None
+
+        db.commit()
+        db.refresh(datos_usuario)
+
+        respuesta = {campo: getattr(datos_usuario, campo) for campo in campos}
+        if foto:
+            respuesta["foto"] = foto
+        elif datos_usuario.foto_key:
+            respuesta["foto"] = media_store.leer(datos_usuario.foto_key)
+        else:
+            respuesta["foto"] = datos_usuario.foto
+        return respuesta
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _guardar_datos_api(user_id, campos, foto):
+    """Upsert del perfil desde la app: actualiza si existe, si no lo crea."""
+    if _actualizar_datos(user_id, campos, foto) is None:
+        _insertar_datos(user_id, campos, foto)
+
 @router.post("/guardar_datos")
 async def guardar_datos(
     request: Request,
@@ -46,29 +84,27 @@ async def guardar_datos(
         return RedirectResponse(url="/login", status_code=302)
 
     contenido_foto = await foto.read() if foto else None
-    db: Session = SessionLocal()
-
-    nuevo_dato = DatosUsuario(
-        user_id=user["id"],
-        nombre_empresa=nombre_empresa,
-        direccion=direccion,
-        ubicacion_google_maps=ubicacion_google_maps,
-        telefono=telefono,
-        horario=horario,
-        categoria=categoria,
-        otra_categoria=otra_categoria,
-        servicios=servicios,
-        sitio_web=sitio_web,
-        foto=contenido_foto
+    await run_db(
+        _insertar_datos,
+        user["id"],
+        dict(
+            nombre_empresa=nombre_empresa,
+            direccion=direccion,
+            ubicacion_google_maps=ubicacion_google_maps,
+            telefono=telefono,
+            horario=horario,
+            categoria=categoria,
+            otra_categoria=otra_categoria,
+            servicios=servicios,
+            sitio_web=sitio_web,
+        ),
+        contenido_foto,
     )
-    db.add(nuevo_dato)
-    db.commit()
-    db.close()
 
     return RedirectResponse(url="/perfil", status_code=302)
 
 @router.get("/perfil")
-async def perfil(request: Request):
+def perfil(request: Request):
     try:
         if 'user' in request.session and 'id' in request.session['user']:
             user_id = request.session['user']['id']
@@ -76,12 +112,16 @@ async def perfil(request: Request):
             cur = conn.cursor()
             cur.execute(""" SELECT * FROM datos_usuario WHERE user_id = %s; """, (user_id,))
             datos_usuario = cur.fetchone()
+            columnas = [col[0] for col in cur.description]
             cur.close()
             conn.close()
-            if datos_usuario and datos_usuario[11]:
-                foto_base64 = base64.b64encode(datos_usuario[11]).decode('utf-8')
-                datos_usuario = list(datos_usuario)
-                datos_usuario[11] = foto_base64
+            if datos_usuario:
+                # La foto puede estar en el media store (foto_key) o todavía en la columna vieja (índice 11)
+                foto_key = datos_usuario[columnas.index("foto_key")] if "foto_key" in columnas else None
+                foto = media_store.leer(foto_key) if foto_key else datos_usuario[11]
+                if foto:
+                    datos_usuario = list(datos_usuario)
+                    datos_usuario[11] = base64.b64encode(foto).decode('utf-8')
             return templates.TemplateResponse("perfil.html", {"request": request, "datos_usuario": datos_usuario})
         else:
             return RedirectResponse(url="/login")
@@ -108,55 +148,42 @@ async def actualizar_perfil(
         raise HTTPException(status_code=401, detail="No autorizado")
 
     user_id = user["id"]
-    db: Session = SessionLocal()
     try:
-        # Buscar el registro existente
-        datos_usuario = db.query(DatosUsuario).filter(DatosUsuario.user_id == user_id).first()
-        if not datos_usuario:
-            raise HTTPException(status_code=404, detail="No se encontraron datos para este usuario")
-
         # Leer la foto si se proporcionó
-        contenido_foto = await foto.read() if foto else datos_usuario.foto
         if foto and not foto.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
+        contenido_foto = await foto.read() if foto else None
 
         # Actualizar los campos
-        datos_usuario.nombre_empresa = nombre_empresa
-        datos_usuario.direccion = direccion
-        datos_usuario.ubicacion_google_maps = ubicacion_google_maps
-        datos_usuario.telefono = telefono
-        datos_usuario.horario = horario
-        datos_usuario.categoria = categoria
-        datos_usuario.otra_categoria = otra_categoria
-        datos_usuario.servicios = servicios
-        datos_usuario.sitio_web = sitio_web
-        datos_usuario.foto = contenido_foto
-
-        db.commit()
-        db.refresh(datos_usuario)
+        datos_usuario = await run_db(
+            _actualizar_datos,
+            user_id,
+            dict(
+                nombre_empresa=nombre_empresa,
+                direccion=direccion,
+                ubicacion_google_maps=ubicacion_google_maps,
+                telefono=telefono,
+                horario=horario,
+                categoria=categoria,
+                otra_categoria=otra_categoria,
+                servicios=servicios,
+                sitio_web=sitio_web,
+            ),
+            contenido_foto,
+        )
+        if datos_usuario is None:
+            raise HTTPException(status_code=404, detail="No se encontraron datos para este usuario")
 
         # Preparar la respuesta JSON para el frontend WEB
-        response_data = {
-            "nombre_empresa": datos_usuario.nombre_empresa,
-            "direccion": datos_usuario.direccion,
-            "ubicacion_google_maps": datos_usuario.ubicacion_google_maps,
-            "telefono": datos_usuario.telefono,
-            "horario": datos_usuario.horario,
-            "categoria": datos_usuario.categoria,
-            "otra_categoria": datos_usuario.otra_categoria,
-            "servicios": datos_usuario.servicios,
-            "sitio_web": datos_usuario.sitio_web,
-            "foto_perfil": f"data:image/jpeg;base64,{base64.b64encode(datos_usuario.foto).decode('utf-8')}" if datos_usuario.foto else None
-        }
+        foto_guardada = datos_usuario.pop("foto")
+        response_data = dict(datos_usuario)
+        response_data["foto_perfil"] = f"data:image/jpeg;base64,{base64.b64encode(foto_guardada).decode('utf-8')}" if foto_guardada else None
         return JSONResponse(content=response_data)
     except HTTPException as he:
         raise he
     except Exception as e:
-        db.rollback()
         logging.error(f"Error al actualizar datos: {e}")
         raise HTTPException(status_code=422, detail=str(e))
-    finally:
-        db.close()
 
 
 # ==============================================================================
@@ -207,25 +234,11 @@ async def actualizar_perfil_api(
         if not foto.content_type.startswith('image/'):
              raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
 
-    db: Session = SessionLocal()
     try:
-        datos_usuario = db.query(DatosUsuario).filter(DatosUsuario.user_id == user_id).first()
-
-        if datos_usuario:
-            datos_usuario.nombre_empresa = nombre_empresa
-            datos_usuario.direccion = direccion
-            datos_usuario.ubicacion_google_maps = ubicacion_google_maps
-            datos_usuario.telefono = telefono
-            datos_usuario.horario = horario
-            datos_usuario.categoria = categoria
-            datos_usuario.otra_categoria = otra_categoria
-            datos_usuario.servicios = servicios
-            datos_usuario.sitio_web = sitio_web
-            if contenido_foto:
-                datos_usuario.foto = contenido_foto
-        else:
-            nuevo_dato = DatosUsuario(
-                user_id=user_id,
+        await run_db(
+            _guardar_datos_api,
+            user_id,
+            dict(
                 nombre_empresa=nombre_empresa,
                 direccion=direccion,
                 ubicacion_google_maps=ubicacion_google_maps,
@@ -235,32 +248,32 @@ async def actualizar_perfil_api(
                 otra_categoria=otra_categoria,
                 servicios=servicios,
                 sitio_web=sitio_web,
-                foto=contenido_foto
-            )
-            db.add(nuevo_dato)
-
-        db.commit()
+            ),
+            contenido_foto,
+        )
         return JSONResponse(content={"status": "ok", "message": "Perfil guardado correctamente"}, status_code=200)
 
     except Exception as e:
-        db.rollback()
         logging.error(f"Error API actualizar: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
-    finally:
-        db.close()
 
 # 2. Endpoint IMPORTANTE: Sirve la imagen como archivo JPG para que Flutter la pueda leer
 @router.get("/api/imagenes/perfil/{user_id}")
-def obtener_imagen_perfil(user_id: int):
+def obtener_imagen_perfil(user_id: int, request: Request):
     db = SessionLocal()
     try:
         datos = db.query(DatosUsuario).filter(DatosUsuario.user_id == user_id).first()
         
+        if datos and datos.foto_key:
+            return media_store.respuesta(request, datos.foto_key, "image/jpeg")
         if datos and datos.foto:
             # RETORNAMOS LOS BYTES DIRECTAMENTE
             return Response(content=datos.foto, media_type="image/jpeg")
         else:
             return Response(status_code=404)
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        return Response(status_code=404)
     except Exception as e:
         logging.error(f"Error sirviendo imagen: {e}")
         return Response(status_code=500)
@@ -275,7 +288,7 @@ def obtener_imagen_perfil(user_id: int):
 # ==============================================================================
 
 @router.get("/api/perfil/{user_id}")
-async def perfil_api_combo(user_id: int):
+def perfil_api_combo(user_id: int):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -291,7 +304,7 @@ async def perfil_api_combo(user_id: int):
                    du.otra_categoria, 
                    du.servicios, 
                    du.sitio_web,
-                   du.foto
+                   (du.foto_key IS NOT NULL OR du.foto IS NOT NULL)
             FROM usuarios u
             LEFT JOIN datos_usuario du ON u.id = du.user_id
             WHERE u.id = %s
@@ -324,7 +337,10 @@ async def perfil_api_combo(user_id: int):
 
         # 2. BUSCAR PUBLICACIONES (Lo que te faltaba: Igual que /user/{id}/publicaciones)
         cur.execute("""
-            SELECT id, contenido, imagen, video, fecha_creacion
+            SELECT id, contenido,
+                   (imagen_key IS NOT NULL OR imagen IS NOT NULL),
+                   (video_key IS NOT NULL OR video IS NOT NULL),
+                   fecha_creacion
             FROM publicaciones 
             WHERE user_id = %s
             ORDER BY fecha_creacion DESC
@@ -336,7 +352,7 @@ async def perfil_api_combo(user_id: int):
         for row in posts_rows:
             # Construir URL de la imagen del post
             post_img_url = ""
-            if row[2]: # Si la columna 'imagen' tiene datos (bytes)
+            if row[2]: # Si el post tiene imagen (media store o columna vieja)
                 post_img_url = f"/media/{row[0]}" 
             
             posts_list.append({
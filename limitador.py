@@ -0,0 +1,34 @@
+# limitador.py
+# Token bucket para no pasarnos de la cuota de FCM: `tasa` envíos por segundo en promedio,
+# con ráfagas de hasta `rafaga`. Es seguro entre hilos (los lotes multicast salen en paralelo).
+import threading
+import time
+
+
+class LimitadorTasa:
+    def __init__(self, tasa: float, rafaga: float = None):
+        if tasa <= 0:
+            raise ValueError("La tasa debe ser mayor que cero")
+        self.tasa = float(tasa)
+        self.rafaga = float(rafaga if rafaga is not None else tasa)
+        self._disponibles = self.rafaga
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._disponibles = min(self.rafaga, self._disponibles + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def esperar(self, cantidad: float = 1):
+        """Bloquea hasta poder gastar `cantidad` fichas. Un lote más grande que la ráfaga se cobra por partes."""
+        while cantidad > 0:
+            parte = min(cantidad, self.rafaga)
+            with self._lock:
+                self._recargar()
+                if self._disponibles >= parte:
+                    self._disponibles -= parte
+                    cantidad -= parte
+                    continue
+                falta = (parte - self._disponibles) / self.tasa
+            time.sleep(falta)
@@ -0,0 +1,184 @@
+# mailer.py
+# Envío masivo de correo con un pool pequeño de conexiones SMTP persistentes.
+#
+#   plantilla = PlantillaCorreo("Asunto", "<p>html</p>")   -> el MIME se arma una sola vez
+#   with Mailer(conexiones=3, tasa=10) as mailer:
+#       metricas = mailer.enviar(plantilla, ["a@x.com", "b@y.com"])
+#
+# Cada conexión hace login una vez y se reutiliza para todos sus mensajes; si el servidor la cierra
+# (Gmail corta sesiones largas) se reconecta y se reintenta ese mensaje una vez. `tasa` limita los
+# mensajes por segundo entre todas las conexiones. Lo usan campanas.py y cualquier correo que mande la app.
+import logging
+import os
+import queue
+import smtplib
+import socket
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import SMTP as POLICY_SMTP
+
+from limitador import LimitadorTasa
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "prendiax@gmail.com")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "ekux nkus emdm azcv")  # contraseña de aplicación
+SMTP_CONEXIONES = int(os.getenv("SMTP_CONEXIONES", "3"))
+SMTP_TASA = float(os.getenv("SMTP_TASA", "0"))  # mensajes por segundo; 0 = sin límite
+SMTP_SOLO_IPV4 = os.getenv("SMTP_SOLO_IPV4", "1") == "1"
+
+# Errores que indican que la conexión murió (no el destinatario): se reconecta y se reintenta
+ERRORES_CONEXION = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, socket.timeout)
+
+
+def _forzar_ipv4():
+    # El servidor no tiene salida por IPv6 (errno 99 / 101 al conectar a Gmail): solo direcciones IPv4
+    original = socket.getaddrinfo
+    if getattr(original, "_solo_ipv4", False):
+        return
+
+    def getaddrinfo_ipv4(*args, **kwargs):
+        return [r for r in original(*args, **kwargs) if r[0] == socket.AF_INET]
+
+    getaddrinfo_ipv4._solo_ipv4 = True
+    socket.getaddrinfo = getaddrinfo_ipv4
+
+
+class PlantillaCorreo:
+    """
+    Asunto + HTML serializados una sola vez. Por destinatario solo se antepone la cabecera To,
+    en lugar de volver a armar y codificar el MIME completo en cada envío.
+    """
+
+    def __init__(self, asunto: str, html: str, remitente: str = None):
+        self.remitente = remitente or SMTP_USER
+        self.asunto = asunto
+        self.html = html
+        self._base = self._armar(None).as_bytes()
+
+    def _armar(self, destinatario):
+        msg = MIMEMultipart(policy=POLICY_SMTP)
+        msg["From"] = f"PrendiaX <{self.remitente}>"
+        if destinatario:
+            msg["To"] = destinatario
+        msg["Subject"] = self.asunto
+        msg.attach(MIMEText(self.html, "html", policy=POLICY_SMTP))
+        return msg
+
+    def para(self, destinatario: str) -> bytes:
+        if destinatario.isascii():
+            return b"To: " + destinatario.encode("ascii") + b"\r\n" + self._base
+        # Direcciones con caracteres no ASCII: que email.policy se encargue de codificarlas
+        return self._armar(destinatario).as_bytes()
+
+
+class _ConexionSMTP:
+    def __init__(self, servidor: str, puerto: int, usuario: str, password: str, starttls: bool):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.starttls = starttls
+        self.smtp = None
+
+    def conectar(self):
+        self.cerrar()
+        smtp = smtplib.SMTP(self.servidor, self.puerto, timeout=30)
+        smtp.ehlo()
+        if self.starttls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self.usuario:
+            smtp.login(self.usuario, self.password)
+        self.smtp = smtp
+
+    def enviar(self, remitente: str, destinatario: str, datos: bytes):
+        if self.smtp is None:
+            self.conectar()
+        try:
+            self.smtp.sendmail(remitente, [destinatario], datos)
+        except ERRORES_CONEXION:
+            logging.info(f"Conexión SMTP con {self.servidor} perdida, reconectando")
+            self.conectar()
+            self.smtp.sendmail(remitente, [destinatario], datos)
+
+    def cerrar(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+
+class Mailer:
+    def __init__(self, conexiones: int = SMTP_CONEXIONES, tasa: float = SMTP_TASA, servidor: str = SMTP_SERVER,
+                 puerto: int = SMTP_PORT, usuario: str = SMTP_USER, password: str = SMTP_PASSWORD,
+                 starttls: bool = True, solo_ipv4: bool = SMTP_SOLO_IPV4):
+        if solo_ipv4:
+            _forzar_ipv4()
+        self.conexiones = max(1, conexiones)
+        self.limitador = LimitadorTasa(tasa) if tasa else None
+        # Las conexiones se abren al primer envío que las toma, no al crear el Mailer
+        self._pool = queue.Queue()
+        for _ in range(self.conexiones):
+            self._pool.put(_ConexionSMTP(servidor, puerto, usuario, password, starttls))
+
+    def _enviar_uno(self, plantilla: PlantillaCorreo, destinatario: str):
+        if self.limitador:
+            self.limitador.esperar()
+        conexion = self._pool.get()
+        try:
+            conexion.enviar(plantilla.remitente, destinatario, plantilla.para(destinatario))
+            return None
+        except smtplib.SMTPAuthenticationError:
+            raise  # credenciales malas: no tiene caso seguir con el resto
+        except Exception as e:
+            if isinstance(e, ERRORES_CONEXION):
+                conexion.cerrar()
+            return e
+        finally:
+            self._pool.put(conexion)
+
+    def enviar(self, plantilla: PlantillaCorreo, destinatarios: list) -> dict:
+        """
+        Manda la plantilla a cada destinatario repartiendo entre las conexiones del pool. Bloquea hasta terminar.
+        Devuelve métricas; "fallidos" trae (destinatario, excepción) de cada correo que no salió.
+        """
+        destinatarios = [d for d in dict.fromkeys(destinatarios) if d]
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.conexiones, max(1, len(destinatarios))),
+                                thread_name_prefix="smtp") as executor:
+            resultados = list(executor.map(lambda d: self._enviar_uno(plantilla, d), destinatarios))
+
+        errores = Counter()
+        fallidos = []
+        for destinatario, error in zip(destinatarios, resultados):
+            if error is not None:
+                errores[type(error).__name__] += 1
+                fallidos.append((destinatario, error))
+        segundos = round(time.perf_counter() - inicio, 2)
+        metricas = {
+            "correos": len(destinatarios), "enviados": len(destinatarios) - len(fallidos), "fallas": len(fallidos),
+            "errores": errores, "fallidos": fallidos, "segundos": segundos,
+            "correos_por_segundo": round(len(destinatarios) / segundos, 1) if segundos else 0.0,
+        }
+        logging.info(
+            f"✉️ Correo '{plantilla.asunto}': {metricas['enviados']} ok / {metricas['fallas']} fallas en {segundos}s "
+            f"({metricas['correos_por_segundo']} correos/s, {self.conexiones} conexiones), errores: {dict(errores)}"
+        )
+        return metricas
+
+    def cerrar(self):
+        # Se cierran pero se quedan en el pool: el siguiente envío las vuelve a abrir
+        for conexion in list(self._pool.queue):
+            conexion.cerrar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
@@ -4,7 +4,6 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-import psycopg2
 import logging
 import os
 from auth_google import router as google_router
@@ -20,6 +19,11 @@ import firebase_admin
 from firebase_admin import credentials
 import admin
 from download import router as download_router
+import asyncio
+import database
+import bloqueos
+import pubsub
+import ws_hub
 
 # --- Configurar logs ---
 logging.basicConfig(level=logging.DEBUG)
@@ -40,21 +44,6 @@ class UserProfile(BaseModel):
     nombre_empresa: str
     email: Optional[str] = None
 
-# --- Conexión a la base de datos PostgreSQL ---
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        logging.debug("Conexión a la base de datos establecida correctamente")
-        return conn
-    except Exception as e:
-        logging.error(f"Error al conectar a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
-
 # --- Configuración general ---
 app = FastAPI()
 templates = Jinja2Templates(directory=".")
@@ -65,6 +54,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
     allow_credentials=True,
+    expose_headers=["X-Next-Cursor"],  # cursor de paginación de los listados
 )
 
 
@@ -80,6 +70,33 @@ app.include_router(admin.router)
 app.include_router(download_router)
 
 
+# --- Pool de conexiones compartido ---
+@app.on_event("startup")
+def abrir_pool_db():
+    try:
+        database.pool.warmup()
+        logging.info(f"Pool de BD listo: {database.get_pool_stats()}")
+    except Exception as e:
+        # No tumbamos el arranque: el pool abrirá conexiones bajo demanda
+        logging.error(f"⚠️ No se pudo precalentar el pool de BD: {e}")
+    # Invalida la caché de bloqueos cuando otro worker registra uno (LISTEN/NOTIFY)
+    bloqueos.iniciar_escucha()
+
+@app.on_event("startup")
+async def iniciar_pubsub():
+    # Hilo de LISTEN/NOTIFY: bloqueos y reenvío de eventos de WebSocket desde otros workers
+    pubsub.iniciar(asyncio.get_running_loop())
+    # Heartbeat del servidor y barrido de sockets muertos
+    ws_hub.iniciar_barrido()
+
+@app.on_event("shutdown")
+def cerrar_pool_db():
+    ws_hub.detener_barrido()
+    pubsub.detener()
+    database.shutdown_db_executor()
+    database.pool.closeall()
+
+
 # --- Rutas principales ---
 @app.get("/")
 def home():
@@ -0,0 +1,276 @@
+# mantenimiento.py
+# Tareas periódicas de mantenimiento de datos (para cron o para correr a mano).
+#
+# Uso:
+#   python mantenimiento.py contadores   -> reconcilia interesados_count / comentarios_count
+#   python mantenimiento.py etiquetas    -> reconstruye etiquetas_conteo (tags en tendencia)
+#   python mantenimiento.py notificaciones -> reconcilia notificaciones_contadores (total / no leídas)
+#   python mantenimiento.py chats        -> reconcilia chats_lectura (no leídos y última actividad por chat)
+#   python mantenimiento.py despertador  -> notificación "despertador" a usuarios inactivos (push_worker.py
+#                                           también la corre cada DESPERTADOR_INTERVALO segundos)
+import argparse
+import logging
+import os
+
+from database import get_db_connection
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DESPERTADOR_LOTE = int(os.getenv("DESPERTADOR_LOTE", "5000"))
+DESPERTADOR_VENTANA_HORAS = int(os.getenv("DESPERTADOR_VENTANA_HORAS", "24"))
+
+# Recalcula cada contador desde su tabla de origen y solo toca las filas que se desviaron.
+# Los triggers mantienen los contadores al día; esto corrige deriva (restores, borrados manuales, etc.)
+RECONCILIAR_INTERESADOS = """
+    UPDATE publicaciones p SET interesados_count = c.total
+    FROM (
+        SELECT p2.id, COUNT(i.publicacion_id) AS total
+        FROM publicaciones p2
+        LEFT JOIN intereses i ON i.publicacion_id = p2.id
+        GROUP BY p2.id
+    ) c
+    WHERE c.id = p.id AND p.interesados_count IS DISTINCT FROM c.total
+"""
+
+RECONCILIAR_COMENTARIOS = """
+    UPDATE publicaciones p SET comentarios_count = c.total
+    FROM (
+        SELECT p2.id, COUNT(co.publicacion_id) AS total
+        FROM publicaciones p2
+        LEFT JOIN comentarios co ON co.publicacion_id = p2.id
+        GROUP BY p2.id
+    ) c
+    WHERE c.id = p.id AND p.comentarios_count IS DISTINCT FROM c.total
+"""
+
+# etiquetas_conteo guarda cuántas publicaciones usan cada etiqueta por día (trigger contar_etiquetas).
+# Se recalcula desde etiquetas_norm: borra los días que ya no existen y corrige solo lo que cambió.
+RECONCILIAR_ETIQUETAS = """
+    WITH reales AS (
+        SELECT e.etiqueta, p.fecha_creacion::date AS dia, COUNT(*) AS total
+        FROM publicaciones p, unnest(p.etiquetas_norm) AS e(etiqueta)
+        GROUP BY e.etiqueta, p.fecha_creacion::date
+    ), sobrantes AS (
+        DELETE FROM etiquetas_conteo c
+        WHERE NOT EXISTS (SELECT 1 FROM reales r WHERE r.etiqueta = c.etiqueta AND r.dia = c.dia)
+    )
+    INSERT INTO etiquetas_conteo (etiqueta, dia, publicaciones)
+    SELECT etiqueta, dia, total FROM reales
+    ON CONFLICT (etiqueta, dia) DO UPDATE SET publicaciones = EXCLUDED.publicaciones
+    WHERE etiquetas_conteo.publicaciones IS DISTINCT FROM EXCLUDED.publicaciones
+"""
+
+
+# notificaciones_contadores guarda por usuario cuántas notificaciones tiene y cuántas sin leer
+# (trigger contar_notificaciones). Se recalcula desde notifications y solo se tocan los usuarios desviados.
+RECONCILIAR_NOTIFICACIONES = """
+    WITH reales AS (
+        SELECT user_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE leida = FALSE) AS no_leidas
+        FROM notifications
+        GROUP BY user_id
+    ), sobrantes AS (
+        DELETE FROM notificaciones_contadores c
+        WHERE NOT EXISTS (SELECT 1 FROM reales r WHERE r.user_id = c.user_id)
+    )
+    INSERT INTO notificaciones_contadores (user_id, total, no_leidas)
+    SELECT user_id, total, no_leidas FROM reales
+    ON CONFLICT (user_id) DO UPDATE SET total = EXCLUDED.total, no_leidas = EXCLUDED.no_leidas
+    WHERE (notificaciones_contadores.total, notificaciones_contadores.no_leidas)
+          IS DISTINCT FROM (EXCLUDED.total, EXCLUDED.no_leidas)
+"""
+
+# chats_lectura guarda por (chat, participante) hasta qué mensaje leyó (last_read_message_id) y cuántos
+# recibió después (no_leidos, lo mantiene chats.py al enviar y al leer). Se recalcula desde mensajes_chat
+# con el índice (chat_id, id); también crea la fila de los participantes que no la tenían.
+RECONCILIAR_CHATS_LECTURA = """
+    WITH reales AS (
+        SELECT c.id AS chat_id, p.user_id, COALESCE(l.last_read_message_id, 0) AS leido_hasta,
+               (SELECT COUNT(*) FROM mensajes_chat m
+                WHERE m.chat_id = c.id AND m.receptor_id = p.user_id
+                  AND m.id > COALESCE(l.last_read_message_id, 0)) AS no_leidos
+        FROM chats c
+        CROSS JOIN LATERAL (VALUES (c.usuario1_id), (c.usuario2_id)) AS p(user_id)
+        LEFT JOIN chats_lectura l ON l.chat_id = c.id AND l.user_id = p.user_id
+    ), sobrantes AS (
+        DELETE FROM chats_lectura l
+        WHERE NOT EXISTS (SELECT 1 FROM reales r WHERE r.chat_id = l.chat_id AND r.user_id = l.user_id)
+    )
+    INSERT INTO chats_lectura (user_id, chat_id, last_read_message_id, no_leidos)
+    SELECT user_id, chat_id, leido_hasta, no_leidos FROM reales
+    ON CONFLICT (user_id, chat_id) DO UPDATE SET no_leidos = EXCLUDED.no_leidos
+    WHERE chats_lectura.no_leidos IS DISTINCT FROM EXCLUDED.no_leidos
+"""
+
+# chats_lectura.ultima_actividad copia la fecha del último mensaje del chat (o su creación) en la fila de cada
+# participante, para que la bandeja sea un recorrido del índice (user_id, ultima_actividad). Se recalcula aparte del
+# contador porque la columna llegó después (migración 014) y 013 ya usa RECONCILIAR_CHATS_LECTURA.
+RECONCILIAR_CHATS_ACTIVIDAD = """
+    UPDATE chats_lectura l SET ultima_actividad = a.ultima_actividad
+    FROM (
+        SELECT c.id, COALESCE(m.fecha_envio, c.creado_en, CURRENT_TIMESTAMP) AS ultima_actividad
+        FROM chats c
+        LEFT JOIN mensajes_chat m ON m.id = c.ultimo_mensaje_id
+    ) a
+    WHERE a.id = l.chat_id AND l.ultima_actividad IS DISTINCT FROM a.ultima_actividad
+"""
+
+# Algoritmo despertador: a cada usuario con la app que lleva 2 días sin entrar (y al que no se despertó en la
+# última semana) le deja en la campanita la publicación más reciente de otra persona. Todo en una sentencia:
+# elige el lote (SKIP LOCKED, por si corren dos a la vez), marca ultima_noti_despertador e inserta las notificaciones.
+# Usa idx_usuarios_despertador y, para la publicación, idx_publicaciones_fecha_id.
+DESPERTAR_INACTIVOS = """
+    WITH dormidos AS (
+        SELECT u.id FROM usuarios u
+        WHERE u.fcm_token IS NOT NULL
+          AND u.ultima_conexion < CURRENT_TIMESTAMP - INTERVAL '2 days'
+          AND (u.ultima_noti_despertador IS NULL OR u.ultima_noti_despertador < CURRENT_TIMESTAMP - INTERVAL '7 days')
+        ORDER BY u.ultima_conexion
+        LIMIT %(lote)s
+        FOR UPDATE SKIP LOCKED
+    ), destino AS (
+        SELECT d.id AS user_id, p.id AS publicacion_id, p.user_id AS actor_id, p.autor
+        FROM dormidos d
+        CROSS JOIN LATERAL (
+            SELECT p.id, p.user_id, COALESCE(du.nombre_empresa, au.nombre) AS autor
+            FROM publicaciones p
+            JOIN usuarios au ON au.id = p.user_id
+            LEFT JOIN datos_usuario du ON du.user_id = p.user_id
+            WHERE p.user_id <> d.id AND p.fecha_creacion > CURRENT_TIMESTAMP - %(ventana)s * INTERVAL '1 hour'
+            ORDER BY p.fecha_creacion DESC, p.id DESC
+            LIMIT 1
+        ) p
+    ), marcados AS (
+        UPDATE usuarios u SET ultima_noti_despertador = CURRENT_TIMESTAMP
+        FROM destino WHERE u.id = destino.user_id
+    )
+    INSERT INTO notifications (user_id, publicacion_id, tipo, leida, fecha_creacion, actor_id, mensaje)
+    SELECT user_id, publicacion_id, 'general', FALSE, CURRENT_TIMESTAMP, actor_id,
+           COALESCE(NULLIF(autor, ''), 'Alguien') || ' acaba de publicar algo nuevo.'
+    FROM destino
+"""
+
+
+def reconciliar_contadores():
+    """Devuelve cuántas publicaciones se corrigieron por cada contador."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(RECONCILIAR_INTERESADOS)
+        interesados = cur.rowcount
+        cur.execute(RECONCILIAR_COMENTARIOS)
+        comentarios = cur.rowcount
+        conn.commit()
+        cur.close()
+        return {"interesados_count": interesados, "comentarios_count": comentarios}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def reconciliar_etiquetas():
+    """Devuelve cuántas filas (etiqueta, día) se insertaron o corrigieron."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(RECONCILIAR_ETIQUETAS)
+        corregidas = cur.rowcount
+        conn.commit()
+        cur.close()
+        return corregidas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def reconciliar_notificaciones():
+    """Devuelve cuántos usuarios tenían el contador desviado (o no lo tenían)."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(RECONCILIAR_NOTIFICACIONES)
+        corregidos = cur.rowcount
+        conn.commit()
+        cur.close()
+        return corregidos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def reconciliar_chats_lectura():
+    """Devuelve cuántas filas (chat, participante) se corrigieron o se crearon."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(RECONCILIAR_CHATS_LECTURA)
+        corregidas = cur.rowcount
+        cur.execute(RECONCILIAR_CHATS_ACTIVIDAD)
+        corregidas += cur.rowcount
+        conn.commit()
+        cur.close()
+        return corregidas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def despertar_inactivos(lote: int = DESPERTADOR_LOTE, ventana_horas: int = DESPERTADOR_VENTANA_HORAS) -> int:
+    """
+    Corre el despertador por lotes (un commit por lote) hasta que un lote sale incompleto.
+    Si no hay publicaciones en las últimas `ventana_horas` no despierta a nadie. Devuelve cuántos notificó.
+    """
+    conn = get_db_connection()
+    total = 0
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute(DESPERTAR_INACTIVOS, {"lote": lote, "ventana": ventana_horas})
+            insertadas = cur.rowcount
+            conn.commit()
+            total += insertadas
+            if insertadas < lote:
+                break
+        cur.close()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento de PrendiaX")
+    sub = parser.add_subparsers(dest="tarea", required=True)
+    sub.add_parser("contadores", help="reconcilia los contadores de intereses y comentarios")
+    sub.add_parser("etiquetas", help="reconstruye el conteo diario de etiquetas (tendencias)")
+    sub.add_parser("notificaciones", help="reconcilia los contadores de notificaciones (total / no leídas)")
+    sub.add_parser("chats", help="reconcilia los no leídos y la última actividad por chat (chats_lectura)")
+    p = sub.add_parser("despertador", help="notifica a los usuarios inactivos la publicación más reciente")
+    p.add_argument("--lote", type=int, default=DESPERTADOR_LOTE, help="usuarios por transacción")
+    p.add_argument("--ventana", type=int, default=DESPERTADOR_VENTANA_HORAS, help="horas hacia atrás para elegir la publicación")
+    args = parser.parse_args()
+
+    if args.tarea == "contadores":
+        corregidas = reconciliar_contadores()
+        logging.info(f"✅ Contadores reconciliados, filas corregidas: {corregidas}")
+    elif args.tarea == "etiquetas":
+        corregidas = reconciliar_etiquetas()
+        logging.info(f"✅ Conteo de etiquetas reconstruido, filas corregidas: {corregidas}")
+    elif args.tarea == "notificaciones":
+        corregidos = reconciliar_notificaciones()
+        logging.info(f"✅ Contadores de notificaciones reconciliados, usuarios corregidos: {corregidos}")
+    elif args.tarea == "chats":
+        corregidas = reconciliar_chats_lectura()
+        logging.info(f"✅ Mensajes sin leer reconciliados, filas corregidas: {corregidas}")
+    elif args.tarea == "despertador":
+        despertados = despertar_inactivos(args.lote, args.ventana)
+        logging.info(f"✅ Despertador: {despertados} usuarios inactivos notificados")
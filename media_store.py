@@ -0,0 +1,192 @@
+# media_store.py
+# Almacén de multimedia direccionado por contenido (la clave es el sha256 del archivo).
+# Las tablas solo guardan la clave (video_key, imagen_key, media_key, foto_key) y los bytes
+# viven fuera de Postgres: así no inflamos el heap/TOAST, los backups ni el WAL.
+#
+# Backends:
+#   MEDIA_BACKEND=local (por defecto) -> archivos en MEDIA_DIR, repartidos en subcarpetas ab/cd/<hash>
+#   MEDIA_BACKEND=s3                  -> cualquier servicio compatible con S3 (requiere boto3)
+#
+# Como la clave es el hash, subir dos veces el mismo archivo no ocupa espacio extra.
+import hashlib
+import logging
+import os
+import tempfile
+
+from dotenv import load_dotenv
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+
+from rangos import respuesta_archivo
+
+load_dotenv()
+
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "local")
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media_store")
+MEDIA_S3_BUCKET = os.getenv("MEDIA_S3_BUCKET")
+MEDIA_S3_PREFIX = os.getenv("MEDIA_S3_PREFIX", "media/")
+MEDIA_S3_ENDPOINT = os.getenv("MEDIA_S3_ENDPOINT")  # p. ej. R2, MinIO o DigitalOcean Spaces
+MEDIA_S3_REGION = os.getenv("MEDIA_S3_REGION")
+MEDIA_URL_EXPIRA = int(os.getenv("MEDIA_URL_EXPIRA", "3600"))
+CHUNK_SUBIDA = 1024 * 1024
+
+
+class ArchivoMuyGrande(Exception):
+    """La subida superó el límite mientras se leía."""
+
+
+def calcular_clave(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalMediaStore:
+    """Guarda cada archivo una sola vez en disco; las escrituras son atómicas (temporal + rename)."""
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        # Temporales de subida dentro de la misma raíz: el rename final es atómico (mismo sistema de archivos)
+        self.dir_temporal = os.path.join(raiz, ".tmp")
+        os.makedirs(self.dir_temporal, exist_ok=True)
+
+    def ruta(self, clave: str) -> str:
+        return os.path.join(self.raiz, clave[:2], clave[2:4], clave)
+
+    def existe(self, clave: str) -> bool:
+        return os.path.exists(self.ruta(clave))
+
+    def guardar(self, data: bytes, content_type: str = None) -> str:
+        clave = calcular_clave(data)
+        destino = self.ruta(clave)
+        if os.path.exists(destino):
+            return clave
+
+        carpeta = os.path.dirname(destino)
+        os.makedirs(carpeta, exist_ok=True)
+        fd, temporal = tempfile.mkstemp(dir=carpeta, prefix=".subiendo-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, destino)
+        except Exception:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return clave
+
+    def guardar_archivo(self, temporal: str, clave: str, content_type: str = None):
+        """Mueve un temporal ya hasheado a su lugar definitivo (si ya existía, el temporal se descarta)."""
+        destino = self.ruta(clave)
+        if os.path.exists(destino):
+            return
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(temporal, destino)
+
+    def leer(self, clave: str) -> bytes:
+        with open(self.ruta(clave), "rb") as f:
+            return f.read()
+
+    def respuesta(self, request, clave: str, media_type: str, filename: str = None):
+        # Lee solo la ventana pedida por Range (seek + trozos fijos)
+        return respuesta_archivo(request, self.ruta(clave), media_type, filename)
+
+
+class S3MediaStore:
+    """Backend compatible con S3. Los GET redirigen a una URL firmada para no pasar los bytes por la app."""
+
+    def __init__(self, bucket: str, prefijo: str = "", endpoint_url: str = None, region: str = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("MEDIA_BACKEND=s3 requiere boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("MEDIA_BACKEND=s3 requiere MEDIA_S3_BUCKET")
+        self.bucket = bucket
+        self.prefijo = prefijo
+        self.dir_temporal = None  # carpeta temporal del sistema
+        self._ClientError = ClientError
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _objeto(self, clave: str) -> str:
+        return f"{self.prefijo}{clave[:2]}/{clave[2:4]}/{clave}"
+
+    def existe(self, clave: str) -> bool:
+        try:
+            self._s3.head_object(Bucket=self.bucket, Key=self._objeto(clave))
+            return True
+        except self._ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def guardar(self, data: bytes, content_type: str = None) -> str:
+        clave = calcular_clave(data)
+        if not self.existe(clave):
+            extra = {"ContentType": content_type} if content_type else {}
+            self._s3.put_object(Bucket=self.bucket, Key=self._objeto(clave), Body=data, **extra)
+        return clave
+
+    def guardar_archivo(self, temporal: str, clave: str, content_type: str = None):
+        if not self.existe(clave):
+            extra = {"ContentType": content_type} if content_type else None
+            # upload_file sube por partes desde disco, sin cargar el archivo en memoria
+            self._s3.upload_file(temporal, self.bucket, self._objeto(clave), ExtraArgs=extra)
+
+    def leer(self, clave: str) -> bytes:
+        return self._s3.get_object(Bucket=self.bucket, Key=self._objeto(clave))["Body"].read()
+
+    def respuesta(self, request, clave: str, media_type: str, filename: str = None):
+        # S3 resuelve los Range por su cuenta
+        params = {"Bucket": self.bucket, "Key": self._objeto(clave), "ResponseContentType": media_type}
+        if filename:
+            params["ResponseContentDisposition"] = f"inline; filename={filename}"
+        url = self._s3.generate_presigned_url("get_object", Params=params, ExpiresIn=MEDIA_URL_EXPIRA)
+        return RedirectResponse(url, status_code=302)
+
+
+def _crear_store():
+    if MEDIA_BACKEND == "s3":
+        return S3MediaStore(MEDIA_S3_BUCKET, MEDIA_S3_PREFIX, MEDIA_S3_ENDPOINT, MEDIA_S3_REGION)
+    if MEDIA_BACKEND != "local":
+        logging.warning(f"MEDIA_BACKEND desconocido '{MEDIA_BACKEND}', usando almacenamiento local")
+    return LocalMediaStore(MEDIA_DIR)
+
+
+store = _crear_store()
+
+
+def _escribir_trozo(archivo, hasher, trozo: bytes):
+    hasher.update(trozo)
+    archivo.write(trozo)
+
+
+async def ingerir_upload(upload, limite: int, content_type: str = None):
+    """
+    Copia un UploadFile al store por trozos: valida el límite mientras lee, calcula el sha256 al vuelo
+    y nunca tiene el archivo completo en memoria. Devuelve la clave, o None si el archivo venía vacío.
+    Lanza ArchivoMuyGrande en cuanto se pasa de `limite` bytes.
+    """
+    hasher = hashlib.sha256()
+    total = 0
+    fd, temporal = tempfile.mkstemp(dir=store.dir_temporal, prefix=".subiendo-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                trozo = await upload.read(CHUNK_SUBIDA)
+                if not trozo:
+                    break
+                total += len(trozo)
+                if total > limite:
+                    raise ArchivoMuyGrande(f"El archivo supera {limite} bytes")
+                await run_in_threadpool(_escribir_trozo, f, hasher, trozo)
+
+        if total == 0:
+            return None
+        clave = hasher.hexdigest()
+        await run_in_threadpool(store.guardar_archivo, temporal, clave, content_type)
+        return clave
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
@@ -0,0 +1,475 @@
+# migraciones.py
+# Cambios de esquema versionados. Cada migración es una lista de sentencias idempotentes
+# que se corren en orden y se registran en migraciones_aplicadas para no repetirlas.
+#
+# Uso:
+#   python migraciones.py            -> aplica las pendientes
+#   python migraciones.py --listar   -> muestra cuáles faltan
+#
+# Los índices se crean CONCURRENTLY para no bloquear escrituras en producción,
+# por eso cada sentencia corre en autocommit (fuera de una transacción).
+import argparse
+import logging
+import os
+
+import psycopg2
+
+from database import DB_CONFIG
+from mantenimiento import (
+    RECONCILIAR_INTERESADOS, RECONCILIAR_COMENTARIOS, RECONCILIAR_ETIQUETAS, RECONCILIAR_NOTIFICACIONES,
+    RECONCILIAR_CHATS_LECTURA, RECONCILIAR_CHATS_ACTIVIDAD,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+MIGRACIONES = [
+    ("001_indices_paginacion_publicaciones", [
+        # Feed, búsqueda e /inicio: ORDER BY fecha_creacion DESC, id DESC con keyset
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicaciones_fecha_id
+        ON publicaciones (fecha_creacion DESC, id DESC)
+        """,
+        # Perfil propio y ajeno: WHERE user_id = %s con el mismo orden
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicaciones_user_fecha_id
+        ON publicaciones (user_id, fecha_creacion DESC, id DESC)
+        """,
+        # Subconsultas por fila del listado (imágenes, intereses, comentarios)
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicacion_imagenes_publicacion
+        ON publicacion_imagenes (publicacion_id)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_intereses_publicacion_user
+        ON intereses (publicacion_id, user_id)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_comentarios_publicacion
+        ON comentarios (publicacion_id)
+        """,
+    ]),
+    ("002_contadores_publicaciones", [
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS interesados_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS comentarios_count INTEGER NOT NULL DEFAULT 0",
+        # Cada INSERT/DELETE en intereses y comentarios ajusta el contador de su publicación en la misma
+        # transacción; también cubre los borrados en cascada (respuestas de un comentario, cuentas eliminadas)
+        """
+        CREATE OR REPLACE FUNCTION contar_intereses() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE publicaciones SET interesados_count = interesados_count + 1 WHERE id = NEW.publicacion_id;
+            ELSE
+                UPDATE publicaciones SET interesados_count = GREATEST(interesados_count - 1, 0) WHERE id = OLD.publicacion_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_contar_intereses ON intereses",
+        """
+        CREATE TRIGGER trg_contar_intereses AFTER INSERT OR DELETE ON intereses
+        FOR EACH ROW EXECUTE FUNCTION contar_intereses()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION contar_comentarios() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE publicaciones SET comentarios_count = comentarios_count + 1 WHERE id = NEW.publicacion_id;
+            ELSE
+                UPDATE publicaciones SET comentarios_count = GREATEST(comentarios_count - 1, 0) WHERE id = OLD.publicacion_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_contar_comentarios ON comentarios",
+        """
+        CREATE TRIGGER trg_contar_comentarios AFTER INSERT OR DELETE ON comentarios
+        FOR EACH ROW EXECUTE FUNCTION contar_comentarios()
+        """,
+        # Llenado inicial con los triggers ya activos
+        RECONCILIAR_INTERESADOS,
+        RECONCILIAR_COMENTARIOS,
+    ]),
+    ("003_claves_media_store", [
+        # Clave sha256 en media_store.py; los bytea quedan solo para filas aún no migradas (ver migrar_media.py)
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS video_key VARCHAR(64)",
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS imagen_key VARCHAR(64)",
+        "ALTER TABLE publicacion_imagenes ADD COLUMN IF NOT EXISTS imagen_key VARCHAR(64)",
+        "ALTER TABLE mensajes_chat ADD COLUMN IF NOT EXISTS media_key VARCHAR(64)",
+        "ALTER TABLE datos_usuario ADD COLUMN IF NOT EXISTS foto_key VARCHAR(64)",
+        # Las filas nuevas ya no llevan bytes
+        "ALTER TABLE publicacion_imagenes ALTER COLUMN imagen DROP NOT NULL",
+    ]),
+    ("004_busqueda_publicaciones", [
+        # Configuración de búsqueda en español que ignora acentos ("cafe" encuentra "café")
+        "CREATE EXTENSION IF NOT EXISTS unaccent",
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+                ALTER TEXT SEARCH CONFIGURATION es_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+            END IF;
+        END
+        $$
+        """,
+        # Etiquetas pesan más (A) que el texto (B) al ordenar por relevancia
+        """
+        CREATE OR REPLACE FUNCTION publicacion_busqueda(contenido TEXT, etiquetas TEXT[]) RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('es_unaccent', COALESCE(array_to_string(etiquetas, ' '), '')), 'A')
+                || setweight(to_tsvector('es_unaccent', COALESCE(contenido, '')), 'B')
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS busqueda tsvector",
+        # Se recalcula en cada INSERT y en los UPDATE que tocan texto o etiquetas (publicar / editar)
+        """
+        CREATE OR REPLACE FUNCTION actualizar_busqueda_publicacion() RETURNS trigger AS $$
+        BEGIN
+            NEW.busqueda := publicacion_busqueda(NEW.contenido, NEW.etiquetas::TEXT[]);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_busqueda_publicacion ON publicaciones",
+        """
+        CREATE TRIGGER trg_busqueda_publicacion BEFORE INSERT OR UPDATE OF contenido, etiquetas ON publicaciones
+        FOR EACH ROW EXECUTE FUNCTION actualizar_busqueda_publicacion()
+        """,
+        "UPDATE publicaciones SET busqueda = publicacion_busqueda(contenido, etiquetas::TEXT[]) WHERE busqueda IS NULL",
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicaciones_busqueda
+        ON publicaciones USING GIN (busqueda)
+        """,
+        # La búsqueda también encuentra por nombre del autor (negocio o persona)
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_datos_usuario_nombre_busqueda
+        ON datos_usuario USING GIN (to_tsvector('es_unaccent', COALESCE(nombre_empresa, '')))
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_nombre_busqueda
+        ON usuarios USING GIN (to_tsvector('es_unaccent', COALESCE(nombre, '')))
+        """,
+    ]),
+    ("005_etiquetas_normalizadas", [
+        # "Tecnología", " tecnologia " y "TECNOLOGÍA" son la misma etiqueta
+        """
+        CREATE OR REPLACE FUNCTION normalizar_etiqueta(etiqueta TEXT) RETURNS TEXT AS $$
+            SELECT lower(unaccent('unaccent'::regdictionary, btrim(etiqueta)))
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION normalizar_etiquetas(etiquetas TEXT[]) RETURNS TEXT[] AS $$
+            SELECT COALESCE(array_agg(DISTINCT normalizar_etiqueta(e)), '{}')
+            FROM unnest(etiquetas) AS e
+            WHERE btrim(e) <> ''
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS etiquetas_norm TEXT[] NOT NULL DEFAULT '{}'",
+        """
+        CREATE OR REPLACE FUNCTION actualizar_etiquetas_publicacion() RETURNS trigger AS $$
+        BEGIN
+            NEW.etiquetas_norm := normalizar_etiquetas(NEW.etiquetas::TEXT[]);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_etiquetas_publicacion ON publicaciones",
+        """
+        CREATE TRIGGER trg_etiquetas_publicacion BEFORE INSERT OR UPDATE OF etiquetas ON publicaciones
+        FOR EACH ROW EXECUTE FUNCTION actualizar_etiquetas_publicacion()
+        """,
+        "UPDATE publicaciones SET etiquetas_norm = normalizar_etiquetas(etiquetas::TEXT[]) WHERE etiquetas IS NOT NULL",
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicaciones_etiquetas_norm
+        ON publicaciones USING GIN (etiquetas_norm)
+        """,
+        # Agregado para /tags/tendencias: publicaciones por etiqueta y día, ajustado en cada INSERT/UPDATE/DELETE
+        """
+        CREATE TABLE IF NOT EXISTS etiquetas_conteo (
+            etiqueta TEXT NOT NULL,
+            dia DATE NOT NULL,
+            publicaciones INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (etiqueta, dia)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_etiquetas_conteo_dia ON etiquetas_conteo (dia)",
+        """
+        CREATE OR REPLACE FUNCTION contar_etiquetas() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE etiquetas_conteo SET publicaciones = GREATEST(publicaciones - 1, 0)
+                WHERE dia = OLD.fecha_creacion::date AND etiqueta = ANY(OLD.etiquetas_norm);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO etiquetas_conteo (etiqueta, dia, publicaciones)
+                SELECT e, NEW.fecha_creacion::date, 1 FROM unnest(NEW.etiquetas_norm) AS e
+                ON CONFLICT (etiqueta, dia) DO UPDATE SET publicaciones = etiquetas_conteo.publicaciones + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_contar_etiquetas ON publicaciones",
+        """
+        CREATE TRIGGER trg_contar_etiquetas AFTER INSERT OR DELETE OR UPDATE OF etiquetas ON publicaciones
+        FOR EACH ROW EXECUTE FUNCTION contar_etiquetas()
+        """,
+        RECONCILIAR_ETIQUETAS,
+    ]),
+    ("006_push_outbox", [
+        # Pushes pendientes, escritos en la misma transacción que el evento; los entrega push_worker.py
+        """
+        CREATE TABLE IF NOT EXISTS push_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            user_id INTEGER,
+            excluir_user_id INTEGER,
+            titulo TEXT NOT NULL,
+            cuerpo TEXT NOT NULL,
+            data JSONB NOT NULL DEFAULT '{}',
+            badge BOOLEAN NOT NULL DEFAULT FALSE,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            siguiente_intento TIMESTAMP NOT NULL DEFAULT NOW(),
+            ultimo_error TEXT,
+            creado_en TIMESTAMP NOT NULL DEFAULT NOW(),
+            enviado_en TIMESTAMP
+        )
+        """,
+        # El worker solo mira las pendientes que ya tocan; el índice parcial se queda chico
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_push_outbox_pendientes
+        ON push_outbox (siguiente_intento, id) WHERE estado = 'pendiente'
+        """,
+    ]),
+    ("007_indice_fcm_token", [
+        # La poda de tokens muertos busca por token (UPDATE ... WHERE fcm_token = ANY(...))
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_fcm_token
+        ON usuarios (fcm_token) WHERE fcm_token IS NOT NULL
+        """,
+    ]),
+    ("008_campanas_ejecuciones", [
+        # Punto de control de campanas.py: hasta qué usuario llegó cada ejecución, para reanudarla si se cae
+        """
+        CREATE TABLE IF NOT EXISTS campanas_ejecuciones (
+            id SERIAL PRIMARY KEY,
+            campana TEXT NOT NULL,
+            parametros JSONB NOT NULL DEFAULT '{}',
+            estado TEXT NOT NULL DEFAULT 'en_curso',
+            ultimo_id INTEGER NOT NULL DEFAULT 0,
+            enviados INTEGER NOT NULL DEFAULT 0,
+            fallidos INTEGER NOT NULL DEFAULT 0,
+            podados INTEGER NOT NULL DEFAULT 0,
+            iniciada_en TIMESTAMP NOT NULL DEFAULT NOW(),
+            actualizada_en TIMESTAMP NOT NULL DEFAULT NOW(),
+            terminada_en TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_campanas_ejecuciones_campana ON campanas_ejecuciones (campana, estado)",
+    ]),
+    ("009_indice_despertador", [
+        # Despertador (mantenimiento.despertar_inactivos): inactivos por ultima_conexion, solo usuarios con app
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usuarios_despertador
+        ON usuarios (ultima_conexion, ultima_noti_despertador) WHERE fcm_token IS NOT NULL
+        """,
+    ]),
+    ("010_contadores_notificaciones", [
+        # Total y no leídas por usuario: la campanita, /notificaciones y el badge de iOS leen una fila
+        # en lugar de contar notifications cada vez
+        """
+        CREATE TABLE IF NOT EXISTS notificaciones_contadores (
+            user_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            no_leidas INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Triggers por sentencia con tablas de transición: marcar todas como leídas o el despertador
+        # (miles de filas) ajustan cada contador una sola vez, agrupado por usuario
+        """
+        CREATE OR REPLACE FUNCTION contar_notificaciones() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO notificaciones_contadores AS c (user_id, total, no_leidas)
+                SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE leida = FALSE)
+                FROM nuevas GROUP BY user_id ORDER BY user_id
+                ON CONFLICT (user_id) DO UPDATE
+                SET total = c.total + EXCLUDED.total, no_leidas = c.no_leidas + EXCLUDED.no_leidas;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE notificaciones_contadores c
+                SET total = GREATEST(c.total - d.total, 0), no_leidas = GREATEST(c.no_leidas - d.no_leidas, 0)
+                FROM (
+                    SELECT user_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE leida = FALSE) AS no_leidas
+                    FROM viejas GROUP BY user_id
+                ) d
+                WHERE c.user_id = d.user_id;
+            ELSE
+                -- UPDATE (casi siempre leida FALSE -> TRUE): neto por usuario de lo que salió y lo que entró
+                UPDATE notificaciones_contadores c
+                SET total = GREATEST(c.total + d.total, 0), no_leidas = GREATEST(c.no_leidas + d.no_leidas, 0)
+                FROM (
+                    SELECT user_id, SUM(total) AS total, SUM(no_leidas) AS no_leidas
+                    FROM (
+                        SELECT user_id, -1 AS total, CASE WHEN leida = FALSE THEN -1 ELSE 0 END AS no_leidas FROM viejas
+                        UNION ALL
+                        SELECT user_id, 1, CASE WHEN leida = FALSE THEN 1 ELSE 0 END FROM nuevas
+                    ) cambios
+                    GROUP BY user_id
+                    HAVING SUM(total) <> 0 OR SUM(no_leidas) <> 0
+                ) d
+                WHERE c.user_id = d.user_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS trg_contar_notificaciones_insert ON notifications",
+        "DROP TRIGGER IF EXISTS trg_contar_notificaciones_update ON notifications",
+        "DROP TRIGGER IF EXISTS trg_contar_notificaciones_delete ON notifications",
+        """
+        CREATE TRIGGER trg_contar_notificaciones_insert AFTER INSERT ON notifications
+        REFERENCING NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION contar_notificaciones()
+        """,
+        """
+        CREATE TRIGGER trg_contar_notificaciones_update AFTER UPDATE ON notifications
+        REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+        FOR EACH STATEMENT EXECUTE FUNCTION contar_notificaciones()
+        """,
+        """
+        CREATE TRIGGER trg_contar_notificaciones_delete AFTER DELETE ON notifications
+        REFERENCING OLD TABLE AS viejas
+        FOR EACH STATEMENT EXECUTE FUNCTION contar_notificaciones()
+        """,
+        # Llenado inicial con los triggers ya activos
+        RECONCILIAR_NOTIFICACIONES,
+    ]),
+    ("011_ws_eventos_grandes", [
+        # Eventos de WebSocket entre workers que no caben en un NOTIFY (8000 bytes): el aviso lleva solo el id.
+        # UNLOGGED porque son efímeros; pubsub.py borra los de más de 10 minutos
+        """
+        CREATE UNLOGGED TABLE IF NOT EXISTS ws_eventos_grandes (
+            id BIGSERIAL PRIMARY KEY,
+            payload TEXT NOT NULL,
+            creado_en TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ws_eventos_grandes_creado ON ws_eventos_grandes (creado_en)",
+    ]),
+    ("012_mensajes_chat_keyset", [
+        # Historial de chat por cursor (before_id/after_id): abrir un chat es un solo seek sin importar su largo
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensajes_chat_chat_id
+        ON mensajes_chat (chat_id, id DESC)
+        """,
+    ]),
+    ("013_chats_lectura", [
+        # Marca de lectura por (participante, chat): leer un chat actualiza esta fila en vez de reescribir
+        # mensajes_chat.leido. La PK empieza por user_id para sumar los no leídos de un usuario (/chats/unread_count)
+        """
+        CREATE TABLE IF NOT EXISTS chats_lectura (
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            last_read_message_id BIGINT NOT NULL DEFAULT 0,
+            no_leidos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, chat_id)
+        )
+        """,
+        # La marca inicial sale de la columna leido: justo antes del primer mensaje recibido sin leer
+        """
+        INSERT INTO chats_lectura (user_id, chat_id, last_read_message_id)
+        SELECT p.user_id, c.id, COALESCE(
+            (SELECT MIN(m.id) - 1 FROM mensajes_chat m
+             WHERE m.chat_id = c.id AND m.receptor_id = p.user_id AND m.leido = FALSE),
+            (SELECT MAX(m.id) FROM mensajes_chat m WHERE m.chat_id = c.id),
+            0)
+        FROM chats c
+        CROSS JOIN LATERAL (VALUES (c.usuario1_id), (c.usuario2_id)) AS p(user_id)
+        ON CONFLICT DO NOTHING
+        """,
+        RECONCILIAR_CHATS_LECTURA,
+    ]),
+    ("014_chats_bandeja", [
+        # Bandeja de entrada (/chats/list) como recorrido ordenado de las filas del usuario en chats_lectura,
+        # sin GROUP BY ni OR sobre usuario1_id/usuario2_id. chats.py la mantiene al enviar y al crear el chat
+        "ALTER TABLE chats_lectura ADD COLUMN IF NOT EXISTS ultima_actividad TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP",
+        RECONCILIAR_CHATS_ACTIVIDAD,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chats_lectura_bandeja
+        ON chats_lectura (user_id, ultima_actividad DESC, chat_id DESC)
+        """,
+    ]),
+    ("016_publicaciones_fijadas", [
+        # Las publicaciones fijadas arriba del feed se marcan con una columna en vez de reconocerlas por su texto.
+        # Para fijar otra: UPDATE publicaciones SET fijada = TRUE WHERE id = ...
+        "ALTER TABLE publicaciones ADD COLUMN IF NOT EXISTS fijada BOOLEAN NOT NULL DEFAULT FALSE",
+        "UPDATE publicaciones SET fijada = TRUE WHERE contenido LIKE 'Bienvenidos a PrendiaX!%' AND NOT fijada",
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_publicaciones_fijadas
+        ON publicaciones (fecha_creacion DESC, id DESC) WHERE fijada
+        """,
+    ]),
+]
+
+# Opcional: texto completo sobre mensajes_chat, la tabla más grande. Solo se crea con CHAT_BUSQUEDA_MENSAJES=1,
+# la misma variable que activa la búsqueda de mensajes en /chats/busqueda
+if os.getenv("CHAT_BUSQUEDA_MENSAJES", "0") == "1":
+    MIGRACIONES.append(("015_busqueda_mensajes_chat", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensajes_chat_busqueda
+        ON mensajes_chat USING GIN (to_tsvector('es_unaccent', COALESCE(contenido, '')))
+        WHERE tipo = 'texto'
+        """,
+    ]))
+
+
+def conectar():
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    return conn
+
+
+def aplicadas(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS migraciones_aplicadas (
+            nombre TEXT PRIMARY KEY,
+            aplicada_en TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cur.execute("SELECT nombre FROM migraciones_aplicadas")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrar(solo_listar=False):
+    conn = conectar()
+    try:
+        cur = conn.cursor()
+        hechas = aplicadas(cur)
+        pendientes = [(nombre, sentencias) for nombre, sentencias in MIGRACIONES if nombre not in hechas]
+
+        if not pendientes:
+            logging.info("✅ Esquema al día, no hay migraciones pendientes")
+            return
+
+        for nombre, sentencias in pendientes:
+            if solo_listar:
+                logging.info(f"Pendiente: {nombre}")
+                continue
+            logging.info(f"▶️ Aplicando {nombre} ({len(sentencias)} sentencias)")
+            for sql in sentencias:
+                cur.execute(sql)
+            cur.execute("INSERT INTO migraciones_aplicadas (nombre) VALUES (%s) ON CONFLICT DO NOTHING", (nombre,))
+            logging.info(f"✅ {nombre} aplicada")
+        cur.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica las migraciones de esquema de PrendiaX")
+    parser.add_argument("--listar", action="store_true", help="solo muestra las migraciones pendientes")
+    args = parser.parse_args()
+    migrar(solo_listar=args.listar)
@@ -0,0 +1,118 @@
+# migrar_media.py
+# Pasa la multimedia guardada como bytea al media store (ver media_store.py), por lotes.
+#
+# Uso:
+#   python migrar_media.py                      -> copia al store y llena las columnas *_key
+#   python migrar_media.py --tabla publicaciones_video --lote 20
+#   python migrar_media.py --purgar             -> además borra el bytea de las filas ya migradas
+#
+# Es reanudable: solo toma filas con la clave vacía, así que si se corta basta con volver a correrlo.
+# Los bytes se leen fila por fila (un video puede pesar 100 MB) y cada lote hace commit.
+# --purgar verifica que el archivo exista en el store antes de poner el bytea en NULL.
+# Después de purgar conviene un VACUUM de las tablas para que Postgres reutilice el espacio del TOAST.
+import argparse
+import logging
+
+from database import get_db_connection
+from media_store import store
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# nombre -> (tabla, columna bytea, columna clave, content type)
+TABLAS = {
+    "publicaciones_video": ("publicaciones", "video", "video_key", "video/mp4"),
+    "publicaciones_imagen": ("publicaciones", "imagen", "imagen_key", "image/jpeg"),
+    "publicacion_imagenes": ("publicacion_imagenes", "imagen", "imagen_key", "image/jpeg"),
+    "mensajes_chat": ("mensajes_chat", "media_content", "media_key", None),
+    "datos_usuario": ("datos_usuario", "foto", "foto_key", "image/jpeg"),
+}
+
+
+def migrar_tabla(nombre, lote):
+    tabla, col_bytes, col_key, content_type = TABLAS[nombre]
+    conn = get_db_connection()
+    migradas = 0
+    ultimo_id = 0
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute(f"""
+                SELECT id FROM {tabla}
+                WHERE {col_key} IS NULL AND {col_bytes} IS NOT NULL AND id > %s
+                ORDER BY id LIMIT %s
+            """, (ultimo_id, lote))
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                break
+
+            for fila_id in ids:
+                cur.execute(f"SELECT {col_bytes} FROM {tabla} WHERE id = %s", (fila_id,))
+                row = cur.fetchone()
+                if not row or row[0] is None:
+                    continue
+                clave = store.guardar(bytes(row[0]), content_type)
+                cur.execute(f"UPDATE {tabla} SET {col_key} = %s WHERE id = %s AND {col_key} IS NULL", (clave, fila_id))
+                migradas += 1
+
+            conn.commit()
+            ultimo_id = ids[-1]
+            logging.info(f"[{nombre}] {migradas} filas migradas (último id {ultimo_id})")
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return migradas
+
+
+def purgar_tabla(nombre, lote):
+    tabla, col_bytes, col_key, _ = TABLAS[nombre]
+    conn = get_db_connection()
+    purgadas = 0
+    ultimo_id = 0
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute(f"""
+                SELECT id, {col_key} FROM {tabla}
+                WHERE {col_key} IS NOT NULL AND {col_bytes} IS NOT NULL AND id > %s
+                ORDER BY id LIMIT %s
+            """, (ultimo_id, lote))
+            filas = cur.fetchall()
+            if not filas:
+                break
+
+            confirmadas = [fila_id for fila_id, clave in filas if store.existe(clave)]
+            faltantes = len(filas) - len(confirmadas)
+            if faltantes:
+                logging.warning(f"[{nombre}] {faltantes} filas con clave pero sin archivo en el store, no se purgan")
+            if confirmadas:
+                cur.execute(f"UPDATE {tabla} SET {col_bytes} = NULL WHERE id = ANY(%s)", (confirmadas,))
+                purgadas += len(confirmadas)
+
+            conn.commit()
+            ultimo_id = filas[-1][0]
+            logging.info(f"[{nombre}] {purgadas} bytea purgados (último id {ultimo_id})")
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return purgadas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra la multimedia de bytea al media store")
+    parser.add_argument("--tabla", choices=sorted(TABLAS), help="solo esta tabla (por defecto todas)")
+    parser.add_argument("--lote", type=int, default=50, help="filas por commit")
+    parser.add_argument("--purgar", action="store_true", help="poner en NULL el bytea de las filas ya migradas")
+    args = parser.parse_args()
+
+    for nombre in ([args.tabla] if args.tabla else list(TABLAS)):
+        total = migrar_tabla(nombre, args.lote)
+        logging.info(f"✅ [{nombre}] migración terminada: {total} filas")
+        if args.purgar:
+            total = purgar_tabla(nombre, args.lote)
+            logging.info(f"🧹 [{nombre}] purga terminada: {total} filas")
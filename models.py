@@ -21,3 +21,4 @@ class DatosUsuario(Base):
     servicios = Column(Text, nullable=True)
     sitio_web = Column(Text, nullable=True)
     foto = Column(LargeBinary, nullable=True)
+    foto_key = Column(String(64), nullable=True)  # clave en media_store; foto queda solo para datos viejos
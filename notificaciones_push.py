@@ -0,0 +1,226 @@
+# notificaciones_push.py
+# Envío de push por FCM en lotes (500 por llamada, el máximo que acepta Firebase) con varios lotes
+# en vuelo a la vez. Lo usa push_worker.py para vaciar push_outbox; la app ya no llama a Firebase.
+#
+#   enviar_mensajes -> pushes individuales (chats, notificaciones) con send_each
+#   enviar_difusion -> el mismo push a muchos tokens con send_each_for_multicast
+#
+# Cada difusión devuelve sus métricas (lotes, éxitos, fallas por código de error, tokens/s) y las deja en el log.
+# usar_fcm_simulado() cambia Firebase por un simulador para correr el worker en local (push_worker.py --stub).
+#
+# Tokens muertos: es_token_muerto() separa "el token ya no sirve" (app desinstalada, token inválido o de otro
+# proyecto) de los errores transitorios; podar_tokens() pone esos fcm_token en NULL por lotes para que
+# cada campaña y cada difusión siguiente ya no los intente.
+import logging
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from firebase_admin import messaging
+
+TAMANO_LOTE = 500
+PUSH_CONCURRENCIA = int(os.getenv("PUSH_CONCURRENCIA", "4"))
+
+# Errores de FCM que valen la pena reintentar; el resto (token no registrado, argumento inválido) es definitivo
+CODIGOS_REINTENTABLES = {"UNAVAILABLE", "INTERNAL", "RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED", "UNKNOWN"}
+LOTE_PODA = 1000
+
+_fcm = messaging
+
+
+class ErrorSimulado(Exception):
+    def __init__(self, code: str):
+        super().__init__(f"error simulado {code}")
+        self.code = code
+
+
+class FCMSimulado:
+    """Mismo contrato que firebase_admin.messaging (send_each / send_each_for_multicast) sin salir a la red."""
+
+    def __init__(self, latencia: float = 0.05, tasa_fallas: float = 0.0):
+        self.latencia = latencia
+        self.tasa_fallas = tasa_fallas
+
+    def _respuesta(self, cantidad: int):
+        time.sleep(self.latencia)
+        respuestas = []
+        for _ in range(cantidad):
+            if random.random() < self.tasa_fallas:
+                codigo = random.choice(["UNAVAILABLE", "NOT_FOUND"])
+                respuestas.append(SimpleNamespace(success=False, exception=ErrorSimulado(codigo), message_id=None))
+            else:
+                respuestas.append(SimpleNamespace(success=True, exception=None, message_id="simulado"))
+        exitos = sum(1 for r in respuestas if r.success)
+        return SimpleNamespace(responses=respuestas, success_count=exitos, failure_count=cantidad - exitos)
+
+    def send_each(self, mensajes):
+        return self._respuesta(len(mensajes))
+
+    def send_each_for_multicast(self, mensaje):
+        return self._respuesta(len(mensaje.tokens))
+
+
+def usar_fcm_simulado(latencia: float = 0.05, tasa_fallas: float = 0.0):
+    global _fcm
+    _fcm = FCMSimulado(latencia, tasa_fallas)
+    logging.warning("⚠️ Push en modo simulado: no se manda nada a Firebase")
+
+
+def codigo_error(exc) -> str:
+    return getattr(exc, "code", None) or type(exc).__name__
+
+
+def es_reintentable(exc) -> bool:
+    codigo = getattr(exc, "code", None)
+    # Sin código es un error de red o del cliente HTTP: se reintenta
+    return codigo is None or codigo in CODIGOS_REINTENTABLES
+
+
+def es_token_muerto(exc) -> bool:
+    """
+    True si FCM dice que el token no va a volver a servir. INVALID_ARGUMENT y PERMISSION_DENIED también
+    salen por un payload o credenciales mal armados, así que solo cuentan si el error habla del token/sender.
+    """
+    if isinstance(exc, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+        return True
+    codigo = getattr(exc, "code", None)
+    texto = str(exc).lower()
+    if codigo == "NOT_FOUND":
+        return True
+    if codigo == "INVALID_ARGUMENT":
+        return "token" in texto
+    if codigo == "PERMISSION_DENIED":
+        return "sender" in texto
+    return False
+
+
+def podar_tokens(cur, tokens: list, lote: int = LOTE_PODA) -> int:
+    """Pone en NULL los fcm_token muertos, de `lote` en `lote`. El commit es del que llama. Devuelve cuántos usuarios tocó."""
+    tokens = list(dict.fromkeys(t for t in tokens if t))
+    podados = 0
+    for i in range(0, len(tokens), lote):
+        cur.execute("UPDATE usuarios SET fcm_token = NULL WHERE fcm_token = ANY(%s)", (tokens[i:i + lote],))
+        podados += cur.rowcount
+    if podados:
+        logging.info(f"🧹 {podados} fcm_token muertos podados")
+    return podados
+
+
+def _apns(badge: int = None):
+    return messaging.APNSConfig(payload=messaging.APNSPayload(aps=messaging.Aps(sound="default", badge=badge)))
+
+
+def _data(data: dict) -> dict:
+    # FCM solo acepta strings en data
+    return {clave: str(valor) for clave, valor in (data or {}).items()}
+
+
+def _lotes(elementos: list, tamano: int = TAMANO_LOTE):
+    for i in range(0, len(elementos), tamano):
+        yield elementos[i:i + tamano]
+
+
+def crear_mensaje(token: str, titulo: str, cuerpo: str, data: dict = None, badge: int = None):
+    return messaging.Message(
+        notification=messaging.Notification(title=titulo, body=cuerpo),
+        apns=_apns(badge),
+        data=_data(data),
+        token=token,
+    )
+
+
+def enviar_mensajes(mensajes: list, limitador=None) -> list:
+    """
+    Manda pushes individuales en lotes de 500. Devuelve, en el mismo orden, None si salió
+    o la excepción de FCM si falló. Un lote que falla completo marca todos sus mensajes con esa excepción.
+    """
+    resultados = []
+    for lote in _lotes(mensajes):
+        if limitador:
+            limitador.esperar(len(lote))
+        try:
+            respuesta = _fcm.send_each(lote)
+            resultados.extend(None if envio.success else envio.exception for envio in respuesta.responses)
+        except Exception as e:
+            logging.error(f"Push: falló un lote de {len(lote)} mensajes: {e}")
+            resultados.extend([e] * len(lote))
+    return resultados
+
+
+def _enviar_lote(numero: int, tokens: list, titulo: str, cuerpo: str, data: dict, limitador) -> dict:
+    if limitador:
+        limitador.esperar(len(tokens))
+    inicio = time.perf_counter()
+    mensaje = messaging.MulticastMessage(
+        notification=messaging.Notification(title=titulo, body=cuerpo),
+        apns=_apns(),
+        data=data,
+        tokens=tokens,
+    )
+    try:
+        respuesta = _fcm.send_each_for_multicast(mensaje)
+    except Exception as e:
+        # Falla del lote completo (red, credenciales): se cuentan todos sus tokens como fallidos
+        logging.error(f"Push lote {numero}: falló completo ({len(tokens)} tokens): {e}")
+        return {"exitos": 0, "fallas": len(tokens), "errores": Counter({codigo_error(e): len(tokens)}),
+                "tokens_fallidos": [], "tokens_muertos": [], "segundos": time.perf_counter() - inicio}
+
+    errores = Counter()
+    tokens_fallidos = []
+    tokens_muertos = []
+    for token, envio in zip(tokens, respuesta.responses):
+        if not envio.success:
+            errores[codigo_error(envio.exception)] += 1
+            tokens_fallidos.append((token, envio.exception))
+            if es_token_muerto(envio.exception):
+                tokens_muertos.append(token)
+
+    segundos = time.perf_counter() - inicio
+    logging.debug(f"Push lote {numero}: {respuesta.success_count} ok / {respuesta.failure_count} fallas en {segundos:.2f}s")
+    return {"exitos": respuesta.success_count, "fallas": respuesta.failure_count, "errores": errores,
+            "tokens_fallidos": tokens_fallidos, "tokens_muertos": tokens_muertos, "segundos": segundos}
+
+
+def enviar_difusion(tokens: list, titulo: str, cuerpo: str, data: dict = None,
+                    concurrencia: int = PUSH_CONCURRENCIA, limitador=None, al_terminar_lote=None) -> dict:
+    """
+    Manda el mismo push a todos los tokens. Bloquea hasta terminar (llamar desde un hilo o un worker).
+    Devuelve las métricas de la difusión; "tokens_fallidos" trae (token, excepción) de cada falla
+    y "tokens_muertos" los que hay que podar (ver podar_tokens).
+    `al_terminar_lote(metricas)` se llama en el hilo que llamó después de cada lote (p. ej. para renovar un arriendo).
+    """
+    data = _data(data)
+    tokens = [t for t in dict.fromkeys(tokens) if t]  # sin vacíos ni duplicados, conservando el orden
+    inicio = time.perf_counter()
+
+    metricas = {"tokens": len(tokens), "lotes": 0, "exitos": 0, "fallas": 0, "errores": Counter(),
+                "tokens_fallidos": [], "tokens_muertos": []}
+    if tokens:
+        with ThreadPoolExecutor(max_workers=max(1, concurrencia), thread_name_prefix="push") as executor:
+            futuros = [
+                executor.submit(_enviar_lote, numero, lote, titulo, cuerpo, data, limitador)
+                for numero, lote in enumerate(_lotes(tokens), start=1)
+            ]
+            for futuro in futuros:
+                resultado = futuro.result()
+                metricas["lotes"] += 1
+                metricas["exitos"] += resultado["exitos"]
+                metricas["fallas"] += resultado["fallas"]
+                metricas["errores"].update(resultado["errores"])
+                metricas["tokens_fallidos"].extend(resultado["tokens_fallidos"])
+                metricas["tokens_muertos"].extend(resultado["tokens_muertos"])
+                if al_terminar_lote:
+                    al_terminar_lote(metricas)
+
+    metricas["segundos"] = round(time.perf_counter() - inicio, 2)
+    metricas["tokens_por_segundo"] = round(len(tokens) / metricas["segundos"], 1) if metricas["segundos"] else 0.0
+    logging.info(
+        f"📣 Difusión '{titulo}': {metricas['tokens']} tokens en {metricas['lotes']} lotes, "
+        f"{metricas['exitos']} ok / {metricas['fallas']} fallas, {metricas['segundos']}s "
+        f"({metricas['tokens_por_segundo']} tokens/s), {len(metricas['tokens_muertos'])} tokens muertos, "
+        f"errores: {dict(metricas['errores'])}"
+    )
+    return metricas
@@ -8,6 +8,7 @@ import io
 import re  # <--- IMPORTANTE: Necesario para los videos en el celular
 from pydantic import BaseModel
 import jwt
+from database import get_db_connection
 router = APIRouter()
 
 # Configurar Jinja2
@@ -23,20 +24,6 @@ logging.basicConfig(
     ]
 )
 
-# Conexión a la base de datos
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Error al conectar a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
-
 # Tamaño máximo de archivo (10 MB)
 MAX_FILE_SIZE = 10 * 1024 * 1024 
 
@@ -6,21 +6,19 @@ import psycopg2
 from datetime import datetime
 import logging
 import io
-import re
+import time
+import base64
 import json 
 from pydantic import BaseModel
 import jwt
-from firebase_admin import messaging 
-from fastapi import BackgroundTasks
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-# 🔥 CONFIGURACIÓN DE TU CORREO (Llena estos datos) 🔥
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USER = "prendiax@gmail.com" # Tu correo oficial
-SMTP_PASSWORD = "ekux nkus emdm azcv" # Contraseña de aplicación
+from database import get_db_connection, run_db
+from media_store import store as media_store, ingerir_upload, ArchivoMuyGrande
+from rangos import respuesta_bytea
+import bloqueos
+import pubsub
+import push_outbox
+from busqueda_sql import FILTRO_BUSQUEDA, RELEVANCIA_BUSQUEDA, tsquery_busqueda
+from ws_hub import hub_notificaciones
 
 router = APIRouter()
 
@@ -38,47 +36,9 @@ logging.basicConfig(
 )
 
 # --- GESTOR DE WEBSOCKETS ---
-class NotificationManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
-        logging.debug(f"Usuario {user_id} conectado a WS Notificaciones")
-
-    def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-        logging.debug(f"Usuario {user_id} desconectado de WS Notificaciones")
-
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    logging.error(f"Error enviando WS a {user_id}: {e}")
-
-notification_manager = NotificationManager()
-
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Error al conectar a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
+# Sockets de notificaciones: ws_hub.hub_notificaciones (varios por usuario, envío por cola)
+# Las notificaciones creadas en otro worker llegan por pubsub y se entregan a los sockets de este proceso
+pubsub.registrar_destino("notificaciones", hub_notificaciones.enviar)
 
 MAX_FILE_SIZE = 100 * 1024 * 1024  
 
@@ -133,117 +93,64 @@ def get_user_id_hybrid(request: Request):
         
     return None
 
-# 🔥 TAREA DE FONDO LIGERA (SOLO PUSH, CORREOS PAUSADOS) 🔥
-def enviar_notificaciones_masivas_background(post_id: int, autor_id: int, nombre_autor: str):
-    """Tarea en segundo plano que envía PUSH a todos sin trabar la app."""
-    conn = None
+def _registrar_notificacion(publicacion_id: int, tipo: str, actor_id: int, mensaje: str, target_user_id: int, comentario_id: int):
+    """Parte síncrona de crear_notificacion: guarda la notificación y encola su push (push_outbox)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        # 1. Sacamos los tokens de la base de datos RÁPIDAMENTE
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Solo traemos a los que SÍ tienen la app instalada (fcm_token)
-        cur.execute("SELECT id, fcm_token FROM usuarios WHERE id != %s AND fcm_token IS NOT NULL", (autor_id,))
-        usuarios_con_app = cur.fetchall()
-        cur.close()
-        
-        # 🔥 CERRAMOS LA BD AQUÍ MISMO para liberar el servidor al instante 🔥
-        conn.close()
-        conn = None 
-
-        # 2. ENVIAR SOLO NOTIFICACIÓN PUSH A LOS CELULARES
-        for user in usuarios_con_app:
-            user_id, fcm_token = user
-            try:
-                push_msg = messaging.Message(
-                    notification=messaging.Notification(
-                        title="¡Nuevos servicios en PrendiaX! 👀", 
-                        body=f"{nombre_autor} acaba de publicar algo nuevo."
-                    ), 
-                    apns=messaging.APNSConfig(payload=messaging.APNSPayload(aps=messaging.Aps(sound="default"))),
-                    data={"tipo": "general", "publicacion_id": str(post_id)}, 
-                    token=fcm_token
-                )
-                messaging.send(push_msg)
-            except Exception as push_err:
-                logging.error(f"Error enviando Push masivo a {user_id}: {push_err}")
+        receptor_id = target_user_id
+        if not receptor_id:
+            cur.execute("SELECT user_id FROM publicaciones WHERE id = %s", (publicacion_id,))
+            publicacion = cur.fetchone()
+            if not publicacion: return None
+            receptor_id = publicacion[0]
 
-        # ⛔ NOTA: La parte de smtplib (Correos) está eliminada temporalmente 
-        # hasta que DigitalOcean nos responda el ticket. ⛔
+        if receptor_id == actor_id: return None 
 
-    except Exception as e:
-        logging.error(f"Error en tarea de fondo masiva: {e}")
+        cur.execute("""
+            SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
+        """, (actor_id,))
+        row = cur.fetchone()
+        actor_name = row[0] if row and row[0] else "Usuario"
+
+        cur.execute("""
+            INSERT INTO notifications (user_id, publicacion_id, tipo, leida, fecha_creacion, actor_id, mensaje, comentario_id)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s)
+            RETURNING id, fecha_creacion
+        """, (receptor_id, publicacion_id, tipo, False, actor_id, mensaje, comentario_id))
+        notificacion = cur.fetchone()
+        no_leidas = _contadores_notificaciones(cur, receptor_id)[1]
+
+        # El push sale por push_worker.py; queda encolado en la misma transacción que la notificación
+        titulos = {'interes': "¡Nueva interacción!", 'comentario': "Nuevo comentario", 'respuesta': "Te han respondido", 'mencion': "Te mencionaron"}
+        cuerpos = {'interes': f"A {actor_name} le interesó tu publicación.", 'comentario': f"{actor_name} comentó: {mensaje}", 'respuesta': f"{actor_name} respondió a tu comentario.", 'mencion': f"{actor_name} te mencionó: {mensaje}"}
+        push_outbox.encolar_push(
+            cur, receptor_id, titulos.get(tipo, "Notificación"), cuerpos.get(tipo, "Tienes una nueva notificación"),
+            {"tipo": tipo, "publicacion_id": publicacion_id}, badge=True
+        )
+        conn.commit()
+
+        payload = {
+            "id": notificacion[0], "user_id": receptor_id, "publicacion_id": publicacion_id,
+            "tipo": tipo, "leida": False, "fecha_creacion": notificacion[1].strftime("%Y-%m-%d %H:%M:%S"),
+            "actor_id": actor_id, "nombre_usuario": actor_name, "mensaje": mensaje, "comentario_id": comentario_id,
+            "no_leidas": no_leidas
+        }
+
+        return payload
     finally:
-        if conn: conn.close()
+        cur.close()
+        conn.close()
 
 async def crear_notificacion(publicacion_id: int, tipo: str, actor_id: int, mensaje: str = None, target_user_id: int = None, comentario_id: int = None):
     try:
         if tipo not in ['interes', 'comentario', 'respuesta', 'mencion', 'general']:
             raise HTTPException(status_code=400, detail="Tipo inválido")
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        try:
-            receptor_id = target_user_id
-            if not receptor_id:
-                cur.execute("SELECT user_id FROM publicaciones WHERE id = %s", (publicacion_id,))
-                publicacion = cur.fetchone()
-                if not publicacion: return None
-                receptor_id = publicacion[0]
-
-            if receptor_id == actor_id: return None 
-
-            cur.execute("""
-                SELECT 
-                    (SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s) AS actor_name,
-                    (SELECT fcm_token FROM usuarios WHERE id = %s) AS fcm_token
-            """, (actor_id, receptor_id))
-            row = cur.fetchone()
-            actor_name = row[0] if row and row[0] else "Usuario"
-            fcm_token = row[1] if row and row[1] else None
-
-            cur.execute("""
-                INSERT INTO notifications (user_id, publicacion_id, tipo, leida, fecha_creacion, actor_id, mensaje, comentario_id)
-                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s)
-                RETURNING id, fecha_creacion
-            """, (receptor_id, publicacion_id, tipo, False, actor_id, mensaje, comentario_id))
-            notificacion = cur.fetchone()
-            conn.commit()
-
-            payload = {
-                "id": notificacion[0], "user_id": receptor_id, "publicacion_id": publicacion_id,
-                "tipo": tipo, "leida": False, "fecha_creacion": notificacion[1].strftime("%Y-%m-%d %H:%M:%S"),
-                "actor_id": actor_id, "nombre_usuario": actor_name, "mensaje": mensaje, "comentario_id": comentario_id
-            }
-            await notification_manager.send_personal_message(payload, receptor_id)
-
-            if fcm_token:
-                titulos = {'interes': "¡Nueva interacción!", 'comentario': "Nuevo comentario", 'respuesta': "Te han respondido", 'mencion': "Te mencionaron"}
-                cuerpos = {'interes': f"A {actor_name} le interesó tu publicación.", 'comentario': f"{actor_name} comentó: {mensaje}", 'respuesta': f"{actor_name} respondió a tu comentario.", 'mencion': f"{actor_name} te mencionó: {mensaje}"}
-                
-                cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = %s AND leida = FALSE", (receptor_id,))
-                total_notis = cur.fetchone()[0]
-                badge_count = total_notis 
-
-                try:
-                    push_msg = messaging.Message(
-                        notification=messaging.Notification(title=titulos.get(tipo, "Notificación"), body=cuerpos.get(tipo, "Tienes una nueva notificación")), 
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(sound="default", badge=badge_count)
-                            )
-                        ),
-                        data={"tipo": tipo, "publicacion_id": str(publicacion_id)},
-                        token=fcm_token,
-                    )
-                    messaging.send(push_msg)
-                except Exception as e:
-                    logging.error(f"Error enviando Push: {e}")
-
-            return payload
-        finally:
-            cur.close()
-            conn.close()
+        payload = await run_db(_registrar_notificacion, publicacion_id, tipo, actor_id, mensaje, target_user_id, comentario_id)
+        if payload:
+            await pubsub.publicar_ws("notificaciones", payload["user_id"], payload)
+        return payload
     except Exception as e:
         logging.error(f"Error crear_notificacion: {e}")
         return None
@@ -253,7 +160,7 @@ async def crear_notificacion(publicacion_id: int, tipo: str, actor_id: int, mens
 # =================================================================
 
 @router.post("/api/update_fcm_token")
-async def update_fcm_token(request: Request, data: FCMTokenRequest):
+def update_fcm_token(request: Request, data: FCMTokenRequest):
     conn = None
     try:
         user_id = get_user_id_hybrid(request)
@@ -273,7 +180,7 @@ async def update_fcm_token(request: Request, data: FCMTokenRequest):
         if conn: conn.close()
 
 @router.get("/current_user")
-async def get_current_user(request: Request):
+def get_current_user(request: Request):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: return {"user_id": None, "tipo": None}
@@ -313,7 +220,7 @@ async def salir(request: Request):
 # =================================================================
 
 @router.get("/foto_perfil/{user_id}")
-async def get_foto_perfil(user_id: int):
+def get_foto_perfil(user_id: int, request: Request):
     conn = None
     try:
         conn = get_db_connection()
@@ -331,17 +238,23 @@ async def get_foto_perfil(user_id: int):
         if not result or result[0] != 'emprendedor':
             raise HTTPException(status_code=404, detail="Foto de perfil no disponible para exploradores")
 
-        cur.execute("SELECT foto FROM datos_usuario WHERE user_id = %s", (user_id,))
+        # El bytea solo se trae si la foto aún no se migró al media store
+        cur.execute("SELECT foto_key, CASE WHEN foto_key IS NULL THEN foto END FROM datos_usuario WHERE user_id = %s", (user_id,))
         result = cur.fetchone()
         cur.close()
 
-        if not result or not result[0]:
+        if result and result[0]:
+            return media_store.respuesta(request, result[0], "image/jpeg")
+        if not result or not result[1]:
             raise HTTPException(status_code=404, detail="Foto de perfil no encontrada")
 
-        foto_data = result[0]
+        foto_data = result[1]
         return StreamingResponse(io.BytesIO(foto_data), media_type="image/jpeg")
     except HTTPException as he:
         raise he
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
     except Exception as e:
         logging.error(f"Error foto de perfil: {e}")
         raise HTTPException(status_code=500, detail="Error foto")
@@ -349,23 +262,30 @@ async def get_foto_perfil(user_id: int):
         if conn: conn.close()
 
 @router.get("/media/imagen/{img_id}")
-def get_media_imagen_carrusel(img_id: int):
+def get_media_imagen_carrusel(img_id: int, request: Request):
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT imagen FROM publicacion_imagenes WHERE id = %s", (img_id,))
+        cur.execute("SELECT imagen_key, CASE WHEN imagen_key IS NULL THEN imagen END FROM publicacion_imagenes WHERE id = %s", (img_id,))
         result = cur.fetchone()
         cur.close()
         
-        if not result or not result[0]:
+        if result and result[0]:
+            return media_store.respuesta(request, result[0], "image/jpeg", f"img_car_{img_id}.jpg")
+        if not result or not result[1]:
             raise HTTPException(status_code=404, detail="Imagen no encontrada")
             
         return StreamingResponse(
-            content=io.BytesIO(result[0]),
+            content=io.BytesIO(result[1]),
             media_type="image/jpeg",
             headers={"Content-Disposition": f"inline; filename=img_car_{img_id}.jpg"}
         )
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
     except Exception as e:
         logging.error(f"Error sirviendo imagen carrusel {img_id}: {e}")
         raise HTTPException(status_code=500, detail="Error interno")
@@ -373,20 +293,25 @@ def get_media_imagen_carrusel(img_id: int):
         if conn: conn.close()
 
 @router.get("/media/imagen_vieja/{post_id}")
-def get_media_imagen_vieja(post_id: int):
+def get_media_imagen_vieja(post_id: int, request: Request):
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT imagen FROM publicaciones WHERE id = %s", (post_id,))
+        cur.execute("SELECT imagen_key, CASE WHEN imagen_key IS NULL THEN imagen END FROM publicaciones WHERE id = %s", (post_id,))
         result = cur.fetchone()
         cur.close()
-        if not result or not result[0]:
+        if result and result[0]:
+            return media_store.respuesta(request, result[0], "image/jpeg", f"old_img_{post_id}.jpg")
+        if not result or not result[1]:
             raise HTTPException(status_code=404, detail="Imagen no encontrada")
         return StreamingResponse(
-            content=io.BytesIO(result[0]), media_type="image/jpeg",
+            content=io.BytesIO(result[1]), media_type="image/jpeg",
             headers={"Content-Disposition": f"inline; filename=old_img_{post_id}.jpg"}
         )
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
     finally:
         if conn: conn.close()
 
@@ -396,58 +321,23 @@ def get_media(post_id: int, request: Request):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT video FROM publicaciones WHERE id = %s", (post_id,))
+        # Solo el tamaño: los bytes se leen por ventanas según el Range que pida el reproductor
+        cur.execute("SELECT video_key, octet_length(video) FROM publicaciones WHERE id = %s", (post_id,))
         result = cur.fetchone()
         cur.close()
         conn.close()
 
-        if not result or not result[0]:
+        if result and result[0]:
+            return media_store.respuesta(request, result[0], "video/mp4", f"post_{post_id}_video.mp4")
+        if not result or not result[1]:
             raise HTTPException(status_code=404, detail="Video no encontrado")
 
-        video_data = result[0]
-        file_size = len(video_data)
-        range_header = request.headers.get("range")
-        headers = {
-            "Accept-Ranges": "bytes",
-            "Content-Disposition": f"inline; filename=post_{post_id}_video.mp4"
-        }
-
-        if not range_header:
-            headers["Content-Length"] = str(file_size)
-            return StreamingResponse(
-                content=io.BytesIO(video_data),
-                media_type="video/mp4",
-                headers=headers,
-                status_code=200
-            )
-
-        try:
-            range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-            if not range_match: raise ValueError("Rango inválido")
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-        except ValueError:
-            start = 0
-            end = file_size - 1
-
-        if start >= file_size:
-            headers["Content-Range"] = f"bytes */{file_size}"
-            return Response(status_code=416, headers=headers)
-
-        end = min(end, file_size - 1)
-        chunk_length = end - start + 1
-        chunk_data = video_data[start : end + 1]
-
-        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
-        headers["Content-Length"] = str(chunk_length)
-        headers["Content-Type"] = "video/mp4"
-
-        return StreamingResponse(
-            io.BytesIO(chunk_data),
-            status_code=206,
-            headers=headers,
-            media_type="video/mp4"
-        )
+        return respuesta_bytea(request, "publicaciones", "video", post_id, result[1], "video/mp4", f"post_{post_id}_video.mp4")
+    except HTTPException as he:
+        raise he
+    except FileNotFoundError:
+        # La fila apunta a una clave que ya no está en el media store
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
     except Exception as e:
         if conn and not conn.closed: conn.close()
         logging.error(f"Error media post {post_id}: {e}")
@@ -457,9 +347,58 @@ def get_media(post_id: int, request: Request):
 # CREAR, EDITAR Y BORRAR PUBLICACIONES
 # =================================================================
 
-# 🔥 ENDPOINT CORREGIDO CON TAREA DE FONDO Y ALGORITMO DESPERTADOR 🔥
+async def _subir_archivo(upload, content_type: str, detalle_limite: str):
+    """Pasa un UploadFile al media store por trozos, cortando en cuanto supera MAX_FILE_SIZE."""
+    try:
+        return await ingerir_upload(upload, MAX_FILE_SIZE, content_type)
+    except ArchivoMuyGrande:
+        raise HTTPException(status_code=400, detail=detalle_limite)
+
+def _guardar_publicacion(user_id: int, texto: str, etiquetas_lista: list, video_key: str | None, imagenes_keys: list):
+    """
+    Inserta la publicación con su multimedia y encola el push masivo. Devuelve (post_id, nombre_autor).
+    El algoritmo despertador ya no corre aquí: lo hace push_worker.py en segundo plano (mantenimiento.despertar_inactivos).
+    """
+    # La multimedia ya está en el media store (ver _subir_archivo); la fila solo guarda la clave
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        cur.execute("""
+            INSERT INTO publicaciones (user_id, contenido, video_key, etiquetas, fecha_creacion)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            RETURNING id
+        """, (user_id, texto, video_key, etiquetas_lista))
+        
+        post_id = cur.fetchone()[0]
+
+        for imagen_key in imagenes_keys:
+            cur.execute("""
+                INSERT INTO publicacion_imagenes (publicacion_id, imagen_key)
+                VALUES (%s, %s)
+            """, (post_id, imagen_key))
+
+        # 🔥 OBTENEMOS EL NOMBRE DEL AUTOR PARA LOS CORREOS Y PUSH MASIVOS 🔥
+        cur.execute("SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s", (user_id,))
+        autor = cur.fetchone()
+        nombre_autor = autor[0] if autor and autor[0] else "Alguien"
+
+        # El push masivo lo manda push_worker.py en lotes; se encola junto con la publicación
+        push_outbox.encolar_difusion(
+            cur, "¡Nuevos servicios en PrendiaX! 👀", f"{nombre_autor} acaba de publicar algo nuevo.",
+            {"tipo": "general", "publicacion_id": post_id}, excluir_user_id=user_id
+        )
+        conn.commit()
+
+        cur.close()
+        return post_id, nombre_autor
+    finally:
+        if conn: conn.close()
+
+# 🔥 ENDPOINT DE PUBLICAR (push y despertador fuera de la petición) 🔥
 @router.post("/publicar")
-async def publicar(request: Request, background_tasks: BackgroundTasks):
+async def publicar(request: Request):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id:
@@ -490,85 +429,66 @@ async def publicar(request: Request, background_tasks: BackgroundTasks):
 
         etiquetas_lista = [e.strip() for e in etiquetas.split(",") if e.strip()] if isinstance(etiquetas, str) and etiquetas else []
         
-        video_data = None
+        # Se copian al store por trozos mientras llegan: nunca se tiene el archivo completo en memoria
+        video_key = None
         if video_valido:
-            video_data = await video_valido.read()
-            if len(video_data) > MAX_FILE_SIZE:
-                raise HTTPException(status_code=400, detail="Video muy pesado")
-
-        conn = None
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute("""
-                INSERT INTO publicaciones (user_id, contenido, video, etiquetas, fecha_creacion)
-                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                RETURNING id
-            """, (user_id, texto, psycopg2.Binary(video_data) if video_data else None, etiquetas_lista))
-            
-            post_id = cur.fetchone()[0]
+            video_key = await _subir_archivo(video_valido, "video/mp4", "Video muy pesado")
 
-            for img in imagenes_validas:
-                img_data = await img.read()
-                if img_data:
-                    cur.execute("""
-                        INSERT INTO publicacion_imagenes (publicacion_id, imagen)
-                        VALUES (%s, %s)
-                    """, (post_id, psycopg2.Binary(img_data)))
-
-            conn.commit()
-
-            # 🔥 OBTENEMOS EL NOMBRE DEL AUTOR PARA LOS CORREOS Y PUSH MASIVOS 🔥
-            cur.execute("SELECT COALESCE(du.nombre_empresa, u.nombre) FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s", (user_id,))
-            autor = cur.fetchone()
-            nombre_autor = autor[0] if autor and autor[0] else "Alguien"
-            
-            # Lanzamos la tarea de envío masivo de correos/pushes en segundo plano
-            background_tasks.add_task(enviar_notificaciones_masivas_background, post_id, user_id, nombre_autor)
-
-            # 🔥 ALGORITMO DESPERTADOR (Notificación In-App para usuarios inactivos) 🔥
-            try:
-                cur.execute("""
-                    SELECT id, fcm_token FROM usuarios 
-                    WHERE id != %s AND fcm_token IS NOT NULL
-                      AND ultima_conexion < CURRENT_TIMESTAMP - INTERVAL '2 days'
-                      AND (ultima_noti_despertador IS NULL OR ultima_noti_despertador < CURRENT_TIMESTAMP - INTERVAL '7 days')
-                    LIMIT 50
-                """, (user_id,))
-                
-                usuarios_dormidos = cur.fetchall()
-
-                if usuarios_dormidos:
-                    ids_despertados = []
-                    for user_dormido in usuarios_dormidos:
-                        ids_despertados.append(user_dormido[0])
-                        # Nota: Esto es solo un respaldo local. El Push principal ya se manda arriba
-                        # Creamos el registro en la base de datos de notificaciones (la campanita)
-                        cur.execute("""
-                            INSERT INTO notifications (user_id, publicacion_id, tipo, leida, fecha_creacion, actor_id, mensaje)
-                            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s)
-                        """, (user_dormido[0], post_id, 'general', False, user_id, f"{nombre_autor} acaba de publicar algo nuevo."))
-
-                    if ids_despertados:
-                        cur.execute("UPDATE usuarios SET ultima_noti_despertador = CURRENT_TIMESTAMP WHERE id = ANY(%s)", (ids_despertados,))
-                        conn.commit()
-            except Exception as alg_err:
-                logging.error(f"Error en Algoritmo Despertador: {alg_err}")
-
-            cur.close()
-        finally:
-            if conn: conn.close()
+        imagenes_keys = []
+        for img in imagenes_validas:
+            img_key = await _subir_archivo(img, "image/jpeg", "Imagen muy pesada")
+            if img_key:
+                imagenes_keys.append(img_key)
 
+        await run_db(_guardar_publicacion, user_id, texto, etiquetas_lista, video_key, imagenes_keys)
         return RedirectResponse(url="/inicio", status_code=302)
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         logging.error(f"💥 ERROR EN /PUBLICAR:\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _actualizar_publicacion(post_id: int, user_id: int, texto: str, etiquetas_lista: list, media: tuple | None):
+    """Actualiza texto/etiquetas y, si media no es None, reemplaza video e imágenes."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+
+        cur.execute("SELECT user_id FROM publicaciones WHERE id = %s", (post_id,))
+        row = cur.fetchone()
+        if not row: raise HTTPException(status_code=404, detail="Publicación no encontrada")
+        if row[0] != user_id: raise HTTPException(status_code=403, detail="No tienes permiso")
+
+        if media is not None:
+            video_key, imagenes_keys = media
+            cur.execute("DELETE FROM publicacion_imagenes WHERE publicacion_id = %s", (post_id,))
+
+            # Se limpian también las columnas viejas para que no quede multimedia anterior en la fila
+            cur.execute("""
+                UPDATE publicaciones SET contenido = %s, etiquetas = %s, video_key = %s, video = NULL, imagen_key = NULL, imagen = NULL
+                WHERE id = %s
+            """, (texto, etiquetas_lista, video_key, post_id))
+
+            for imagen_key in imagenes_keys:
+                cur.execute("INSERT INTO publicacion_imagenes (publicacion_id, imagen_key) VALUES (%s, %s)", 
+                            (post_id, imagen_key))
+        else:
+            cur.execute("""
+                UPDATE publicaciones SET contenido = %s, etiquetas = %s
+                WHERE id = %s
+            """, (texto, etiquetas_lista, post_id))
+
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
 @router.post("/api/publicacion/{post_id}/editar")
 async def editar_publicacion(post_id: int, request: Request):
-    conn = None
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
@@ -584,56 +504,37 @@ async def editar_publicacion(post_id: int, request: Request):
         if imagen_singular and getattr(imagen_singular, "filename", None):
             imagenes.append(imagen_singular)
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("SELECT user_id FROM publicaciones WHERE id = %s", (post_id,))
-        row = cur.fetchone()
-        if not row: raise HTTPException(status_code=404, detail="Publicación no encontrada")
-        if row[0] != user_id: raise HTTPException(status_code=403, detail="No tienes permiso")
-
         texto = contenido.strip() if contenido else ""
         etiquetas_lista = [e.strip() for e in etiquetas.split(",") if e.strip()] if isinstance(etiquetas, str) and etiquetas else []
 
+        media = None
         if reemplazar_media == "true":
-            cur.execute("DELETE FROM publicacion_imagenes WHERE publicacion_id = %s", (post_id,))
-            
             imagenes_validas = [img for img in imagenes if getattr(img, "filename", None)]
             video_valido = video if getattr(video, "filename", None) else None
-            video_data = await video_valido.read() if video_valido else None
             
             if len(imagenes_validas) > 10: raise HTTPException(status_code=400, detail="Máximo 10 imágenes")
-            if imagenes_validas and video_data: raise HTTPException(status_code=400, detail="Imágenes o video, no ambos")
-
-            cur.execute("""
-                UPDATE publicaciones SET contenido = %s, etiquetas = %s, video = %s
-                WHERE id = %s
-            """, (texto, etiquetas_lista, psycopg2.Binary(video_data) if video_data else None, post_id))
+            if imagenes_validas and video_valido: raise HTTPException(status_code=400, detail="Imágenes o video, no ambos")
 
+            video_key = await _subir_archivo(video_valido, "video/mp4", "Video muy pesado") if video_valido else None
+            imagenes_keys = []
             for img in imagenes_validas:
-                img_data = await img.read()
-                if img_data:
-                    cur.execute("INSERT INTO publicacion_imagenes (publicacion_id, imagen) VALUES (%s, %s)", 
-                                (post_id, psycopg2.Binary(img_data)))
-        else:
-            cur.execute("""
-                UPDATE publicaciones SET contenido = %s, etiquetas = %s
-                WHERE id = %s
-            """, (texto, etiquetas_lista, post_id))
+                img_key = await _subir_archivo(img, "image/jpeg", "Imagen muy pesada")
+                if img_key:
+                    imagenes_keys.append(img_key)
+            media = (video_key, imagenes_keys)
 
-        conn.commit()
+        await run_db(_actualizar_publicacion, post_id, user_id, texto, etiquetas_lista, media)
         return JSONResponse(content={"status": "ok", "message": "Publicación actualizada"})
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         logging.error(f"💥 ERROR EN /EDITAR:\n{traceback.format_exc()}")
-        if conn: conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn: conn.close()
 
 @router.delete("/borrar_publicacion/{post_id}")
-async def borrar_publicacion(post_id: int, request: Request):
+def borrar_publicacion(post_id: int, request: Request):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
@@ -661,8 +562,121 @@ async def borrar_publicacion(post_id: int, request: Request):
 # FEED, BÚSQUEDA Y LECTURA DE POSTS
 # =================================================================
 
+# =================================================================
+# LISTADOS DE PUBLICACIONES (consulta, formato y paginación compartidos)
+# =================================================================
+
+# Columnas de una publicación lista para el feed. El primer %s es el usuario que mira (para "interesado").
+# interesados_count / comentarios_count son contadores en la fila, mantenidos por triggers (ver migraciones.py).
+COLUMNAS_PUBLICACIONES = """
+    SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion,
+        COALESCE(du.nombre_empresa, u.nombre) AS display_name,
+        CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END AS tipo_usuario,
+        (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id) AS imagenes_ids,
+        (p.video_key IS NOT NULL OR p.video IS NOT NULL) AS has_video,
+        p.interesados_count,
+        EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s) AS interesado,
+        p.comentarios_count,
+        (p.imagen_key IS NOT NULL OR p.imagen IS NOT NULL) AS has_old_image
+"""
+FROM_PUBLICACIONES = """
+    FROM publicaciones p
+    JOIN usuarios u ON p.user_id = u.id
+    LEFT JOIN datos_usuario du ON p.user_id = du.user_id
+"""
+SQL_PUBLICACIONES = COLUMNAS_PUBLICACIONES + FROM_PUBLICACIONES
+
+# Oculta en ambos sentidos a los usuarios bloqueados (param: bloqueos.ids_bloqueados(usuario), cacheado por worker)
+FILTRO_SIN_BLOQUEOS = "p.user_id <> ALL(%s::int[])"
+
+# Publicaciones de bienvenida que van fijadas arriba de la primera página del feed (columna fijada,
+# índice parcial idx_publicaciones_fijadas, ver migración 016_publicaciones_fijadas)
+FILTRO_FIJADA = "p.fijada"
+
+def _codificar_cursor(fecha_creacion, post_id: int) -> str:
+    valor = fecha_creacion.isoformat() if isinstance(fecha_creacion, datetime) else str(fecha_creacion)
+    return base64.urlsafe_b64encode(f"{valor}|{post_id}".encode()).decode()
+
+def _decodificar_cursor(cursor: Optional[str], por_relevancia: bool = False):
+    """
+    Cursor opaco -> (fecha_creacion, id), o (relevancia, id) en la búsqueda.
+    None si no viene; 400 si está mal formado.
+    """
+    if not cursor:
+        return None
+    try:
+        valor, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if por_relevancia:
+            float(valor)
+        else:
+            datetime.fromisoformat(valor)
+        return valor, int(post_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _fila_a_publicacion(row) -> dict:
+    return {
+        "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
+        "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [],
+        "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
+        "video_url": f"/media/{row[0]}" if row[8] else "",
+        "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
+        "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
+        "nombre_empresa": row[5], "tipo_usuario": row[6],
+        "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
+    }
+
+def _listar_publicaciones(cur, viewer_id, condiciones: list, params: list, limit: int, cursor=None, offset: int = 0, relevancia=None, fijadas_primero: bool = False):
+    """
+    Paginación keyset sobre (fecha_creacion, id): cada página es un seek al índice sin importar la profundidad.
+    Con `relevancia` = (expresión SQL, params) se ordena por (relevancia, id) y el cursor guarda esa pareja.
+    `offset` es el modo viejo (deprecado) y solo se usa cuando el cliente no manda cursor.
+    `fijadas_primero` antepone p.fijada al orden (solo para el modo offset del feed).
+    Devuelve (publicaciones, next_cursor); next_cursor es None cuando ya no hay más.
+    """
+    condiciones = list(condiciones)
+    params = list(params)
+    sql = SQL_PUBLICACIONES
+    select_params = []
+
+    if relevancia:
+        expresion, expresion_params = relevancia
+        # Columna 13 del SELECT; se repite en el WHERE porque el alias no se puede usar ahí
+        sql = COLUMNAS_PUBLICACIONES + f", {expresion} AS relevancia" + FROM_PUBLICACIONES
+        select_params = list(expresion_params)
+        if cursor:
+            condiciones.append(f"({expresion}, p.id) < (%s::real, %s)")
+            params.extend(expresion_params)
+            params.extend(cursor)
+        orden, col_cursor = "relevancia DESC, p.id DESC", 13
+    else:
+        if cursor:
+            condiciones.append("(p.fecha_creacion, p.id) < (%s, %s)")
+            params.extend(cursor)
+        orden, col_cursor = "p.fecha_creacion DESC, p.id DESC", 4
+    if fijadas_primero:
+        orden = "p.fijada DESC, " + orden
+
+    if condiciones:
+        sql += " WHERE " + " AND ".join(f"({c})" for c in condiciones)
+    sql += f" ORDER BY {orden} LIMIT %s"
+    params.append(limit)
+    if offset and not cursor:
+        sql += " OFFSET %s"
+        params.append(offset)
+
+    cur.execute(sql, [viewer_id] + select_params + params)
+    rows = cur.fetchall()
+    next_cursor = _codificar_cursor(rows[-1][col_cursor], rows[-1][0]) if rows and len(rows) == limit else None
+    return [_fila_a_publicacion(row) for row in rows], next_cursor
+
+def _poner_cursor(response: Response, next_cursor: Optional[str]):
+    # El cuerpo sigue siendo una lista (la app no cambia); el cursor viaja en un header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
 @router.get("/inicio", response_class=HTMLResponse)
-async def inicio(request: Request, limit: int = 10, offset: int = 0):
+def inicio(request: Request, limit: int = 10, offset: int = 0, cursor: Optional[str] = None):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id:
@@ -672,49 +686,13 @@ async def inicio(request: Request, limit: int = 10, offset: int = 0):
         try:
             conn = get_db_connection()
             cur = conn.cursor()
-            cur.execute("""
-                SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                    COALESCE(du.nombre_empresa, u.nombre) AS display_name,
-                    CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END AS tipo_usuario,
-                    (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id) AS imagenes_ids,
-                    p.video IS NOT NULL AS has_video,
-                    COUNT(DISTINCT i.user_id) AS interesados_count,
-                    EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s) AS interesado,
-                    (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id) AS comentarios_count,
-                    p.imagen IS NOT NULL AS has_old_image
-                FROM publicaciones p
-                JOIN usuarios u ON p.user_id = u.id
-                LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-                LEFT JOIN intereses i ON p.id = i.publicacion_id
-                GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-                ORDER BY p.fecha_creacion DESC
-                LIMIT %s OFFSET %s
-            """, (user_id, limit, offset))
-            publicaciones = cur.fetchall()
+            publicaciones_list, _ = _listar_publicaciones(
+                cur, user_id, [], [], limit, _decodificar_cursor(cursor), offset
+            )
             cur.close()
         finally:
             if conn: conn.close()
 
-        publicaciones_list = [
-            {
-                "id": row[0],
-                "user_id": int(row[1]),
-                "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [],
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [],
-                "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5],
-                "tipo_usuario": row[6],
-                "interesados_count": int(row[9]),
-                "interesado": row[10],
-                "comentarios_count": int(row[11])
-            }
-            for row in publicaciones
-        ]
-
         return templates.TemplateResponse("inicio.html", {
             "request": request,
             "publicaciones": publicaciones_list,
@@ -724,117 +702,157 @@ async def inicio(request: Request, limit: int = 10, offset: int = 0):
         logging.error(f"Error en /inicio: {e}")
         return RedirectResponse(url="/login", status_code=302)
 
+def _es_fijada(cur, post_id: int) -> bool:
+    cur.execute("SELECT fijada FROM publicaciones WHERE id = %s", (post_id,))
+    fila = cur.fetchone()
+    return bool(fila and fila[0])
+
 @router.get("/feed")
-async def feed(limit: int = 10, offset: int = 0, request: Request = None):
+def feed(response: Response, limit: int = 10, offset: int = 0, cursor: Optional[str] = None, request: Request = None):
+    posicion = _decodificar_cursor(cursor)
     conn = None
     try:
         current_user = get_user_id_hybrid(request) if request else -1
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        query = """
-            SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                COALESCE(du.nombre_empresa, u.nombre) AS display_name,
-                CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END AS tipo_usuario,
-                (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id) AS imagenes_ids,
-                p.video IS NOT NULL AS has_video,
-                COUNT(DISTINCT i.user_id) AS interesados_count,
-                EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s) AS interesado,
-                (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id) AS comentarios_count,
-                p.imagen IS NOT NULL AS has_old_image
-            FROM publicaciones p
-            JOIN usuarios u ON p.user_id = u.id
-            LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-            LEFT JOIN intereses i ON p.id = i.publicacion_id
-            WHERE 
-                p.user_id NOT IN (SELECT bloqueado_id FROM bloqueos WHERE bloqueador_id = %s)
-                AND 
-                p.user_id NOT IN (SELECT bloqueador_id FROM bloqueos WHERE bloqueado_id = %s)
-            GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-            ORDER BY CASE WHEN p.contenido LIKE 'Bienvenidos a PrendiaX!%%' THEN 1 ELSE 0 END DESC, p.fecha_creacion DESC LIMIT %s OFFSET %s
-        """
-        
-        cur.execute(query, (current_user, current_user, current_user, limit, offset))
-        publicaciones = cur.fetchall()
+        ocultos = bloqueos.ids_bloqueados(current_user, cur)
+
+        if offset and not posicion:
+            # Modo viejo: un solo ORDER BY con las fijadas primero, así el OFFSET cuenta las dos listas juntas
+            publicaciones, next_cursor = _listar_publicaciones(
+                cur, current_user, [FILTRO_SIN_BLOQUEOS], [ocultos], limit, None, offset, fijadas_primero=True
+            )
+            cur.close()
+            _poner_cursor(response, next_cursor)
+            return publicaciones
+
+        # Keyset: primero las fijadas, de a `limit`, y después las demás. Un cursor que apunta a una fijada
+        # sigue dentro de las fijadas; cualquier otro ya las dejó atrás
+        en_fijadas = posicion is None or _es_fijada(cur, posicion[1])
+        fijadas, next_cursor = [], None
+        if en_fijadas:
+            fijadas, next_cursor = _listar_publicaciones(
+                cur, current_user, [FILTRO_SIN_BLOQUEOS, FILTRO_FIJADA], [ocultos], limit, posicion
+            )
+
+        publicaciones = []
+        restantes = limit - len(fijadas)
+        if restantes > 0:
+            publicaciones, next_cursor = _listar_publicaciones(
+                cur, current_user, [FILTRO_SIN_BLOQUEOS, f"NOT {FILTRO_FIJADA}"], [ocultos],
+                restantes, None if en_fijadas else posicion
+            )
         cur.close()
 
-        return [
-            {
-                "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [], 
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5], "tipo_usuario": row[6],
-                "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
-            } for row in publicaciones
-        ]
+        _poner_cursor(response, next_cursor)
+        return fijadas + publicaciones
     except Exception as e:
         logging.error(f"Error feed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn: conn.close()
 
+# Búsqueda de texto completo: FILTRO_BUSQUEDA y RELEVANCIA_BUSQUEDA viven en busqueda_sql.py
 @router.get("/search")
-async def search_publicaciones(query: str, limit: int = 10, offset: int = 0, request: Request = None):
+def search_publicaciones(response: Response, query: str, limit: int = 10, offset: int = 0, cursor: Optional[str] = None, request: Request = None):
     query = query.strip().lower()
     if not query: raise HTTPException(status_code=400, detail="Query empty")
+    posicion = _decodificar_cursor(cursor, por_relevancia=True)
+    tsquery = tsquery_busqueda(query)
+    if not tsquery:
+        return []
     conn = None
     try:
         current_user = get_user_id_hybrid(request) if request else -1
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                COALESCE(du.nombre_empresa, u.nombre),
-                CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id),
-                p.video IS NOT NULL,
-                COUNT(DISTINCT i.user_id),
-                EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s),
-                (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id),
-                p.imagen IS NOT NULL
-            FROM publicaciones p
-            JOIN usuarios u ON p.user_id = u.id
-            LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-            LEFT JOIN intereses i ON p.id = i.publicacion_id
-            WHERE 
-                (
-                    LOWER(COALESCE(du.nombre_empresa, u.nombre)) LIKE %s
-                    OR EXISTS (SELECT 1 FROM unnest(p.etiquetas) AS etiqueta WHERE LOWER(etiqueta) LIKE %s)
-                    OR LOWER(p.contenido) LIKE %s
-                )
-                AND p.user_id NOT IN (SELECT bloqueado_id FROM bloqueos WHERE bloqueador_id = %s)
-                AND p.user_id NOT IN (SELECT bloqueador_id FROM bloqueos WHERE bloqueado_id = %s)
-            GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-            ORDER BY p.fecha_creacion DESC LIMIT %s OFFSET %s
-        """, (current_user, f"%{query}%", f"%{query}%", f"%{query}%", current_user, current_user, limit, offset))
-        
-        publicaciones = cur.fetchall()
+
+        publicaciones, next_cursor = _listar_publicaciones(
+            cur, current_user, [FILTRO_BUSQUEDA, FILTRO_SIN_BLOQUEOS],
+            [tsquery, tsquery, tsquery, bloqueos.ids_bloqueados(current_user, cur)],
+            limit, posicion, offset, relevancia=(RELEVANCIA_BUSQUEDA, [tsquery])
+        )
         cur.close()
 
-        return [
-            {
-                "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [], 
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5], "tipo_usuario": row[6],
-                "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
-            } for row in publicaciones
-        ]
+        _poner_cursor(response, next_cursor)
+        return publicaciones
     except Exception as e:
         logging.error(f"Error search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if conn: conn.close()
 
+# Etiquetas normalizadas (minúsculas, sin acentos) con índice GIN; ver migración 005_etiquetas_normalizadas.
+# La normalización se hace en SQL para que coincida exactamente con la de etiquetas_norm. Params: etiqueta.
+FILTRO_ETIQUETA = "p.etiquetas_norm @> ARRAY[normalizar_etiqueta(%s)]"
+
+# /tags/tendencias se lee de etiquetas_conteo (mantenida por trigger) y además se guarda unos minutos en memoria
+TENDENCIAS_TTL = 300
+_tendencias_cache: Dict[tuple, tuple] = {}
+
+def _consultar_tendencias(dias: int, limit: int) -> list:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT etiqueta, SUM(publicaciones) AS total
+            FROM etiquetas_conteo
+            WHERE dia > CURRENT_DATE - %s
+            GROUP BY etiqueta
+            HAVING SUM(publicaciones) > 0
+            ORDER BY total DESC, etiqueta
+            LIMIT %s
+        """, (dias, limit))
+        tendencias = [{"etiqueta": row[0], "publicaciones": int(row[1])} for row in cur.fetchall()]
+        cur.close()
+        return tendencias
+    finally:
+        conn.close()
+
+# Va antes de /tags/{tag} para que "tendencias" no se tome como nombre de etiqueta
+@router.get("/tags/tendencias")
+def tags_tendencias(dias: int = 7, limit: int = 20):
+    dias = max(1, min(dias, 90))
+    limit = max(1, min(limit, 100))
+    clave = (dias, limit)
+    guardado = _tendencias_cache.get(clave)
+    if guardado and guardado[0] > time.monotonic():
+        return guardado[1]
+    try:
+        tendencias = _consultar_tendencias(dias, limit)
+    except Exception as e:
+        logging.error(f"Error tendencias: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    _tendencias_cache[clave] = (time.monotonic() + TENDENCIAS_TTL, tendencias)
+    return tendencias
+
+@router.get("/tags/{tag}")
+def listar_por_etiqueta(tag: str, response: Response, limit: int = 10, cursor: Optional[str] = None, request: Request = None):
+    tag = tag.strip()
+    if not tag: raise HTTPException(status_code=400, detail="Etiqueta vacía")
+    posicion = _decodificar_cursor(cursor)
+    conn = None
+    try:
+        current_user = get_user_id_hybrid(request) if request else -1
+        conn = get_db_connection()
+        cur = conn.cursor()
+        publicaciones, next_cursor = _listar_publicaciones(
+            cur, current_user, [FILTRO_ETIQUETA, FILTRO_SIN_BLOQUEOS], [tag, bloqueos.ids_bloqueados(current_user, cur)],
+            limit, posicion
+        )
+        cur.close()
+
+        _poner_cursor(response, next_cursor)
+        return publicaciones
+    except Exception as e:
+        logging.error(f"Error tags: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if conn: conn.close()
+
 @router.get("/perfil/feed")
-async def perfil_feed(request: Request, limit: int = 10, offset: int = 0):
+def perfil_feed(request: Request, response: Response, limit: int = 10, offset: int = 0, cursor: Optional[str] = None):
+    posicion = _decodificar_cursor(cursor)
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
@@ -843,85 +861,34 @@ async def perfil_feed(request: Request, limit: int = 10, offset: int = 0):
         try:
             conn = get_db_connection()
             cur = conn.cursor()
-            cur.execute("""
-                SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                    COALESCE(du.nombre_empresa, u.nombre),
-                    CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                    (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id), 
-                    p.video IS NOT NULL,
-                    COUNT(DISTINCT i.user_id),
-                    EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s),
-                    (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id),
-                    p.imagen IS NOT NULL
-                FROM publicaciones p
-                JOIN usuarios u ON p.user_id = u.id
-                LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-                LEFT JOIN intereses i ON p.id = i.publicacion_id
-                WHERE p.user_id = %s
-                GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-                ORDER BY p.fecha_creacion DESC LIMIT %s OFFSET %s
-            """, (user_id, user_id, limit, offset))
-            publicaciones = cur.fetchall()
+            publicaciones, next_cursor = _listar_publicaciones(
+                cur, user_id, ["p.user_id = %s"], [user_id], limit, posicion, offset
+            )
             cur.close()
         finally:
             if conn: conn.close()
 
-        return [
-            {
-                "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [], 
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5], "tipo_usuario": row[6],
-                "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
-            } for row in publicaciones
-        ]
+        _poner_cursor(response, next_cursor)
+        return publicaciones
     except Exception as e:
         logging.error(f"Error perfil feed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/user/{user_id}/publicaciones")
-async def get_user_publicaciones(user_id: int, limit: int = 10, offset: int = 0, request: Request = None):
+def get_user_publicaciones(user_id: int, response: Response, limit: int = 10, offset: int = 0, cursor: Optional[str] = None, request: Request = None):
+    posicion = _decodificar_cursor(cursor)
     conn = None
     try:
         current_user = get_user_id_hybrid(request) if request else -1
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                COALESCE(du.nombre_empresa, u.nombre),
-                CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id), 
-                p.video IS NOT NULL,
-                COUNT(DISTINCT i.user_id),
-                EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s),
-                (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id),
-                p.imagen IS NOT NULL
-            FROM publicaciones p
-            JOIN usuarios u ON p.user_id = u.id
-            LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-            LEFT JOIN intereses i ON p.id = i.publicacion_id
-            WHERE p.user_id = %s
-            GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-            ORDER BY p.fecha_creacion DESC LIMIT %s OFFSET %s
-        """, (current_user, user_id, limit, offset))
-        publicaciones = cur.fetchall()
+        publicaciones, next_cursor = _listar_publicaciones(
+            cur, current_user, ["p.user_id = %s"], [user_id], limit, posicion, offset
+        )
         cur.close()
 
-        return [
-            {
-                "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [], 
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5], "tipo_usuario": row[6],
-                "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
-            } for row in publicaciones
-        ]
+        _poner_cursor(response, next_cursor)
+        return publicaciones
     except Exception as e:
         logging.error(f"Error user posts: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -929,44 +896,19 @@ async def get_user_publicaciones(user_id: int, limit: int = 10, offset: int = 0,
         if conn: conn.close()
 
 @router.get("/publicacion/{post_id}")
-async def get_publicacion(post_id: int, request: Request):
+def get_publicacion(post_id: int, request: Request):
     try:
         current_user = get_user_id_hybrid(request)
         conn = None
         try:
             conn = get_db_connection()
             cur = conn.cursor()
-            cur.execute("""
-                SELECT p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, 
-                    COALESCE(du.nombre_empresa, u.nombre),
-                    CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                    (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id), 
-                    p.video IS NOT NULL,
-                    COUNT(DISTINCT i.user_id),
-                    EXISTS (SELECT 1 FROM intereses i WHERE i.publicacion_id = p.id AND i.user_id = %s),
-                    (SELECT COUNT(*) FROM comentarios c WHERE c.publicacion_id = p.id),
-                    p.imagen IS NOT NULL
-                FROM publicaciones p
-                JOIN usuarios u ON p.user_id = u.id
-                LEFT JOIN datos_usuario du ON p.user_id = du.user_id
-                LEFT JOIN intereses i ON p.id = i.publicacion_id
-                WHERE p.id = %s
-                GROUP BY p.id, p.user_id, p.contenido, p.etiquetas, p.fecha_creacion, p.imagen, du.nombre_empresa, u.nombre, du.categoria
-            """, (current_user if current_user else -1, post_id))
+            cur.execute(SQL_PUBLICACIONES + " WHERE p.id = %s", (current_user if current_user else -1, post_id))
             row = cur.fetchone()
             cur.close()
             if not row: raise HTTPException(status_code=404, detail="No encontrado")
 
-            return {
-                "id": row[0], "user_id": int(row[1]), "contenido": row[2] or "",
-                "imagenes": [f"/media/imagen/{img_id}" for img_id in row[7] if img_id is not None] if row[7] else [], 
-                "imagen_url": f"/media/imagen_vieja/{row[0]}" if row[12] else (f"/media/imagen/{row[7][0]}" if row[7] and row[7][0] is not None else ""),
-                "video_url": f"/media/{row[0]}" if row[8] else "",
-                "etiquetas": row[3] or [], "fecha_creacion": row[4].strftime("%Y-%m-%d %H:%M:%S"),
-                "foto_perfil_url": f"/foto_perfil/{row[1]}" if row[6] == 'emprendedor' else "",
-                "nombre_empresa": row[5], "tipo_usuario": row[6],
-                "interesados_count": int(row[9]), "interesado": row[10], "comentarios_count": int(row[11])
-            }
+            return _fila_a_publicacion(row)
         finally:
             if conn: conn.close()
     except Exception as e:
@@ -978,7 +920,7 @@ async def get_publicacion(post_id: int, request: Request):
 # =================================================================
 
 @router.get("/user/{user_id}")
-async def get_user(user_id: int):
+def get_user(user_id: int):
     conn = None
     try:
         conn = get_db_connection()
@@ -986,7 +928,7 @@ async def get_user(user_id: int):
         cur.execute("""
             SELECT u.id, 
                 CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                COALESCE(du.nombre_empresa, u.nombre), u.email, du.foto, du.direccion, du.ubicacion_google_maps,
+                COALESCE(du.nombre_empresa, u.nombre), u.email, (du.foto_key IS NOT NULL OR du.foto IS NOT NULL), du.direccion, du.ubicacion_google_maps,
                 du.telefono, du.horario, du.categoria, du.otra_categoria, du.servicios, du.sitio_web
             FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
         """, (user_id,))
@@ -1008,14 +950,15 @@ async def get_user(user_id: int):
         if conn: conn.close()
 
 @router.get("/publicacion/{post_id}/comentarios")
-async def list_comments(post_id: int, limit: int = 50, offset: int = 0):
+def list_comments(post_id: int, limit: int = 50, offset: int = 0):
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         
-        cur.execute("SELECT COUNT(*) FROM comentarios WHERE publicacion_id = %s", (post_id,))
-        total = cur.fetchone()[0]
+        cur.execute("SELECT comentarios_count FROM publicaciones WHERE id = %s", (post_id,))
+        fila = cur.fetchone()
+        total = fila[0] if fila else 0
 
         cur.execute("""
             SELECT 
@@ -1063,9 +1006,43 @@ async def list_comments(post_id: int, limit: int = 50, offset: int = 0):
     finally:
         if conn: conn.close()
 
+def _guardar_comentario(post_id: int, user_id: int, contenido: str, parent_id: int | None, reply_to_user_id: int | None):
+    """Inserta el comentario y devuelve (fila, autor del comentario padre, datos del autor)."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO comentarios (publicacion_id, user_id, contenido, parent_id, reply_to_user_id, fecha_creacion)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            RETURNING id, publicacion_id, user_id, contenido, fecha_creacion
+        """, (post_id, user_id, contenido, parent_id, reply_to_user_id))
+        
+        comment_data = cur.fetchone()
+        conn.commit()
+
+        parent_user_id = None
+        if not reply_to_user_id and parent_id:
+            cur.execute("SELECT user_id FROM comentarios WHERE id = %s", (parent_id,))
+            parent_row = cur.fetchone()
+            parent_user_id = parent_row[0] if parent_row else None
+
+        cur.execute("""
+            SELECT COALESCE(du.nombre_empresa, u.nombre), 
+                   CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
+                   CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN %s || %s ELSE '' END
+            FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
+        """, ("/foto_perfil/", user_id, user_id))
+        user_info = cur.fetchone()
+        cur.close()
+        return comment_data, parent_user_id, user_info
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
 @router.post("/publicacion/{post_id}/comentar")
 async def post_comment(post_id: int, request: CommentRequest, http_request: Request):
-    conn = None
     try:
         user_id = get_user_id_hybrid(http_request)
         if not user_id: raise HTTPException(status_code=401, detail="Login requerido")
@@ -1073,18 +1050,10 @@ async def post_comment(post_id: int, request: CommentRequest, http_request: Requ
         contenido = request.contenido.strip()
         if not contenido: raise HTTPException(status_code=400, detail="Contenido vacío")
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO comentarios (publicacion_id, user_id, contenido, parent_id, reply_to_user_id, fecha_creacion)
-            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-            RETURNING id, publicacion_id, user_id, contenido, fecha_creacion
-        """, (post_id, user_id, contenido, request.parent_id, request.reply_to_user_id))
-        
-        comment_data = cur.fetchone()
+        comment_data, parent_user_id, user_info = await run_db(
+            _guardar_comentario, post_id, user_id, contenido, request.parent_id, request.reply_to_user_id
+        )
         new_comment_id = comment_data[0]
-        conn.commit()
 
         if request.reply_to_user_id:
             await crear_notificacion(
@@ -1096,15 +1065,13 @@ async def post_comment(post_id: int, request: CommentRequest, http_request: Requ
                 comentario_id=new_comment_id
             )
         elif request.parent_id:
-            cur.execute("SELECT user_id FROM comentarios WHERE id = %s", (request.parent_id,))
-            parent_row = cur.fetchone()
-            if parent_row:
+            if parent_user_id:
                 await crear_notificacion(
                     publicacion_id=post_id,
                     tipo="respuesta",
                     actor_id=user_id,
                     mensaje=contenido,
-                    target_user_id=parent_row[0],
+                    target_user_id=parent_user_id,
                     comentario_id=new_comment_id
                 )
         else:
@@ -1117,15 +1084,6 @@ async def post_comment(post_id: int, request: CommentRequest, http_request: Requ
                 comentario_id=new_comment_id
             )
 
-        cur.execute("""
-            SELECT COALESCE(du.nombre_empresa, u.nombre), 
-                   CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                   CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN %s || %s ELSE '' END
-            FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
-        """, ("/foto_perfil/", user_id, user_id))
-        user_info = cur.fetchone()
-        cur.close()
-
         return {
             "id": new_comment_id,
             "publicacion_id": post_id,
@@ -1140,20 +1098,13 @@ async def post_comment(post_id: int, request: CommentRequest, http_request: Requ
         }
 
     except Exception as e:
-        if conn: conn.rollback()
         logging.error(f"Error al comentar: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn: conn.close()
 
-@router.post("/publicacion/{post_id}/interesar")
-async def toggle_interest(post_id: int, request: InterestRequest, http_request: Request):
-    conn = None
+def _alternar_interes(post_id: int, user_id: int):
+    """Agrega o quita el interés del usuario. Devuelve (interesados_count, interesado, fue_agregado)."""
+    conn = get_db_connection()
     try:
-        user_id = get_user_id_hybrid(http_request)
-        if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
-
-        conn = get_db_connection()
         cur = conn.cursor()
         
         cur.execute("SELECT id FROM publicaciones WHERE id = %s", (post_id,))
@@ -1166,31 +1117,44 @@ async def toggle_interest(post_id: int, request: InterestRequest, http_request:
             cur.execute("DELETE FROM intereses WHERE publicacion_id = %s AND user_id = %s", (post_id, user_id))
         else:
             cur.execute("INSERT INTO intereses (publicacion_id, user_id, fecha_creacion) VALUES (%s, %s, CURRENT_TIMESTAMP)", (post_id, user_id))
-            await crear_notificacion(
-                publicacion_id=post_id,
-                tipo="interes",
-                actor_id=user_id,
-                mensaje="Le interesa tu publicación"
-            )
 
         conn.commit()
         
-        cur.execute("SELECT COUNT(*) FROM intereses WHERE publicacion_id = %s", (post_id,))
-        interesados_count = cur.fetchone()[0]
+        cur.execute("SELECT interesados_count FROM publicaciones WHERE id = %s", (post_id,))
+        fila = cur.fetchone()
+        interesados_count = fila[0] if fila else 0
         cur.execute("SELECT EXISTS (SELECT 1 FROM intereses WHERE publicacion_id = %s AND user_id = %s)", (post_id, user_id))
         interesado = cur.fetchone()[0]
         cur.close()
+        return interesados_count, interesado, not existing_interest
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@router.post("/publicacion/{post_id}/interesar")
+async def toggle_interest(post_id: int, request: InterestRequest, http_request: Request):
+    try:
+        user_id = get_user_id_hybrid(http_request)
+        if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
+
+        interesados_count, interesado, agregado = await run_db(_alternar_interes, post_id, user_id)
+        if agregado:
+            await crear_notificacion(
+                publicacion_id=post_id,
+                tipo="interes",
+                actor_id=user_id,
+                mensaje="Le interesa tu publicación"
+            )
 
         return {"interesados_count": interesados_count, "interesado": interesado}
     except Exception as e:
-        if conn: conn.rollback()
         logging.error(f"Error like: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn: conn.close()
 
 @router.delete("/borrar_comentario/{comentario_id}")
-async def borrar_comentario(comentario_id: int, request: Request):
+def borrar_comentario(comentario_id: int, request: Request):
     conn = None
     try:
         user_id = get_user_id_hybrid(request)
@@ -1215,7 +1179,7 @@ async def borrar_comentario(comentario_id: int, request: Request):
         if conn: conn.close()
 
 @router.get("/api/perfil/{perfil_id}/resenas")
-async def get_user_resenas(perfil_id: int, request: Request, limit: int = 10, offset: int = 0):
+def get_user_resenas(perfil_id: int, request: Request, limit: int = 10, offset: int = 0):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -1226,7 +1190,7 @@ async def get_user_resenas(perfil_id: int, request: Request, limit: int = 10, of
             SELECT r.id, r.user_id, r.perfil_id, r.texto, r.calificacion, r.fecha_creacion,
                    COALESCE(du.nombre_empresa, u.nombre),
                    CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                   du.foto
+                   (du.foto_key IS NOT NULL OR du.foto IS NOT NULL)
             FROM resenas r JOIN usuarios u ON r.user_id = u.id LEFT JOIN datos_usuario du ON r.user_id = du.user_id
             WHERE r.perfil_id = %s ORDER BY r.fecha_creacion DESC LIMIT %s OFFSET %s
         """, (perfil_id, limit, offset))
@@ -1246,7 +1210,7 @@ async def get_user_resenas(perfil_id: int, request: Request, limit: int = 10, of
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/api/perfil/{perfil_id}/resenas")
-async def create_review(perfil_id: int, request: ReviewRequest, http_request: Request):
+def create_review(perfil_id: int, request: ReviewRequest, http_request: Request):
     conn = None
     try:
         user_id = get_user_id_hybrid(http_request)
@@ -1265,7 +1229,7 @@ async def create_review(perfil_id: int, request: ReviewRequest, http_request: Re
         cur.execute("""
             SELECT COALESCE(du.nombre_empresa, u.nombre), 
                    CASE WHEN du.categoria IS NOT NULL AND du.categoria != '' THEN 'emprendedor' ELSE 'explorador' END,
-                   du.foto
+                   (du.foto_key IS NOT NULL OR du.foto IS NOT NULL)
             FROM usuarios u LEFT JOIN datos_usuario du ON u.id = du.user_id WHERE u.id = %s
         """, (user_id,))
         autor = cur.fetchone()
@@ -1284,7 +1248,7 @@ async def create_review(perfil_id: int, request: ReviewRequest, http_request: Re
         if conn: conn.close()
 
 @router.delete("/api/perfil/{perfil_id}/resenas/{resena_id}")
-async def delete_review(perfil_id: int, resena_id: int, request: Request):
+def delete_review(perfil_id: int, resena_id: int, request: Request):
     conn = None
     try:
         user_id = get_user_id_hybrid(request)
@@ -1307,8 +1271,14 @@ async def delete_review(perfil_id: int, resena_id: int, request: Request):
     finally:
         if conn: conn.close()
 
+def _contadores_notificaciones(cur, user_id: int):
+    """(total, no_leidas) del usuario; notificaciones_contadores lo mantiene al día por trigger."""
+    cur.execute("SELECT total, no_leidas FROM notificaciones_contadores WHERE user_id = %s", (user_id,))
+    fila = cur.fetchone()
+    return (fila[0], fila[1]) if fila else (0, 0)
+
 @router.get("/notificaciones")
-async def obtener_notificaciones(request: Request, limit: int = 10, offset: int = 0):
+def obtener_notificaciones(request: Request, limit: int = 10, offset: int = 0):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
@@ -1330,10 +1300,7 @@ async def obtener_notificaciones(request: Request, limit: int = 10, offset: int
             """, ("/foto_perfil/", user_id, limit, offset))
             notificaciones = cur.fetchall()
 
-            cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = %s", (user_id,))
-            total = cur.fetchone()[0]
-            cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = %s AND leida = FALSE", (user_id,))
-            no_leidas = cur.fetchone()[0]
+            total, no_leidas = _contadores_notificaciones(cur, user_id)
 
             return {
                 "notificaciones": [
@@ -1354,7 +1321,7 @@ async def obtener_notificaciones(request: Request, limit: int = 10, offset: int
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/notificaciones/{notificacion_id}/leida")
-async def marcar_notificacion_leida(notificacion_id: int, request: Request):
+def marcar_notificacion_leida(notificacion_id: int, request: Request):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
@@ -1369,15 +1336,34 @@ async def marcar_notificacion_leida(notificacion_id: int, request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/notificaciones/marcar_todas_leidas")
+def marcar_todas_notificaciones_leidas(request: Request):
+    try:
+        user_id = get_user_id_hybrid(request)
+        if not user_id: raise HTTPException(status_code=401, detail="No autorizado")
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # Una sola sentencia: el trigger pone el contador del usuario en cero de una vez
+        cur.execute("UPDATE notifications SET leida = TRUE WHERE user_id = %s AND leida = FALSE", (user_id,))
+        marcadas = cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        return {"message": "Todas leídas", "marcadas": marcadas}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/notificaciones/no_leidas")
-async def contar_notificaciones_no_leidas(request: Request):
+def contar_notificaciones_no_leidas(request: Request):
     try:
         user_id = get_user_id_hybrid(request)
         if not user_id: return {"no_leidas": 0}
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM notifications WHERE user_id = %s AND leida = FALSE", (user_id,))
-        no_leidas = cur.fetchone()[0]
+        no_leidas = _contadores_notificaciones(cur, user_id)[1]
         cur.close()
         conn.close()
         return {"no_leidas": no_leidas}
@@ -1386,18 +1372,20 @@ async def contar_notificaciones_no_leidas(request: Request):
 
 @router.websocket("/notificaciones/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await notification_manager.connect(websocket, user_id)
+    await websocket.accept()
+    conexion = hub_notificaciones.registrar(websocket, user_id)
     try:
         while True:
-            await websocket.receive_text()
+            conexion.recibido(await websocket.receive_text())
     except WebSocketDisconnect:
-        notification_manager.disconnect(websocket, user_id)
+        pass
     except Exception as e:
         logging.error(f"Error en WS notificaciones: {e}")
-        notification_manager.disconnect(websocket, user_id)
+    finally:
+        await hub_notificaciones.desconectar(conexion)
 
 @router.post("/api/reportar/usuario")
-async def reportar_usuario(request: Request, reporte: ReporteUsuarioRequest):
+def reportar_usuario(request: Request, reporte: ReporteUsuarioRequest):
     conn = None
     try:
         user_id = get_user_id_hybrid(request)
@@ -1424,7 +1412,7 @@ async def reportar_usuario(request: Request, reporte: ReporteUsuarioRequest):
         if conn: conn.close()
 
 @router.post("/api/bloquear/usuario")
-async def bloquear_usuario(request: Request, bloqueo: BloqueoRequest):
+def bloquear_usuario(request: Request, bloqueo: BloqueoRequest):
     conn = None
     try:
         user_id = get_user_id_hybrid(request)
@@ -1441,7 +1429,9 @@ async def bloquear_usuario(request: Request, bloqueo: BloqueoRequest):
             VALUES (%s, %s)
             ON CONFLICT (bloqueador_id, bloqueado_id) DO NOTHING
         """, (user_id, bloqueo.bloqueado_id))
+        bloqueos.notificar_cambio(cur, user_id, bloqueo.bloqueado_id)
         conn.commit()
+        bloqueos.invalidar(user_id, bloqueo.bloqueado_id)
 
         return JSONResponse({"status": "ok", "message": "Usuario bloqueado. No verás su contenido."})
     except Exception as e:
@@ -1452,7 +1442,7 @@ async def bloquear_usuario(request: Request, bloqueo: BloqueoRequest):
         if conn: conn.close()
 
 @router.delete("/api/usuario/eliminar")
-async def eliminar_cuenta(request: Request):
+def eliminar_cuenta(request: Request):
     conn = None
     try:
         user_id = get_user_id_hybrid(request) 
@@ -1482,7 +1472,7 @@ async def eliminar_cuenta(request: Request):
 # =================================================================
 
 @router.get("/post/{post_id}", response_class=HTMLResponse)
-async def ver_publicacion_web(post_id: int):
+def ver_publicacion_web(post_id: int):
     conn = None
     try:
         conn = get_db_connection()
@@ -1492,8 +1482,8 @@ async def ver_publicacion_web(post_id: int):
         cur.execute("""
             SELECT p.contenido, COALESCE(du.nombre_empresa, u.nombre), p.fecha_creacion,
                    (SELECT array_agg(id) FROM publicacion_imagenes WHERE publicacion_id = p.id) AS imagenes_ids,
-                   p.video IS NOT NULL AS has_video,
-                   p.imagen IS NOT NULL AS has_old_image
+                   (p.video_key IS NOT NULL OR p.video IS NOT NULL) AS has_video,
+                   (p.imagen_key IS NOT NULL OR p.imagen IS NOT NULL) AS has_old_image
             FROM publicaciones p
             JOIN usuarios u ON p.user_id = u.id
             LEFT JOIN datos_usuario du ON u.id = du.user_id
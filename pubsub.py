@@ -0,0 +1,184 @@
+# pubsub.py
+# Puente entre workers de uvicorn con LISTEN/NOTIFY de Postgres (sin broker externo).
+#
+# Un solo hilo por proceso escucha todos los canales suscritos con una conexión propia:
+#   suscribir(canal, callback, al_reconectar)  -> callback(payload) corre en el hilo de escucha
+#   notificar(cur, canal, payload)             -> NOTIFY dentro de la transacción del que llama
+#
+# Encima va la entrega de WebSockets: chats.py y publicaciones.py guardan sus sockets en dicts por
+# proceso, así que con varios workers el receptor puede estar conectado a otro. publicar_ws() entrega
+# a los sockets locales de inmediato y publica el evento en CANAL_WS; cada uno de los demás workers lo
+# recibe y lo reenvía a sus propios sockets. El worker de origen ignora su propio eco (ORIGEN).
+import asyncio
+import json
+import logging
+import os
+import select
+import socket
+import threading
+
+import psycopg2
+
+from database import DB_CONFIG, get_db_connection, run_db
+
+CANAL_WS = "ws_eventos"
+WS_PUBSUB = os.getenv("WS_PUBSUB", "1") == "1"  # 0 = un solo worker, no hace falta publicar
+# NOTIFY acepta hasta 8000 bytes; los eventos más grandes (mensajes largos) viajan por ws_eventos_grandes
+LIMITE_NOTIFY = 7900
+ORIGEN = f"{socket.gethostname()}:{os.getpid()}"
+
+_suscripciones = {}  # canal -> [(callback, al_reconectar)]
+_escuchando = set()  # canales con LISTEN en la conexión actual
+_lock = threading.Lock()
+_detener = threading.Event()
+_hilo = None
+
+_loop = None
+_destinos = {}  # "chat" / "notificaciones" -> async fn(user_id, mensaje) que entrega a los sockets locales
+
+
+def suscribir(canal: str, callback, al_reconectar=None):
+    """
+    `callback(payload)` corre en el hilo de escucha: no debe bloquear mucho. `al_reconectar()` se llama
+    cuando se cae la conexión, porque mientras tanto se pudieron perder avisos.
+    """
+    with _lock:
+        _suscripciones.setdefault(canal, []).append((callback, al_reconectar))
+
+
+def notificar(cur, canal: str, payload: str):
+    """Postgres entrega el NOTIFY solo si la transacción hace commit."""
+    cur.execute("SELECT pg_notify(%s, %s)", (canal, payload))
+
+
+def _despachar(canal: str, payload: str):
+    with _lock:
+        callbacks = [callback for callback, _ in _suscripciones.get(canal, [])]
+    for callback in callbacks:
+        try:
+            callback(payload)
+        except Exception as e:
+            logging.error(f"Error procesando aviso de {canal}: {e}")
+
+
+def _avisar_reconexion():
+    with _lock:
+        callbacks = [al_reconectar for subs in _suscripciones.values() for _, al_reconectar in subs if al_reconectar]
+    for al_reconectar in callbacks:
+        try:
+            al_reconectar()
+        except Exception as e:
+            logging.error(f"Error al reconectar pubsub: {e}")
+
+
+def _escuchar():
+    while not _detener.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            conn.autocommit = True
+            cur = conn.cursor()
+            _escuchando.clear()
+            while not _detener.is_set():
+                # Canales suscritos después de arrancar el hilo
+                with _lock:
+                    nuevos = set(_suscripciones) - _escuchando
+                for canal in nuevos:
+                    cur.execute(f'LISTEN "{canal}"')
+                    _escuchando.add(canal)
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    aviso = conn.notifies.pop(0)
+                    _despachar(aviso.channel, aviso.payload)
+        except Exception as e:
+            logging.error(f"⚠️ Escucha de LISTEN/NOTIFY caída, reconectando: {e}")
+            _avisar_reconexion()
+            _detener.wait(5)
+        finally:
+            if conn is not None and not conn.closed:
+                conn.close()
+
+
+def iniciar(loop=None):
+    """Arranca el hilo de escucha. `loop` es el event loop donde se entregan los eventos de WebSocket."""
+    global _hilo, _loop
+    if loop is not None:
+        _loop = loop
+    if _hilo and _hilo.is_alive():
+        return
+    _detener.clear()
+    _hilo = threading.Thread(target=_escuchar, name="pubsub", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    _detener.set()
+
+
+# --- Eventos de WebSocket entre workers ---
+
+def registrar_destino(destino: str, entregar):
+    """`entregar(user_id, mensaje)` es una corrutina que manda a los sockets de este proceso."""
+    _destinos[destino] = entregar
+
+
+def _notificar_ws(evento: dict):
+    texto = json.dumps(evento, ensure_ascii=False)
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        if len(texto.encode("utf-8")) > LIMITE_NOTIFY:
+            cur.execute("DELETE FROM ws_eventos_grandes WHERE creado_en < NOW() - INTERVAL '10 minutes'")
+            cur.execute("INSERT INTO ws_eventos_grandes (payload) VALUES (%s) RETURNING id", (texto,))
+            texto = json.dumps({"origen": ORIGEN, "grande": cur.fetchone()[0]})
+        notificar(cur, CANAL_WS, texto)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _leer_evento_grande(evento_id: int):
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT payload FROM ws_eventos_grandes WHERE id = %s", (evento_id,))
+        fila = cur.fetchone()
+        cur.close()
+        return json.loads(fila[0]) if fila else None
+    finally:
+        conn.close()
+
+
+async def publicar_ws(destino: str, user_id: int, mensaje: dict):
+    """Entrega `mensaje` a los sockets de `user_id` en este worker y en todos los demás."""
+    await _destinos[destino](user_id, mensaje)
+    if not WS_PUBSUB:
+        return
+    try:
+        await run_db(_notificar_ws, {"origen": ORIGEN, "destino": destino, "user_id": user_id, "mensaje": mensaje})
+    except Exception as e:
+        # El mensaje ya quedó guardado; los clientes de otros workers lo verán al recargar
+        logging.error(f"No se pudo publicar el evento WS {destino} para {user_id}: {e}")
+
+
+def _al_evento_ws(payload: str):
+    evento = json.loads(payload)
+    if evento.get("origen") == ORIGEN:
+        return  # ya se entregó localmente en publicar_ws
+    if "grande" in evento:
+        evento = _leer_evento_grande(evento["grande"])
+        if evento is None:
+            return
+    entregar = _destinos.get(evento["destino"])
+    if entregar is None or _loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(entregar(evento["user_id"], evento["mensaje"]), _loop)
+
+
+suscribir(CANAL_WS, _al_evento_ws)
@@ -0,0 +1,32 @@
+# push_outbox.py
+# Los pushes ya no se mandan desde la petición: se escriben en push_outbox dentro de la misma
+# transacción que el mensaje / la notificación / la publicación, y push_worker.py los entrega.
+# Si la transacción hace rollback no queda push huérfano; si FCM falla, el worker reintenta.
+#
+# Tipos de fila:
+#   'directo'  -> un usuario (user_id); el token y el badge se resuelven al momento de enviar
+#   'difusion' -> todos los usuarios con app menos excluir_user_id (nuevas publicaciones)
+import json
+
+CANAL_OUTBOX = "push_outbox"
+# Va en el mismo execute que el INSERT (una sola ida a la base). Llega al worker solo si la transacción
+# hace commit; si no, el worker igual revisa cada pocos segundos
+DESPERTAR_WORKER = f"NOTIFY {CANAL_OUTBOX}"
+
+
+def encolar_push(cur, user_id: int, titulo: str, cuerpo: str, data: dict = None, badge: bool = False):
+    """`badge=True` manda en iOS el número de notificaciones sin leer al momento del envío."""
+    cur.execute(f"""
+        INSERT INTO push_outbox (tipo, user_id, titulo, cuerpo, data, badge)
+        VALUES ('directo', %s, %s, %s, %s::jsonb, %s);
+        {DESPERTAR_WORKER}
+    """, (user_id, titulo, cuerpo, json.dumps(data or {}), badge))
+
+
+def encolar_difusion(cur, titulo: str, cuerpo: str, data: dict = None, excluir_user_id: int = None):
+    cur.execute(f"""
+        INSERT INTO push_outbox (tipo, excluir_user_id, titulo, cuerpo, data)
+        VALUES ('difusion', %s, %s, %s, %s::jsonb);
+        {DESPERTAR_WORKER}
+    """, (excluir_user_id, titulo, cuerpo, json.dumps(data or {})))
+
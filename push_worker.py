@@ -0,0 +1,307 @@
+# push_worker.py
+# Proceso aparte (no corre dentro de uvicorn) que vacía push_outbox y entrega los pushes por FCM.
+#
+# Uso:
+#   python push_worker.py                        -> corre para siempre
+#   python push_worker.py --stub                 -> FCM simulado, para desarrollo local
+#   python push_worker.py --stub --fallas 0.2    -> simula un 20% de errores para ver los reintentos
+#   python push_worker.py --una-vez              -> entrega lo pendiente y termina (cron, pruebas)
+#
+# Toma filas en lotes con FOR UPDATE SKIP LOCKED, así se pueden correr varios workers a la vez.
+# Cada fila tomada queda "arrendada" ARRIENDO_SEGUNDOS: si el worker muere a la mitad, otro la retoma.
+# Los errores transitorios de FCM se reintentan con backoff exponencial (con jitter) hasta PUSH_MAX_INTENTOS;
+# los definitivos (token no registrado, argumento inválido) marcan la fila como 'fallido' de inmediato.
+# Estados: pendiente -> enviado | fallido | descartado (el usuario no tiene token).
+# Los tokens que FCM reporta como muertos se ponen en NULL en usuarios (podar_tokens) en la misma vuelta.
+# Cada DESPERTADOR_INTERVALO segundos corre también el algoritmo despertador (mantenimiento.despertar_inactivos)
+# en un hilo aparte con su propia conexión, para que la entrega del outbox no se detenga mientras tanto.
+# No corre con --stub ni con --una-vez.
+import argparse
+import logging
+import os
+import random
+import select
+import signal
+import threading
+import time
+
+import firebase_admin
+import psycopg2
+from firebase_admin import credentials
+
+import mantenimiento
+import notificaciones_push
+from database import DB_CONFIG
+from limitador import LimitadorTasa
+from push_outbox import CANAL_OUTBOX
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+PUSH_LOTE = int(os.getenv("PUSH_LOTE", "100"))
+PUSH_TASA = float(os.getenv("PUSH_TASA", "500"))  # pushes por segundo
+PUSH_MAX_INTENTOS = int(os.getenv("PUSH_MAX_INTENTOS", "8"))
+PUSH_ESPERA = float(os.getenv("PUSH_ESPERA", "5"))  # segundos entre revisiones si no llega ningún NOTIFY
+DESPERTADOR_INTERVALO = float(os.getenv("DESPERTADOR_INTERVALO", "900"))  # 0 = no lo corre este worker
+ARRIENDO_SEGUNDOS = 600  # una difusión lo renueva entre lotes mientras dura (renovar_arriendo)
+BACKOFF_BASE = 5
+BACKOFF_MAX = 3600
+
+_detener = False
+_parar_despertador = threading.Event()
+_podar = True  # con --stub los "tokens muertos" son inventados: no se tocan los de verdad
+
+
+def _pedir_salida(signum, frame):
+    global _detener
+    _detener = True
+    _parar_despertador.set()
+    logging.info("Señal recibida, el worker termina al acabar el lote actual")
+
+
+def conectar(autocommit=False):
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = autocommit
+    return conn
+
+
+def backoff(intentos: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (intentos - 1)) * random.uniform(0.8, 1.2)
+
+
+def reclamar(conn, lote: int) -> list:
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE push_outbox o
+        SET intentos = o.intentos + 1, siguiente_intento = NOW() + %s * INTERVAL '1 second'
+        FROM (
+            SELECT id FROM push_outbox
+            WHERE estado = 'pendiente' AND siguiente_intento <= NOW()
+            ORDER BY siguiente_intento, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) pendientes
+        WHERE o.id = pendientes.id
+        RETURNING o.id, o.tipo, o.user_id, o.excluir_user_id, o.titulo, o.cuerpo, o.data, o.badge, o.intentos
+    """, (ARRIENDO_SEGUNDOS, lote))
+    filas = cur.fetchall()
+    cur.close()
+    conn.commit()
+    return filas
+
+
+def registrar_resultados(conn, enviados: list, descartados: list, errores: list, tokens_muertos: list = ()) -> dict:
+    """errores: lista de (id, intentos, excepción). Devuelve cuántas filas quedaron en cada estado."""
+    cur = conn.cursor()
+    podados = 0
+    if tokens_muertos and _podar:
+        podados = notificaciones_push.podar_tokens(cur, list(tokens_muertos))
+    elif tokens_muertos:
+        logging.info(f"(simulado) se podarían {len(tokens_muertos)} tokens")
+    if enviados:
+        cur.execute("UPDATE push_outbox SET estado = 'enviado', enviado_en = NOW(), ultimo_error = NULL WHERE id = ANY(%s)", (enviados,))
+    if descartados:
+        cur.execute("UPDATE push_outbox SET estado = 'descartado', ultimo_error = 'sin fcm_token' WHERE id = ANY(%s)", (descartados,))
+
+    reintentos = fallidos = 0
+    for fila_id, intentos, error in errores:
+        detalle = f"{notificaciones_push.codigo_error(error)}: {error}"[:500]
+        if notificaciones_push.es_reintentable(error) and intentos < PUSH_MAX_INTENTOS:
+            cur.execute("""
+                UPDATE push_outbox SET siguiente_intento = NOW() + %s * INTERVAL '1 second', ultimo_error = %s
+                WHERE id = %s
+            """, (backoff(intentos), detalle, fila_id))
+            reintentos += 1
+        else:
+            cur.execute("UPDATE push_outbox SET estado = 'fallido', ultimo_error = %s WHERE id = %s", (detalle, fila_id))
+            fallidos += 1
+    conn.commit()
+    cur.close()
+    return {"enviados": len(enviados), "descartados": len(descartados), "reintentos": reintentos,
+            "fallidos": fallidos, "tokens_podados": podados}
+
+
+def procesar_directos(conn, filas: list, limitador) -> dict:
+    user_ids = list({fila[2] for fila in filas})
+    cur = conn.cursor()
+    cur.execute("SELECT id, fcm_token FROM usuarios WHERE id = ANY(%s) AND fcm_token IS NOT NULL", (user_ids,))
+    tokens = dict(cur.fetchall())
+    badges = {}
+    if any(fila[7] for fila in filas):
+        # Badge al momento del envío: lo que el usuario tiene sin leer ahora, no cuando se encoló
+        cur.execute("SELECT user_id, no_leidas FROM notificaciones_contadores WHERE user_id = ANY(%s)", (user_ids,))
+        badges = dict(cur.fetchall())
+    cur.close()
+    conn.commit()
+
+    con_token, descartados = [], []
+    for fila in filas:
+        (con_token if tokens.get(fila[2]) else descartados).append(fila)
+
+    mensajes = [
+        notificaciones_push.crear_mensaje(
+            tokens[fila[2]], fila[4], fila[5], fila[6], badge=int(badges.get(fila[2], 0)) if fila[7] else None
+        )
+        for fila in con_token
+    ]
+    resultados = notificaciones_push.enviar_mensajes(mensajes, limitador) if mensajes else []
+
+    enviados, errores, muertos = [], [], []
+    for fila, error in zip(con_token, resultados):
+        if error is None:
+            enviados.append(fila[0])
+        else:
+            errores.append((fila[0], fila[8], error))
+            if notificaciones_push.es_token_muerto(error):
+                muertos.append(tokens[fila[2]])
+    return registrar_resultados(conn, enviados, [fila[0] for fila in descartados], errores, muertos)
+
+
+def renovar_arriendo(conn, fila_id: int):
+    """Extiende el arriendo de una fila reclamada para que otro worker no la tome mientras se sigue enviando."""
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE push_outbox SET siguiente_intento = NOW() + %s * INTERVAL '1 second'
+            WHERE id = %s AND estado = 'pendiente'
+        """, (ARRIENDO_SEGUNDOS, fila_id))
+        cur.close()
+        conn.commit()
+    except psycopg2.Error as e:
+        # La difusión sigue: cortarla a medias es peor que arriesgar un duplicado si el arriendo vence
+        logging.warning(f"No se pudo renovar el arriendo de la difusión {fila_id}: {e}")
+        if not conn.closed:
+            conn.rollback()
+
+
+def procesar_difusion(conn, fila, limitador, concurrencia: int) -> dict:
+    fila_id, _, _, excluir_user_id, titulo, cuerpo, data, _, intentos = fila
+    cur = conn.cursor()
+    cur.execute("SELECT fcm_token FROM usuarios WHERE fcm_token IS NOT NULL AND id IS DISTINCT FROM %s", (excluir_user_id,))
+    tokens = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.commit()
+
+    # Una difusión grande puede tardar más que ARRIENDO_SEGUNDOS (300k tokens a 500/s = 10 min): el arriendo
+    # se renueva entre lotes, a lo sumo cada tercio de su duración
+    renovado = time.monotonic()
+
+    def renovar(_metricas):
+        nonlocal renovado
+        if time.monotonic() - renovado >= ARRIENDO_SEGUNDOS / 3:
+            renovar_arriendo(conn, fila_id)
+            renovado = time.monotonic()
+
+    metricas = notificaciones_push.enviar_difusion(
+        tokens, titulo, cuerpo, data, concurrencia, limitador, al_terminar_lote=renovar
+    )
+
+    # Se reintenta solo si todos los lotes fallaron completos (red, credenciales): reintentar una
+    # difusión a medias duplicaría el push a quienes ya lo recibieron
+    if metricas["tokens"] and metricas["exitos"] == 0 and not metricas["tokens_fallidos"]:
+        error = RuntimeError(f"difusión sin envíos: {dict(metricas['errores'])}")
+        return registrar_resultados(conn, [], [], [(fila_id, intentos, error)])
+    return registrar_resultados(conn, [fila_id], [], [], metricas["tokens_muertos"])
+
+
+def procesar_lote(conn, filas: list, limitador, concurrencia: int) -> dict:
+    totales = {"enviados": 0, "descartados": 0, "reintentos": 0, "fallidos": 0, "tokens_podados": 0}
+    directos = [fila for fila in filas if fila[1] == "directo"]
+    partes = [procesar_directos(conn, directos, limitador)] if directos else []
+    for fila in filas:
+        if fila[1] == "difusion":
+            partes.append(procesar_difusion(conn, fila, limitador, concurrencia))
+    for parte in partes:
+        for clave, valor in parte.items():
+            totales[clave] += valor
+    return totales
+
+
+def correr_despertador():
+    try:
+        despertados = mantenimiento.despertar_inactivos()
+        if despertados:
+            logging.info(f"⏰ Despertador: {despertados} usuarios inactivos notificados")
+    except Exception as e:
+        # No debe tumbar el worker de push: se reintenta en el siguiente intervalo
+        logging.error(f"Error en el algoritmo despertador: {e}")
+
+
+def _ciclo_despertador():
+    while not _parar_despertador.is_set():
+        correr_despertador()
+        _parar_despertador.wait(DESPERTADOR_INTERVALO)
+
+
+def esperar_aviso(conn_aviso, segundos: float):
+    """Duerme hasta que llegue un NOTIFY push_outbox o pasen `segundos`."""
+    if select.select([conn_aviso], [], [], segundos) != ([], [], []):
+        conn_aviso.poll()
+        conn_aviso.notifies.clear()
+
+
+def correr(args):
+    global _podar
+    signal.signal(signal.SIGTERM, _pedir_salida)
+    signal.signal(signal.SIGINT, _pedir_salida)
+    if args.stub:
+        notificaciones_push.usar_fcm_simulado(tasa_fallas=args.fallas)
+        _podar = False
+    elif not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate("firebase_key.json"))
+    limitador = LimitadorTasa(args.tasa, rafaga=max(args.tasa, notificaciones_push.TAMANO_LOTE))
+
+    if DESPERTADOR_INTERVALO and not args.una_vez and not args.stub:
+        threading.Thread(target=_ciclo_despertador, name="despertador", daemon=True).start()
+
+    conn = conn_aviso = None
+    inicio = time.monotonic()
+    acumulado = podados = 0
+    while not _detener:
+        try:
+            if conn is None or conn.closed:
+                conn = conectar()
+                conn_aviso = conectar(autocommit=True)
+                conn_aviso.cursor().execute(f"LISTEN {CANAL_OUTBOX}")
+                logging.info(f"🚚 Worker de push listo (lote {args.lote}, {args.tasa} pushes/s)")
+
+            filas = reclamar(conn, args.lote)
+            if not filas:
+                if args.una_vez:
+                    break
+                esperar_aviso(conn_aviso, PUSH_ESPERA)
+                continue
+
+            t0 = time.perf_counter()
+            totales = procesar_lote(conn, filas, limitador, args.concurrencia)
+            acumulado += totales["enviados"]
+            podados += totales["tokens_podados"]
+            logging.info(
+                f"Outbox: {len(filas)} filas en {time.perf_counter() - t0:.2f}s -> {totales} "
+                f"| {acumulado} enviados y {podados} tokens podados en {time.monotonic() - inicio:.0f}s"
+            )
+        except psycopg2.Error as e:
+            # Las filas tomadas vuelven a estar disponibles cuando vence el arriendo
+            logging.error(f"⚠️ Error de base de datos en el worker de push, reconectando: {e}")
+            for c in (conn, conn_aviso):
+                if c is not None and not c.closed:
+                    c.close()
+            conn = conn_aviso = None
+            time.sleep(PUSH_ESPERA)
+
+    _parar_despertador.set()
+    for c in (conn, conn_aviso):
+        if c is not None and not c.closed:
+            c.close()
+    logging.info(f"Worker de push detenido ({acumulado} enviados, {podados} tokens podados)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrega los pushes encolados en push_outbox")
+    parser.add_argument("--lote", type=int, default=PUSH_LOTE, help="filas del outbox por vuelta")
+    parser.add_argument("--tasa", type=float, default=PUSH_TASA, help="máximo de pushes por segundo")
+    parser.add_argument("--concurrencia", type=int, default=notificaciones_push.PUSH_CONCURRENCIA,
+                        help="lotes multicast en paralelo en las difusiones")
+    parser.add_argument("--stub", action="store_true", help="no llama a Firebase (FCM simulado)")
+    parser.add_argument("--fallas", type=float, default=0.0, help="con --stub: fracción de envíos que fallan")
+    parser.add_argument("--una-vez", action="store_true", help="termina cuando ya no hay pendientes")
+    correr(parser.parse_args())
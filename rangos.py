@@ -0,0 +1,119 @@
+# rangos.py
+# Respuestas HTTP con soporte de Range (RFC 7233) que leen solo la ventana pedida
+# y la mandan en trozos de tamaño fijo. Los reproductores de iOS piden muchos rangos
+# pequeños; así cada petición cuesta lo que pide y no el archivo completo.
+#
+#   respuesta_archivo -> archivo en disco (media store local): seek + lecturas de CHUNK_ARCHIVO
+#   respuesta_bytea   -> filas viejas en Postgres: substring() por trozos de CHUNK_BYTEA
+import os
+import re
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from database import get_db_connection
+
+CHUNK_ARCHIVO = 256 * 1024
+CHUNK_BYTEA = 1024 * 1024
+
+_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangoInvalido(Exception):
+    """El rango pedido no se puede satisfacer (416)."""
+
+
+def parsear_rango(range_header: str, tamano: int):
+    """
+    Devuelve (inicio, fin) inclusivos, o None si no hay rango o no se entiende
+    (en ese caso se responde el archivo completo, como permite el RFC).
+    Lanza RangoInvalido si el rango cae fuera del archivo.
+    """
+    if not range_header:
+        return None
+    match = _RANGO.match(range_header.strip().replace(" ", ""))
+    if not match:
+        return None  # incluye múltiples rangos "bytes=0-1,5-6": se ignoran
+    inicio_txt, fin_txt = match.groups()
+
+    if not inicio_txt:
+        # Sufijo: "bytes=-500" son los últimos 500 bytes
+        if not fin_txt or int(fin_txt) == 0:
+            raise RangoInvalido()
+        sufijo = int(fin_txt)
+        return max(tamano - sufijo, 0), tamano - 1
+
+    inicio = int(inicio_txt)
+    fin = int(fin_txt) if fin_txt else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        raise RangoInvalido()
+    return inicio, min(fin, tamano - 1)
+
+
+def _responder(request: Request, tamano: int, media_type: str, filename: str, leer_ventana):
+    """leer_ventana(inicio, largo) debe ser un generador de bytes con exactamente `largo` bytes."""
+    headers = {"Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = f"inline; filename={filename}"
+
+    try:
+        rango = parsear_rango(request.headers.get("range"), tamano)
+    except RangoInvalido:
+        headers["Content-Range"] = f"bytes */{tamano}"
+        return Response(status_code=416, headers=headers)
+
+    if rango is None:
+        headers["Content-Length"] = str(tamano)
+        return StreamingResponse(leer_ventana(0, tamano), status_code=200, media_type=media_type, headers=headers)
+
+    inicio, fin = rango
+    largo = fin - inicio + 1
+    headers["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    headers["Content-Length"] = str(largo)
+    return StreamingResponse(leer_ventana(inicio, largo), status_code=206, media_type=media_type, headers=headers)
+
+
+def respuesta_archivo(request: Request, ruta: str, media_type: str, filename: str = None):
+    tamano = os.path.getsize(ruta)
+
+    def leer_ventana(inicio, largo):
+        with open(ruta, "rb") as f:
+            f.seek(inicio)
+            pendiente = largo
+            while pendiente > 0:
+                trozo = f.read(min(CHUNK_ARCHIVO, pendiente))
+                if not trozo:
+                    break
+                pendiente -= len(trozo)
+                yield trozo
+
+    return _responder(request, tamano, media_type, filename, leer_ventana)
+
+
+def respuesta_bytea(request: Request, tabla: str, columna: str, fila_id: int, tamano: int, media_type: str, filename: str = None):
+    """
+    Sirve un bytea sin traerlo completo: cada trozo es un substring() con su propia conexión del pool,
+    así un cliente lento no retiene una conexión mientras descarga.
+    `tamano` viene de octet_length() en la consulta que validó el acceso.
+    """
+    def leer_ventana(inicio, largo):
+        posicion = inicio
+        fin = inicio + largo
+        while posicion < fin:
+            cuanto = min(CHUNK_BYTEA, fin - posicion)
+            conn = get_db_connection()
+            try:
+                cur = conn.cursor()
+                # substring de SQL es 1-indexado
+                cur.execute(f"SELECT substring({columna} FROM %s FOR %s) FROM {tabla} WHERE id = %s", (posicion + 1, cuanto, fila_id))
+                row = cur.fetchone()
+                cur.close()
+            finally:
+                conn.close()
+            if not row or not row[0]:
+                break
+            trozo = bytes(row[0])
+            posicion += len(trozo)
+            yield trozo
+
+    return _responder(request, tamano, media_type, filename, leer_ventana)
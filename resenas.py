@@ -3,6 +3,7 @@ from pydantic import BaseModel
 import psycopg2
 from datetime import datetime
 import logging
+from database import get_db_connection
 
 router = APIRouter()
 
@@ -16,20 +17,6 @@ logging.basicConfig(
     ]
 )
 
-# Conexión a la base de datos
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="prendia_db",
-            user="postgres",
-            password="Elbicho7",
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Error al conectar a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
-
 # Modelo para la solicitud de reseña
 class ReviewRequest(BaseModel):
     texto: str
@@ -83,7 +70,7 @@ def get_current_user_id(authorization: str):
 
 # Ruta para listar reseñas de un perfil
 @router.get("/api/perfil/{perfil_id}/resenas")
-async def get_resenas(perfil_id: int, limit: int = 10, offset: int = 0, authorization: str = Header(None)):
+def get_resenas(perfil_id: int, limit: int = 10, offset: int = 0, authorization: str = Header(None)):
     
     # 🛑 ESTE PRINT ES LA PRUEBA DE QUE EL CÓDIGO SE ACTUALIZÓ
     print("\n🔥🔥🔥 ¡CÓDIGO NUEVO DE RESEÑAS EJECUTÁNDOSE! 🔥🔥🔥")
@@ -151,7 +138,7 @@ async def get_resenas(perfil_id: int, limit: int = 10, offset: int = 0, authoriz
 
 # Ruta para crear una reseña
 @router.post("/api/perfil/{perfil_id}/resenas")
-async def create_review(perfil_id: int, request: ReviewRequest, authorization: str = Header(None)):
+def create_review(perfil_id: int, request: ReviewRequest, authorization: str = Header(None)):
     
     # 1. Autenticación con Token
     user_id = get_current_user_id(authorization)
@@ -0,0 +1,229 @@
+# ws_hub.py
+# Registro único de WebSockets por usuario, para chats y notificaciones (un Hub por canal).
+#
+# - Un usuario puede tener varios sockets a la vez (celular + web + otra pestaña): todos reciben.
+# - Cada socket tiene su propia cola acotada (WS_COLA_MAX) y una tarea que la vacía. enviar() solo
+#   encola, así que un cliente lento no frena al que manda ni a los demás sockets.
+# - Si la cola de un socket se llena, ese cliente se está quedando atrás: se cierra (código 1013)
+#   y la app se reconecta y recarga lo que le faltó.
+# - Heartbeat en dos niveles:
+#   * Protocolo: uvicorn manda ping/pong de WebSocket a todos los sockets (--ws-ping-interval y
+#     --ws-ping-timeout en el Procfile, que suman WS_HEARTBEAT_TIMEOUT) y cierra los que no contestan,
+#     sin importar la versión del cliente.
+#   * Aplicación: los clientes que se anotan mandando "pong" (la web lo hace al abrir) reciben además
+#     {"type": "ping"} cada WS_HEARTBEAT_INTERVALO, y el barrido cierra los que llevan WS_HEARTBEAT_TIMEOUT
+#     sin mandar ningún frame. Las versiones viejas de la app nunca se anotan y no reciben ese JSON.
+# - estadisticas() expone usuarios y sockets conectados en este worker, ritmo de conexiones/desconexiones
+#   y duración de las conexiones (/api/admin/websockets).
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Set
+
+from fastapi import WebSocket
+
+WS_COLA_MAX = int(os.getenv("WS_COLA_MAX", "100"))
+WS_ENVIO_TIMEOUT = float(os.getenv("WS_ENVIO_TIMEOUT", "10"))  # segundos para que un send_text termine
+WS_HEARTBEAT_INTERVALO = float(os.getenv("WS_HEARTBEAT_INTERVALO", "25"))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "75"))
+VENTANA_RITMO = 60  # segundos para el ritmo de conexiones/desconexiones
+PING = json.dumps({"type": "ping"})
+
+
+class Conexion:
+    def __init__(self, hub: "Hub", websocket: WebSocket, user_id: int):
+        self.hub = hub
+        self.websocket = websocket
+        self.user_id = user_id
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=WS_COLA_MAX)
+        self.cerrada = False
+        self.conectada_en = time.monotonic()
+        self.ultima_actividad = self.conectada_en
+        self.responde_heartbeat = False
+        self._emisor = asyncio.create_task(self._vaciar_cola())
+
+    def recibido(self, texto: str) -> bool:
+        """Registrar cada frame que manda el cliente. True si era "pong": anota al cliente en el heartbeat."""
+        self.ultima_actividad = time.monotonic()
+        if texto == "pong":
+            self.responde_heartbeat = True
+            return True
+        return False
+
+    def vencida(self, ahora: float) -> bool:
+        return self.responde_heartbeat and ahora - self.ultima_actividad > WS_HEARTBEAT_TIMEOUT
+
+    async def _vaciar_cola(self):
+        try:
+            while True:
+                texto = await self.cola.get()
+                await asyncio.wait_for(self.websocket.send_text(texto), WS_ENVIO_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.debug(f"WS {self.hub.nombre}: envío a {self.user_id} falló, se cierra: {e}")
+            await self.cerrar(1011)
+
+    def encolar(self, texto: str) -> bool:
+        if self.cerrada:
+            return False
+        try:
+            self.cola.put_nowait(texto)
+            return True
+        except asyncio.QueueFull:
+            self.hub.lentas += 1
+            logging.warning(f"WS {self.hub.nombre}: usuario {self.user_id} no consume sus mensajes, se desconecta")
+            self._descartar()  # ya no recibe nada más, aunque el close tarde
+            asyncio.create_task(self._cerrar_socket(1013, "Cliente lento"))
+            return False
+
+    def _descartar(self):
+        self.cerrada = True
+        self.hub.quitar(self)
+        if asyncio.current_task() is not self._emisor:
+            self._emisor.cancel()
+
+    async def cerrar(self, codigo: int = 1000, razon: str = ""):
+        if self.cerrada:
+            return
+        self._descartar()
+        await self._cerrar_socket(codigo, razon)
+
+    async def _cerrar_socket(self, codigo: int, razon: str):
+        try:
+            await self.websocket.close(code=codigo, reason=razon)
+        except Exception:
+            pass  # ya estaba cerrado del lado del cliente
+
+
+class Hub:
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._conexiones: Dict[int, Set[Conexion]] = {}
+        self.enviados = 0
+        self.lentas = 0
+        self.vencidas = 0
+        self.conexiones_totales = 0
+        self.desconexiones_totales = 0
+        self._conexiones_recientes = deque()  # instantes de conexión en la última VENTANA_RITMO
+        self._desconexiones_recientes = deque()
+        self._duraciones = deque(maxlen=1000)  # segundos que duraron las últimas conexiones
+
+    def registrar(self, websocket: WebSocket, user_id: int) -> Conexion:
+        """Agrega un socket ya aceptado. Devuelve la Conexion para quitarla al desconectarse."""
+        conexion = Conexion(self, websocket, user_id)
+        self._conexiones.setdefault(user_id, set()).add(conexion)
+        self.conexiones_totales += 1
+        self._conexiones_recientes.append(conexion.conectada_en)
+        logging.debug(f"Usuario {user_id} conectado a WS {self.nombre} ({len(self._conexiones[user_id])} sockets)")
+        return conexion
+
+    def quitar(self, conexion: Conexion):
+        sockets = self._conexiones.get(conexion.user_id)
+        if sockets is None:
+            return
+        if conexion not in sockets:
+            return
+        sockets.discard(conexion)
+        if not sockets:
+            del self._conexiones[conexion.user_id]
+        ahora = time.monotonic()
+        self.desconexiones_totales += 1
+        self._desconexiones_recientes.append(ahora)
+        self._duraciones.append(ahora - conexion.conectada_en)
+        logging.debug(f"Usuario {conexion.user_id} desconectado de WS {self.nombre}")
+
+    async def desconectar(self, conexion: Conexion):
+        """Al salir del endpoint: saca el socket del hub y detiene su tarea de envío."""
+        await conexion.cerrar()
+
+    async def enviar(self, user_id: int, mensaje: dict) -> int:
+        """Encola el mensaje en todos los sockets del usuario en este worker. Devuelve en cuántos."""
+        sockets = self._conexiones.get(user_id)
+        if not sockets:
+            return 0
+        texto = json.dumps(mensaje)  # se serializa una vez para todos los sockets
+        encolados = sum(1 for conexion in list(sockets) if conexion.encolar(texto))
+        self.enviados += encolados
+        return encolados
+
+    def conectado(self, user_id: int) -> bool:
+        return bool(self._conexiones.get(user_id))
+
+    async def barrer(self) -> int:
+        """Cierra los sockets sin heartbeat y manda el ping a los que se anotaron. Devuelve cuántos cerró."""
+        ahora = time.monotonic()
+        cerradas = 0
+        for sockets in list(self._conexiones.values()):
+            for conexion in list(sockets):
+                if conexion.vencida(ahora) or conexion._emisor.done():
+                    self.vencidas += 1
+                    cerradas += 1
+                    await conexion.cerrar(1001, "Sin heartbeat")
+                elif conexion.responde_heartbeat:
+                    conexion.encolar(PING)
+        return cerradas
+
+    @staticmethod
+    def _por_minuto(instantes: deque, ahora: float) -> float:
+        while instantes and instantes[0] < ahora - VENTANA_RITMO:
+            instantes.popleft()
+        return round(len(instantes) * 60 / VENTANA_RITMO, 1)
+
+    def estadisticas(self) -> dict:
+        ahora = time.monotonic()
+        duraciones = sorted(self._duraciones)
+        return {
+            "usuarios": len(self._conexiones),
+            "sockets": sum(len(s) for s in self._conexiones.values()),
+            "mensajes_encolados": self.enviados,
+            "desconectados_por_lentos": self.lentas,
+            "cerrados_sin_heartbeat": self.vencidas,
+            "conexiones_totales": self.conexiones_totales,
+            "desconexiones_totales": self.desconexiones_totales,
+            "conexiones_por_minuto": self._por_minuto(self._conexiones_recientes, ahora),
+            "desconexiones_por_minuto": self._por_minuto(self._desconexiones_recientes, ahora),
+            "duracion_segundos": {
+                "p50": round(duraciones[len(duraciones) // 2], 1),
+                "p95": round(duraciones[min(len(duraciones) - 1, int(len(duraciones) * 0.95))], 1),
+                "max": round(duraciones[-1], 1),
+            } if duraciones else {},
+        }
+
+
+hub_chat = Hub("chat")
+hub_notificaciones = Hub("notificaciones")
+
+
+_barrido = None
+
+
+async def _barrer_siempre():
+    while True:
+        await asyncio.sleep(WS_HEARTBEAT_INTERVALO)
+        for hub in (hub_chat, hub_notificaciones):
+            try:
+                cerradas = await hub.barrer()
+                if cerradas:
+                    logging.info(f"WS {hub.nombre}: {cerradas} sockets sin heartbeat cerrados")
+            except Exception as e:
+                logging.error(f"Error en el barrido de WS {hub.nombre}: {e}")
+
+
+def iniciar_barrido():
+    """Llamar desde el startup (dentro del event loop)."""
+    global _barrido
+    if _barrido is None or _barrido.done():
+        _barrido = asyncio.create_task(_barrer_siempre())
+
+
+def detener_barrido():
+    if _barrido is not None:
+        _barrido.cancel()
+
+
+def estadisticas() -> dict:
+    return {"pid": os.getpid(), "chat": hub_chat.estadisticas(), "notificaciones": hub_notificaciones.estadisticas()}